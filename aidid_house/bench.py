@@ -0,0 +1,249 @@
+import argparse
+import glob
+import json
+import os
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from scrapy import Request
+from scrapy.downloadermiddlewares.httpcompression import HttpCompressionMiddleware
+from scrapy.responsetypes import responsetypes
+
+from aidid_house.embedded import embedded_state
+from aidid_house.warc import WarcArchive
+
+
+# -------------------------------------------------------------------
+# Offline parser benchmarks
+# -------------------------------------------------------------------
+# Feeds responses recorded with WARC_CAPTURE_DIR (see aidid_house.warc)
+# straight into the hot spider callbacks, without Scrapy's engine, and
+# reports per callback:
+#   items/sec, p50/p95/max parse time per response, allocated KiB per
+#   response (tracemalloc peak, measured in a separate pass)
+# Each run is written to .scrapy/bench/<timestamp>.json; --save-baseline
+# also stores it as the baseline that later runs are compared against:
+#   python -m aidid_house.bench --save-baseline
+#   python -m aidid_house.bench --compare       # exits 1 on a regression
+# The embedded.* pairs time the old selector/regex extraction of embedded
+# JSON against aidid_house.embedded on the same pages:
+#   python -m aidid_house.bench --only embedded.next_data.selector --only embedded.next_data.scan
+
+def _spiders():
+    from aidid_house.spiders.buy5168 import Buy5168Spider
+    from aidid_house.spiders.buyHB import BuyHBSpider
+    from aidid_house.spiders.buyRakuya import BuyrakuyaSpider
+    from aidid_house.spiders.buyXinyi import BuyxinyiSpider
+    from aidid_house.spiders.buyYungChing import BuyyongchingSpider
+    from aidid_house.spiders.rakuya_trades import RakuyaTradesSpider
+    return BuyxinyiSpider, Buy5168Spider, BuyHBSpider, BuyrakuyaSpider, BuyyongchingSpider, RakuyaTradesSpider
+
+
+def _merge_deal_data(spider, response):
+    data = json.loads(response.text)
+    return spider.merge_deal_data(data.get('dealList', []), data.get('formatDealList', []))
+
+
+# Embedded JSON extraction: full-DOM selectors and regexes over the page
+# text (as the spiders did) against one byte scan (aidid_house.embedded).
+def _next_data_selector(spider, response):
+    return [json.loads(response.xpath('//script[@id="__NEXT_DATA__"][@type="application/json"]/text()').get())]
+
+
+def _next_data_scan(spider, response):
+    return [embedded_state(response).script_json('__NEXT_DATA__')]
+
+
+def _sell_search_selector(spider, response):
+    return [json.loads(response.css('script::text').re_first(r'window\.sellSearch\s*=\s*(\{.*?\});'))]
+
+
+def _sell_search_scan(spider, response):
+    return [embedded_state(response).window_var('sellSearch')]
+
+
+def _rakuya_case_selector(spider, response):
+    layer = json.loads(response.css('script::text').re_first(r'window\.tmpDataLayer\s*=\s*(\{.*?\});') or '{}')
+    ld = re.search(r'<script type="application/ld\+json">(.+?)</script>', response.text, re.DOTALL)
+    return [layer, json.loads(ld.group(1)) if ld else None]
+
+
+def _rakuya_case_scan(spider, response):
+    state = embedded_state(response)
+    return [state.window_var('tmpDataLayer'), state.ld_json()]
+
+
+# name -> (spider class name, callback the fixtures were recorded for, function under test)
+BENCHMARKS = {
+    'buyXinyi.parse_case_page': ('BuyxinyiSpider', 'parse_case_page', None),
+    'buy5168.parse_case': ('Buy5168Spider', 'parse_case', None),
+    'buy5168.parse_case_api': ('Buy5168Spider', 'parse_case_api', None),
+    'buyHB.parse_case_page': ('BuyHBSpider', 'parse_case_page', None),
+    'buyRakuya.parse': ('BuyrakuyaSpider', 'parse', None),
+    'buyRakuya.parse_case': ('BuyrakuyaSpider', 'parse_case', None),
+    'buyYungChing.parse_case_page': ('BuyyongchingSpider', 'parse_case_page', None),
+    'rakuya_trades.parse_page_data': ('RakuyaTradesSpider', 'parse_page_data', None),
+    'rakuya_trades.merge_deal_data': ('RakuyaTradesSpider', 'parse_page_data', _merge_deal_data),
+    'embedded.next_data.selector': ('BuyxinyiSpider', 'parse_case_page', _next_data_selector),
+    'embedded.next_data.scan': ('BuyxinyiSpider', 'parse_case_page', _next_data_scan),
+    'embedded.sell_search.selector': ('BuyrakuyaSpider', 'parse', _sell_search_selector),
+    'embedded.sell_search.scan': ('BuyrakuyaSpider', 'parse', _sell_search_scan),
+    'embedded.rakuya_case.selector': ('BuyrakuyaSpider', 'parse_case', _rakuya_case_selector),
+    'embedded.rakuya_case.scan': ('BuyrakuyaSpider', 'parse_case', _rakuya_case_scan),
+}
+
+# Metrics checked by --compare, and whether higher is better. Throughput is
+# compared per response: parse_page_data yields requests, not items.
+COMPARED = {'responses_per_sec': True, 'p95_ms': False, 'alloc_kib_per_response': False}
+
+
+def load_fixtures(paths, spider_name, callback):
+    """Decompressed responses recorded for `spider_name`'s `callback`, with their request meta."""
+    decompress = HttpCompressionMiddleware()
+    fixtures = []
+    for path in paths:
+        archive = WarcArchive(path)
+        try:
+            for _, entry in archive.entries():
+                if entry.get('spider') != spider_name or entry.get('callback') != callback or entry['status'] != 200:
+                    continue
+                status, headers, body, url = archive.read(entry)
+                request = Request(url, method=entry.get('method', 'GET'), meta=entry.get('meta', {}))
+                respcls = responsetypes.from_args(headers=headers, url=url)
+                response = respcls(url=url, status=status, headers=headers, body=body, request=request)
+                fixtures.append(decompress.process_response(request, response, None))
+        finally:
+            archive.close()
+    return fixtures
+
+
+def _consume(fn, response):
+    items = requests = 0
+    for result in fn(response) or ():
+        if isinstance(result, Request):
+            requests += 1
+        else:
+            items += 1
+    return items, requests
+
+
+def run_benchmark(fn, fixtures, repeat):
+    # Parsed selectors are cached on the response, so every call gets a
+    # fresh copy: the timings include building the lxml tree.
+    timings, items, requests = [], 0, 0
+    for _ in range(repeat):
+        for fixture in fixtures:
+            response = fixture.replace()
+            started = time.perf_counter()
+            n_items, n_requests = _consume(fn, response)
+            timings.append(time.perf_counter() - started)
+            items += n_items
+            requests += n_requests
+
+    tracemalloc.start()
+    peaks = []
+    for fixture in fixtures:
+        response = fixture.replace()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        _consume(fn, response)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    total = sum(timings)
+    timings.sort()
+    return {
+        'responses': len(fixtures),
+        'calls': len(timings),
+        'items': items // repeat,
+        'requests': requests // repeat,
+        'total_s': round(total, 4),
+        'items_per_sec': round(items / total, 1) if total else None,
+        'responses_per_sec': round(len(timings) / total, 1) if total else None,
+        'p50_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+        'alloc_kib_per_response': round(sum(peaks) / len(peaks) / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Regressions of `results` against `baseline` larger than `threshold` (a fraction)."""
+    regressions = []
+    for name, metrics in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            old, new = before.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append((name, metric, old, new, change))
+    return regressions
+
+
+def main():
+    from scrapy.utils.project import data_path
+
+    parser = argparse.ArgumentParser(description="Benchmark spider callbacks on recorded responses.")
+    parser.add_argument('archives', nargs='*', help="WARC archives (default: .scrapy/warc/*.warc.gz)")
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument('--repeat', type=int, default=3, help="timing passes over the fixtures")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the new baseline")
+    parser.add_argument('--compare', action='store_true', help="compare with the baseline, exit 1 on a regression")
+    parser.add_argument('--baseline', default=None, help="baseline file (default: .scrapy/bench/baseline.json)")
+    parser.add_argument('--threshold', type=float, default=0.15, help="allowed relative change (default 0.15)")
+    args = parser.parse_args()
+
+    archives = args.archives or sorted(glob.glob(os.path.join(data_path('warc'), '*.warc.gz')))
+    if not archives:
+        sys.exit("No WARC archives found; record some with -s WARC_CAPTURE_DIR=warc")
+    bench_dir = data_path('bench', createdir=True)
+    baseline_path = args.baseline or os.path.join(bench_dir, 'baseline.json')
+
+    spider_classes = {cls.__name__: cls for cls in _spiders()}
+    results = {}
+    for name in args.only or BENCHMARKS:
+        class_name, callback, fn = BENCHMARKS[name]
+        spider = spider_classes[class_name]()
+        fixtures = load_fixtures(archives, spider.name, callback)
+        if not fixtures:
+            print(f"{name:32} no fixtures")
+            continue
+        call = (lambda response, fn=fn, spider=spider: fn(spider, response)) if fn else getattr(spider, callback)
+        results[name] = run_benchmark(call, fixtures, args.repeat)
+        r = results[name]
+        print(f"{name:32} {r['responses']:5d} responses {r['items_per_sec'] or 0:10.1f} items/s "
+              f"p50 {r['p50_ms']:8.2f} ms  p95 {r['p95_ms']:8.2f} ms  {r['alloc_kib_per_response']:8.1f} KiB/response")
+
+    run = {'created_at': datetime.now().isoformat(timespec='seconds'), 'archives': archives, 'results': results}
+    path = os.path.join(bench_dir, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(run, f, indent=2)
+    print(f"Results written to {path}")
+    if args.save_baseline:
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+
+    if args.compare:
+        if not os.path.exists(baseline_path):
+            sys.exit(f"No baseline at {baseline_path}; run with --save-baseline first")
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, old, new, change in regressions:
+            print(f"REGRESSION {name} {metric}: {old} -> {new} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {baseline_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+from urllib.parse import urlparse
+
+# Recognising responses that mean "this client is being throttled or
+# blocked" rather than "this page has no data". Requests can state what a
+# real answer looks like:
+#   meta['block_expect'] = 'window.sellSearch'   # text a real page contains
+#   meta['block_expect_json'] = True             # body must be a complete JSON document
+
+BLOCK_STATUS_CODES = {403, 429}
+
+CAPTCHA_MARKERS = (b'captcha', b'cf-chl', b'challenge-platform', b'access denied', b'request unsuccessful')
+# Challenge pages are small; real listing pages may well load a reCAPTCHA
+# script for their contact forms.
+CAPTCHA_MAX_SIZE = 32 * 1024
+
+BLOCK_CLASSES = ('status_403', 'status_429', 'redirect_home', 'empty', 'captcha', 'truncated_json', 'empty_shell')
+
+# Sent by BlockDetectionMiddleware for every response it checks, after
+# HttpCompressionMiddleware, so handlers see what the body really was:
+#   handler(request, response, block, spider)   # block: a BLOCK_CLASSES entry or None
+response_classified = object()
+
+
+def classify_block(response, request=None):
+    """Return the block class of a response (one of BLOCK_CLASSES) or None."""
+    if response.status in BLOCK_STATUS_CODES:
+        return f'status_{response.status}'
+    if request is not None and request.meta.get('redirect_urls'):
+        # Sent from a deep link back to the front page.
+        if urlparse(response.url).path in ('', '/') and urlparse(request.meta['redirect_urls'][0]).path not in ('', '/'):
+            return 'redirect_home'
+    if response.status != 200:
+        return None
+    if response.headers.get(b'Content-Encoding', b'identity').lower() != b'identity':
+        # Still compressed (signal handlers and middlewares below
+        # HttpCompressionMiddleware): the body cannot be judged yet.
+        return None
+    body = response.body
+    stripped = body.strip()
+    if not stripped:
+        return 'empty'
+    if len(body) <= CAPTCHA_MAX_SIZE and any(marker in body.lower() for marker in CAPTCHA_MARKERS):
+        return 'captcha'
+    if request is None:
+        return None
+    if request.meta.get('block_expect_json'):
+        if stripped[:1] not in (b'{', b'[') or stripped[-1:] not in (b'}', b']'):
+            return 'truncated_json'
+    expect = request.meta.get('block_expect')
+    if expect and expect.encode() not in body:
+        return 'empty_shell'
+    return None
@@ -0,0 +1,75 @@
+import configparser
+import functools
+import os
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.ini')
+
+# Set by enable_pool(); when several spiders share one process (see
+# aidid_house.runner) their pipelines borrow connections from one pool,
+# created on first use.
+_pool_size = None
+_pool = None
+
+
+@functools.lru_cache(maxsize=None)
+def load_config(path=CONFIG_PATH):
+    """Read config.ini next to the package (or the given path). Parsed once per process."""
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+def get_connection(config=None):
+    """Open a new psycopg2 connection using the [postgres] section of config.ini."""
+    if config is None:
+        config = load_config()
+    return psycopg2.connect(**_connect_kwargs(config))
+
+
+def enable_pool(maxconn=10):
+    """Make acquire()/release() use a process-wide pool of up to maxconn connections."""
+    global _pool_size
+    _pool_size = maxconn
+
+
+def close_pool():
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.closeall()
+    _pool = None
+    _pool_size = None
+
+
+def acquire():
+    """Borrow a connection from the shared pool, or open one if no pool is enabled."""
+    global _pool
+    if _pool_size is None:
+        return get_connection()
+    if _pool is None:
+        _pool = ThreadedConnectionPool(1, _pool_size, **_connect_kwargs(load_config()))
+    return _pool.getconn()
+
+
+def release(conn):
+    """Give back a connection obtained with acquire()."""
+    if conn is None:
+        return
+    if _pool is not None:
+        if not conn.closed:
+            conn.rollback()
+        _pool.putconn(conn)
+    else:
+        conn.close()
+
+
+def _connect_kwargs(config):
+    return dict(
+        host=config['postgres']['host'],
+        database=config['postgres']['database'],
+        user=config['postgres']['user'],
+        password=config['postgres']['password'],
+        port=config['postgres']['port']
+    )
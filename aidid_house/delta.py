@@ -0,0 +1,99 @@
+import hashlib
+import re
+
+from aidid_house.items import HouseUpdateItem
+
+
+# -------------------------------------------------------------------
+# Delta crawling
+# -------------------------------------------------------------------
+# DeltaScrapePipeline hands every spider the ACTIVE listing URLs of the
+# master table (spider.existing_urls) when it opens. A spider that finds a
+# known listing on a list page or API yields HouseUpdateItem(url=...), which
+# only refreshes last_seen, instead of fetching the detail page again.
+# Spiders whose list data carries a case id rather than the stored URL look
+# listings up by id:
+#   known = known_cases(self, r'buy\.houseprice\.tw/house/(\w+)')
+#   if case_id in known:
+#       yield HouseUpdateItem(url=known[case_id])
+#
+# A skipped listing can still change, for example with a price cut. List
+# cards show title, price and area, so spiders fingerprint each card and
+# pass it to card_update(). The pipeline stores the fingerprint in
+# card_fingerprint and hands the stored ones over as spider.existing_cards.
+# For a known listing whose card changed, card_update() says so, and the
+# spider fetches its detail page again. The update is yielded either way:
+# it keeps the listing live if the new fetch fails, and carries no
+# fingerprint then, so the stored one stays and the next run tries again:
+#   card = list_card(card_selector)
+#   update, changed = card_update(self, url, card)
+#   yield update
+#   if changed:
+#       yield scrapy.Request(url, meta={'card_fingerprint': fingerprint(card), ...})
+# A listing without a stored fingerprint (first run with this code) records
+# it and is not fetched again. A card that shows none of the fields cannot
+# tell whether the listing changed, so its detail page is fetched again.
+#
+# The price is the total price: it is read from the card's price element
+# (TOTAL_PRICE, or the spider's own XPath) when the card has one. Unit
+# prices (萬/坪) and struck-through old prices never count.
+
+PRICE = re.compile(r'(\d[\d,]*(?:\.\d+)?)\s*萬(?!元?\s*/\s*坪)')
+AREA = re.compile(r'(\d+(?:\.\d+)?)\s*坪')
+TITLE = ('.//*[self::h2 or self::h3 or contains(@class, "title") or contains(@class, "name")]'
+         '//text()[normalize-space()]')
+STRUCK = 'ancestor::del or ancestor::s or ancestor::strike'
+TOTAL_PRICE = ('.//*[contains(@class, "price") and not(contains(@class, "unit")) and not(contains(@class, "old"))'
+               f' and not(contains(@class, "original"))]//text()[not({STRUCK})]')
+
+
+def known_cases(spider, pattern):
+    """{case id: stored URL} for the spider's existing_urls matching `pattern` (built once per spider)."""
+    index = spider.__dict__.get('_known_cases')
+    if index is None:
+        regex = re.compile(pattern)
+        index = {}
+        for url in spider.existing_urls:
+            match = regex.search(url)
+            if match:
+                index[match.group(1)] = url
+        spider._known_cases = index
+    return index
+
+
+def list_card(card, price_xpath=TOTAL_PRICE):
+    """Title, total price (萬) and area (坪) shown on a list card (a selector)."""
+    text = ' '.join(card.xpath(f'.//text()[not({STRUCK})]').getall())
+    price = PRICE.search(' '.join(card.xpath(price_xpath).getall())) or PRICE.search(text)
+    area = AREA.search(text)
+    return {
+        'title': ' '.join(t.strip() for t in card.xpath(TITLE).getall()) or None,
+        'price': price.group(1).replace(',', '') if price else None,
+        'area': area.group(1) if area else None,
+    }
+
+
+def fingerprint(card):
+    """A short hash of a card's values, or None when the card shows none."""
+    values = [str(card[key]) if card[key] is not None else '' for key in sorted(card)]
+    if not any(values):
+        return None
+    return hashlib.sha1('\x1f'.join(values).encode('utf-8')).hexdigest()[:16]
+
+
+def card_update(spider, url, card):
+    """
+    (HouseUpdateItem, changed) for a known listing. changed is True when
+    the card differs from the stored fingerprint, or shows none of its
+    fields, and the detail page should be fetched again; the update then
+    leaves the stored fingerprint alone.
+    """
+    current = fingerprint(card)
+    if current is None:
+        spider.crawler.stats.inc_value('delta/card_unreadable')
+        return HouseUpdateItem(url=url), True
+    stored = getattr(spider, 'existing_cards', {}).get(url)
+    if stored is not None and stored != current:
+        spider.crawler.stats.inc_value('delta/card_changed')
+        return HouseUpdateItem(url=url), True
+    return HouseUpdateItem(url=url, card_fingerprint=current), False
@@ -0,0 +1,126 @@
+import json
+import re
+import weakref
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# -------------------------------------------------------------------
+# Embedded page state
+# -------------------------------------------------------------------
+# Most listing data ships as JSON inside <script> tags: __NEXT_DATA__ on
+# Sinyi, window.sellSearch / window.tmpDataLayer / window.itemContact and
+# ld+json on Rakuya. embedded_state(response) finds every script block with
+# one scan over the raw body bytes, without building the DOM, and decodes a
+# blob (with orjson when it is installed) only when it is asked for. Both
+# the scan and each decoded blob are cached per response, so several fields
+# and callbacks share one parse:
+#   state = embedded_state(response)
+#   state.script_json('__NEXT_DATA__')   # <script id="__NEXT_DATA__">
+#   state.window_var('sellSearch')       # window.sellSearch = {...};
+#   state.ld_json()                      # every application/ld+json block
+# Blobs that are not valid JSON raise ValueError (json.JSONDecodeError).
+
+ASSIGNMENT = re.compile(rb'window\.([A-Za-z_$][\w$]*)\s*=(?!=)\s*')
+# Attribute values may be double-, single- or unquoted (<script id=__NEXT_DATA__>).
+ATTRIBUTE = re.compile(rb'''([\w-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+))''')
+
+_decoder = json.JSONDecoder()
+_states = weakref.WeakKeyDictionary()
+
+
+def loads(data):
+    """Decode JSON from bytes or str, with orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _value(data):
+    # An assignment usually fills the rest of its script (up to the ';');
+    # anything after it needs a decoder that stops at the end of the value.
+    blob = data.rstrip().rstrip(b';').rstrip()
+    try:
+        return loads(blob)
+    except ValueError:
+        return _decoder.raw_decode(data.decode('utf-8'))[0]
+
+
+class EmbeddedState:
+    def __init__(self, body):
+        self.body = body
+        # (attributes, content start, content end) of every <script>
+        self.scripts = []
+        # script id -> index, window variable -> (script index, value start)
+        self.ids = {}
+        self.assignments = {}
+        self.cache = {}
+        self._scan()
+
+    def _scan(self):
+        body = self.body
+        find = body.find
+        pos = find(b'<script')
+        while pos != -1:
+            tag_end = find(b'>', pos)
+            if tag_end == -1:
+                break
+            end = find(b'</script>', tag_end)
+            if end == -1:
+                break
+            attrs = {m.group(1).lower(): next(v for v in m.group(2, 3, 4) if v is not None)
+                     for m in ATTRIBUTE.finditer(body, pos + 7, tag_end)}
+            index = len(self.scripts)
+            self.scripts.append((attrs, tag_end + 1, end))
+            if b'id' in attrs:
+                self.ids.setdefault(attrs[b'id'].decode('ascii', 'replace'), index)
+            if b'src' not in attrs:
+                for match in ASSIGNMENT.finditer(body, tag_end + 1, end):
+                    self.assignments.setdefault(match.group(1).decode('ascii'), (index, match.end()))
+            pos = find(b'<script', end + 9)
+
+    def _cached(self, key, decode):
+        if key not in self.cache:
+            self.cache[key] = decode()
+        return self.cache[key]
+
+    def script_json(self, script_id):
+        """The decoded JSON content of <script id="script_id">, or None."""
+        index = self.ids.get(script_id)
+        if index is None:
+            return None
+        _, start, end = self.scripts[index]
+        return self._cached(('id', script_id), lambda: loads(self.body[start:end]))
+
+    def window_var(self, name):
+        """The decoded value of `window.<name> = ...;`, or None."""
+        found = self.assignments.get(name)
+        if found is None:
+            return None
+        index, start = found
+        end = self.scripts[index][2]
+        return self._cached(('window', name), lambda: _value(self.body[start:end]))
+
+    def ld_json(self):
+        """Every application/ld+json block, decoded (blocks that fail to decode are skipped)."""
+        def decode():
+            blobs = []
+            for attrs, start, end in self.scripts:
+                if attrs.get(b'type') == b'application/ld+json':
+                    try:
+                        blobs.append(loads(self.body[start:end]))
+                    except ValueError:
+                        continue
+            return blobs
+        return self._cached(('ld',), decode)
+
+
+def embedded_state(response):
+    """The (cached) EmbeddedState of a response."""
+    state = _states.get(response)
+    if state is None:
+        state = _states[response] = EmbeddedState(response.body)
+    return state
@@ -0,0 +1,820 @@
+import csv
+import json
+import logging
+import math
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.extensions.telnet import update_telnet_vars
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.project import data_path
+from twisted.internet import task
+
+from aidid_house.blocking import classify_block, response_classified
+from aidid_house.db import acquire
+from aidid_house.ledger import RunLedger, crawl_row
+from aidid_house.logs import EventLog, JsonFormatter
+from aidid_house.metrics import REGISTRY, start_server, stop_server
+from aidid_house.proxies import ProxyPool, proxy_label
+from aidid_house.warc import WarcWriter, capture_extra
+
+logger = logging.getLogger(__name__)
+
+
+# -------------------------------------------------------------------
+# Adaptive concurrency (AIMD per downloader slot)
+# -------------------------------------------------------------------
+# A downloader slot is one domain, or one domain through one proxy when
+# ADAPTIVE_CONCURRENCY_PER_PROXY is on (see ProxyPoolMiddleware). Every
+# ADAPTIVE_CONCURRENCY_WINDOW seconds each slot that kept its requests busy
+# and stayed fast gets one more concurrent request. A blocked response
+# (403/429, captcha, empty body), as judged by BlockDetectionMiddleware on
+# the decompressed body, halves the slot at once. Latency above
+# ADAPTIVE_CONCURRENCY_LATENCY_FACTOR times the slot's best window takes a
+# quarter off. Every change is appended to ADAPTIVE_CONCURRENCY_LOG as one
+# JSON line.
+class SlotState:
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.best_latency = None
+        self.last_decrease = 0
+        self.reset_window()
+
+    def reset_window(self):
+        self.responses = 0
+        self.blocked = 0
+        self.latency_sum = 0.0
+
+    def mean_latency(self):
+        return self.latency_sum / self.responses if self.responses else None
+
+
+class AdaptiveConcurrency:
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.start = settings.getint('ADAPTIVE_CONCURRENCY_START', 4)
+        self.min = settings.getint('ADAPTIVE_CONCURRENCY_MIN', 1)
+        self.max = min(settings.getint('ADAPTIVE_CONCURRENCY_MAX', 32), settings.getint('CONCURRENT_REQUESTS'))
+        self.window = settings.getfloat('ADAPTIVE_CONCURRENCY_WINDOW', 10)
+        self.latency_factor = settings.getfloat('ADAPTIVE_CONCURRENCY_LATENCY_FACTOR', 2.0)
+        self.log_path = settings.get('ADAPTIVE_CONCURRENCY_LOG')
+        # response_downloaded fires before HttpCompressionMiddleware; blocks
+        # in the body are only known once BlockDetectionMiddleware has run.
+        self.classified = settings.getbool('BLOCK_DETECTION_ENABLED', True)
+        self.slots = {}
+        self.log_file = None
+        self.loop = None
+        self.spider_name = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED'):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(s.response_downloaded, signal=signals.response_downloaded)
+        if s.classified:
+            crawler.signals.connect(s.response_classified, signal=response_classified)
+        return s
+
+    def spider_opened(self, spider):
+        self.spider_name = spider.name
+        if self.log_path:
+            path = data_path(self.log_path)
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.log_file = open(path, 'a', encoding='utf-8')
+        self.loop = task.LoopingCall(self.evaluate)
+        self.loop.start(self.window, now=False)
+
+    def spider_closed(self, spider):
+        if self.loop and self.loop.running:
+            self.loop.stop()
+        for key, state in self.slots.items():
+            self.stats.set_value(f'concurrency/{key}', state.concurrency)
+        if self.log_file:
+            self.log_file.close()
+
+    def request_reached_downloader(self, request, spider):
+        # The downloader creates slots (again, after collecting idle ones)
+        # with its static concurrency; apply ours before they fill up.
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            slot.concurrency = self._state(key, slot).concurrency
+
+    def response_downloaded(self, response, request, spider):
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+        state = self._state(key, slot)
+        latency = request.meta.get('download_latency')
+        state.responses += 1
+        if latency is not None:
+            state.latency_sum += latency
+        if not self.classified:
+            # Without block detection only statuses and redirects can be judged.
+            self._blocked(key, slot, state, classify_block(response, request))
+
+    def response_classified(self, request, response, block, spider):
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            self._blocked(key, slot, self._state(key, slot), block)
+
+    def _blocked(self, key, slot, state, block):
+        if block is None:
+            return
+        state.blocked += 1
+        self.stats.inc_value(f'concurrency/blocked/{block}')
+        # Back off at once, but only once per window: the responses already
+        # in flight when the site started blocking would halve it again.
+        if time.time() - state.last_decrease >= self.window:
+            self._set(key, slot, state, max(self.min, state.concurrency // 2), f'blocked:{block}')
+
+    def evaluate(self):
+        downloader = self.crawler.engine.downloader
+        for key, state in list(self.slots.items()):
+            slot = downloader.slots.get(key)
+            if slot is None:
+                # Garbage-collected by the downloader after going idle.
+                del self.slots[key]
+                continue
+            latency = state.mean_latency()
+            if latency is not None and state.blocked == 0:
+                if state.best_latency is None or latency < state.best_latency:
+                    state.best_latency = latency
+                if latency > state.best_latency * self.latency_factor:
+                    if time.time() - state.last_decrease >= self.window:
+                        self._set(key, slot, state, max(self.min, math.floor(state.concurrency * 0.75)), 'latency')
+                elif state.responses >= state.concurrency and state.concurrency < self.max:
+                    self._set(key, slot, state, state.concurrency + 1, 'increase')
+            state.reset_window()
+
+    def _state(self, key, slot):
+        if key not in self.slots:
+            self.slots[key] = SlotState(min(self.start, self.max))
+        return self.slots[key]
+
+    def _set(self, key, slot, state, concurrency, reason):
+        if concurrency == state.concurrency:
+            return
+        record = {
+            'ts': round(time.time(), 3),
+            'spider': self.spider_name,
+            'slot': key,
+            'from': state.concurrency,
+            'to': concurrency,
+            'reason': reason,
+            'responses': state.responses,
+            'blocked': state.blocked,
+            'latency': round(state.mean_latency(), 3) if state.responses else None,
+            'best_latency': round(state.best_latency, 3) if state.best_latency is not None else None,
+        }
+        if concurrency < state.concurrency:
+            state.last_decrease = time.time()
+            self.stats.inc_value('concurrency/decreases')
+        else:
+            self.stats.inc_value('concurrency/increases')
+        state.concurrency = slot.concurrency = concurrency
+        logger.info(f"Concurrency {key}: {record['from']} -> {concurrency} ({reason}, "
+                    f"{record['responses']} responses, latency {record['latency']})")
+        if self.log_file:
+            self.log_file.write(json.dumps(record) + '\n')
+            self.log_file.flush()
+
+
+# -------------------------------------------------------------------
+# Bandwidth accounting
+# -------------------------------------------------------------------
+# Bytes by (domain, proxy, callback): sent (request line, headers, body),
+# received on the wire (headers plus body as transferred, i.e. still
+# compressed) and decompressed body size, plus the items each callback
+# yielded. At close the table goes to the log, to bandwidth/* stats, to a
+# per-run JSON report and to a running CSV appended to by every run, e.g.
+#   .scrapy/bandwidth/buyHB-2024-06-01.json
+#   .scrapy/bandwidth.csv
+class BandwidthAccounting:
+    columns = ('requests', 'sent_bytes', 'received_bytes', 'decompressed_bytes', 'items')
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.report_dir = crawler.settings.get('BANDWIDTH_REPORT_DIR', 'bandwidth')
+        self.table_path = crawler.settings.get('BANDWIDTH_TABLE', 'bandwidth.csv')
+        self.run_id = crawler.settings.get('CRAWL_RUN_ID')
+        self.rows = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('BANDWIDTH_ENABLED', True):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(s.response_received, signal=signals.response_received)
+        crawler.signals.connect(s.item_scraped, signal=signals.item_scraped)
+        return s
+
+    def spider_opened(self, spider):
+        self.run_id = self.run_id or time.strftime('%Y%m%d-%H%M%S')
+
+    def response_downloaded(self, response, request, spider):
+        row = self._row(request)
+        row[0] += 1
+        row[1] += len(request.method) + len(request.url) + len(request.headers.to_string()) + len(request.body)
+        row[2] += len(response.headers.to_string()) + len(response.body)
+
+    def response_received(self, response, request, spider):
+        if 'cached' not in response.flags:
+            self._row(request)[3] += len(response.body)
+
+    def item_scraped(self, item, response, spider):
+        if response is not None and response.request is not None:
+            self._row(response.request)[4] += 1
+
+    def spider_closed(self, spider):
+        if not self.rows:
+            return
+        table = sorted(self.rows.items(), key=lambda kv: kv[1][2], reverse=True)
+        totals = [sum(row[i] for _, row in table) for i in range(len(self.columns))]
+        for name, value in zip(self.columns, totals):
+            self.stats.set_value(f'bandwidth/{name}', value)
+        if totals[4]:
+            self.stats.set_value('bandwidth/received_bytes_per_item', totals[2] // totals[4])
+
+        spider.logger.info(f"Bandwidth: {totals[2] / 1e6:.1f} MB received ({totals[3] / 1e6:.1f} MB decompressed), "
+                           f"{totals[1] / 1e6:.1f} MB sent, {totals[4]} items")
+        for (domain, proxy, callback), row in table[:10]:
+            spider.logger.info(f"  {domain:<28} {proxy:<24} {callback:<20} {row[0]:>7} req "
+                               f"{row[2] / 1e6:>9.1f} MB  {row[2] // max(row[0], 1):>8} B/req")
+
+        records = [dict(zip(('domain', 'proxy', 'callback') + self.columns, key + tuple(row))) for key, row in table]
+        report_dir = data_path(self.report_dir, createdir=True)
+        with open(os.path.join(report_dir, f"{spider.name}-{self.run_id}.json"), 'w', encoding='utf-8') as f:
+            json.dump({
+                'spider': spider.name,
+                'run_id': self.run_id,
+                'totals': dict(zip(self.columns, totals)),
+                'received_bytes_per_item': totals[2] // totals[4] if totals[4] else None,
+                'rows': records,
+            }, f, indent=2)
+
+        table_path = data_path(self.table_path)
+        new_table = not os.path.exists(table_path)
+        with open(table_path, 'a', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            if new_table:
+                writer.writerow(('finished_at', 'spider', 'run_id', 'domain', 'proxy', 'callback') + self.columns)
+            finished_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+            for (domain, proxy, callback), row in table:
+                writer.writerow((finished_at, spider.name, self.run_id, domain, proxy, callback, *row))
+
+    def _row(self, request):
+        proxy = request.meta.get('proxy')
+        callback = getattr(request.callback, '__name__', None) or 'parse'
+        key = (urlparse_cached(request).hostname or '', proxy_label(proxy) if proxy else 'direct', callback)
+        if key not in self.rows:
+            self.rows[key] = [0] * len(self.columns)
+        return self.rows[key]
+
+
+# -------------------------------------------------------------------
+# WARC capture
+# -------------------------------------------------------------------
+# Records every downloaded response, as received, to
+# .scrapy/<WARC_CAPTURE_DIR>/<spider>-<run id>.warc.gz for offline replay
+# (see aidid_house.warc). Responses served from the HTTP cache are not
+# downloaded and so not captured; capture with HTTPCACHE_ENABLED=False.
+class WarcCapture:
+    def __init__(self, crawler, directory):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.directory = directory
+        self.run_id = crawler.settings.get('CRAWL_RUN_ID')
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = crawler.settings.get('WARC_CAPTURE_DIR')
+        if not directory:
+            raise NotConfigured
+        s = cls(crawler, directory)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.response_downloaded, signal=signals.response_downloaded)
+        return s
+
+    def spider_opened(self, spider):
+        run_id = self.run_id or time.strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(data_path(self.directory, createdir=True), f"{spider.name}-{run_id}.warc.gz")
+        self.writer = WarcWriter(path)
+        spider.logger.info(f"Capturing responses to {path}")
+
+    def response_downloaded(self, response, request, spider):
+        fingerprint = self.crawler.request_fingerprinter.fingerprint(request).hex()
+        self.writer.write_exchange(request, response, fingerprint, capture_extra(request, spider))
+        self.stats.inc_value('warc/captured')
+        self.stats.inc_value('warc/captured_bytes', len(response.body))
+
+    def spider_closed(self, spider):
+        if self.writer:
+            self.writer.close()
+
+
+# -------------------------------------------------------------------
+# Event-loop stall watchdog
+# -------------------------------------------------------------------
+# A heartbeat on the reactor every STALL_WATCHDOG_INTERVAL seconds, and a
+# watcher thread that samples the reactor thread's stack whenever the
+# heartbeat is more than STALL_WATCHDOG_THRESHOLD late. When the heartbeat
+# comes back, the stall's duration is shared out among the call sites
+# sampled during it. Call sites are the innermost project frame plus the
+# innermost frame overall, e.g.
+#   aidid_house/pipelines.py:142 process_item > psycopg2/extras.py:... execute
+# Totals go to the stall/... stats, the worst sites to the log, and every
+# site with an example stack to .scrapy/<STALL_WATCHDOG_DIR>/<spider>-<run id>.json.
+class StallWatchdog:
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.interval = settings.getfloat('STALL_WATCHDOG_INTERVAL', 0.05)
+        self.threshold = settings.getfloat('STALL_WATCHDOG_THRESHOLD', 0.25)
+        self.directory = settings.get('STALL_WATCHDOG_DIR', 'stalls')
+        self.run_id = crawler.settings.get('CRAWL_RUN_ID')
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.samples = []
+        # call site -> {'stalls', 'seconds', 'max', 'stack'}
+        self.sites = {}
+        self.stalls = 0
+        self.stalled = 0.0
+        self.longest = 0.0
+        self.reactor_thread = None
+        self.last_beat = None
+        self.loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('STALL_WATCHDOG_ENABLED', True):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        self.reactor_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.loop = task.LoopingCall(self.beat)
+        self.loop.start(self.interval, now=False)
+        threading.Thread(target=self.watch, name='stall-watchdog', daemon=True).start()
+
+    def beat(self):
+        now = time.monotonic()
+        late = now - self.last_beat - self.interval
+        self.last_beat = now
+        if late < self.threshold:
+            return
+        with self.lock:
+            samples, self.samples = self.samples, []
+        self.stalls += 1
+        self.stalled += late
+        self.longest = max(self.longest, late)
+        samples = samples or [(('unknown (shorter than one sample)',), None)]
+        share = late / len(samples)
+        seen = set()
+        for site, stack in samples:
+            entry = self.sites.setdefault(site, {'stalls': 0, 'seconds': 0.0, 'max': 0.0, 'stack': stack})
+            entry['seconds'] += share
+            entry['max'] = max(entry['max'], late)
+            if site not in seen:
+                entry['stalls'] += 1
+                seen.add(site)
+        logger.debug(f"Reactor stalled {late:.3f}s in {' | '.join(' > '.join(site) for site in dict.fromkeys(s for s, _ in samples))}")
+
+    def watch(self):
+        while not self.stopped.wait(self.interval):
+            if time.monotonic() - self.last_beat - self.interval < self.threshold:
+                continue
+            frame = sys._current_frames().get(self.reactor_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            with self.lock:
+                self.samples.append((self._site(stack), traceback.format_list(stack[-12:])))
+
+    @staticmethod
+    def _site(stack):
+        # Only what runs inside the event loop; the frames below it just
+        # started the crawl.
+        loop_frames = [i for i, f in enumerate(stack)
+                       if f.filename.endswith(('asyncio/events.py', 'twisted/internet/base.py'))]
+        if loop_frames:
+            stack = stack[loop_frames[-1] + 1:] or stack
+
+        def label(frame):
+            parts = frame.filename.replace(os.sep, '/').split('/')
+            return f"{'/'.join(parts[-2:])}:{frame.lineno} {frame.name}"
+        innermost = label(stack[-1])
+        own = next((label(f) for f in reversed(stack) if f'{os.sep}aidid_house{os.sep}' in f.filename
+                    and not f.filename.endswith('extensions.py')), None)
+        return (own, innermost) if own and own != innermost else (innermost,)
+
+    def spider_closed(self, spider):
+        self.stopped.set()
+        if self.loop and self.loop.running:
+            self.loop.stop()
+        self.stats.set_value('stall/count', self.stalls)
+        self.stats.set_value('stall/seconds', round(self.stalled, 3))
+        self.stats.set_value('stall/max_seconds', round(self.longest, 3))
+        if not self.stalls:
+            return
+        sites = sorted(self.sites.items(), key=lambda kv: kv[1]['seconds'], reverse=True)
+        spider.logger.info(f"Reactor stalled {self.stalls} times for {self.stalled:.1f}s in total "
+                           f"(longest {self.longest:.2f}s, threshold {self.threshold}s)")
+        for site, entry in sites[:10]:
+            spider.logger.info(f"  {entry['seconds']:>8.2f}s {entry['stalls']:>6} stalls  {' > '.join(site)}")
+
+        run_id = self.run_id or time.strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(data_path(self.directory, createdir=True), f"{spider.name}-{run_id}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'spider': spider.name,
+                'run_id': run_id,
+                'threshold': self.threshold,
+                'stalls': self.stalls,
+                'seconds': round(self.stalled, 3),
+                'max_seconds': round(self.longest, 3),
+                'sites': [{'site': ' > '.join(site), 'stalls': entry['stalls'], 'seconds': round(entry['seconds'], 3),
+                           'max_seconds': round(entry['max'], 3), 'stack': entry['stack']} for site, entry in sites],
+            }, f, indent=2)
+
+
+# -------------------------------------------------------------------
+# On-demand sampling profiler
+# -------------------------------------------------------------------
+# Started and stopped on a running crawl, without a restart:
+#   kill -USR1 <pid>                     # PROFILER_SIGNAL toggles it
+#   telnet localhost 6023                # or from the telnet console:
+#   >>> profiler.start(); ...; profiler.stop()
+# A thread samples the reactor thread's stack (all threads with
+# PROFILER_ALL_THREADS) PROFILER_HZ times a second. Stopping writes the
+# samples in folded-stack format, rooted at spider=<name>;run=<id>, to
+# .scrapy/<PROFILER_DIR>/<spider>-<run id>-<time>.folded, ready for
+# flamegraph.pl or speedscope. A session ends by itself after
+# PROFILER_MAX_DURATION seconds, and at the latest when the spider closes.
+# The signal handler is installed once per process and toggles the profilers
+# of every open spider together (see aidid_house.runner).
+class SamplingProfiler:
+    _open = []
+    _handled = set()
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.hz = settings.getfloat('PROFILER_HZ', 100)
+        self.all_threads = settings.getbool('PROFILER_ALL_THREADS', False)
+        self.max_duration = settings.getfloat('PROFILER_MAX_DURATION', 300)
+        self.signal_name = settings.get('PROFILER_SIGNAL', 'SIGUSR1')
+        self.directory = settings.get('PROFILER_DIR', 'profiles')
+        self.run_id = settings.get('CRAWL_RUN_ID')
+        self.stats = crawler.stats
+        self.spider = None
+        self.reactor_thread = None
+        self.counts = {}
+        self.samples = 0
+        self.started_at = None
+        self.stopping = None
+        self.thread = None
+        self.timeout = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PROFILER_ENABLED', False):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.update_telnet_vars, signal=update_telnet_vars)
+        return s
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.run_id = self.run_id or time.strftime('%Y%m%d-%H%M%S')
+        self.reactor_thread = threading.get_ident()
+        SamplingProfiler._open.append(self)
+        signum = getattr(signal, self.signal_name, None) if self.signal_name else None
+        if signum is not None and signum not in SamplingProfiler._handled:
+            # Only the main thread may install handlers; the toggle itself
+            # runs on the reactor.
+            from twisted.internet import reactor
+            signal.signal(signum, lambda *_: reactor.callFromThread(SamplingProfiler.toggle_all))
+            SamplingProfiler._handled.add(signum)
+
+    @classmethod
+    def toggle_all(cls):
+        """Stop every open profiler if any is running, otherwise start them all."""
+        if any(p.running for p in cls._open):
+            return [p.stop() for p in cls._open]
+        return [p.start() for p in cls._open]
+
+    def update_telnet_vars(self, telnet_vars):
+        telnet_vars['profiler'] = self
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def toggle(self):
+        return self.stop() if self.running else self.start()
+
+    def start(self, duration=None):
+        """Start sampling; stops by itself after `duration` (PROFILER_MAX_DURATION) seconds."""
+        if self.running:
+            return 'already running'
+        self.counts = {}
+        self.samples = 0
+        self.started_at = time.time()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._sample, args=(self.stopping,), name='sampling-profiler', daemon=True)
+        self.thread.start()
+        duration = duration or self.max_duration
+        if duration:
+            from twisted.internet import reactor
+            self.timeout = reactor.callLater(duration, self.stop)
+        logger.info(f"Sampling profiler started at {self.hz:g} Hz"
+                    + (f", stopping after {duration:g}s" if duration else ""))
+        return 'started'
+
+    def stop(self):
+        """Stop sampling and write the folded stacks; returns the file path."""
+        if not self.running:
+            return None
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        if self.timeout and self.timeout.active():
+            self.timeout.cancel()
+        self.timeout = None
+        duration = time.time() - self.started_at
+        name = f"{self.spider.name}-{self.run_id}-{time.strftime('%H%M%S')}.folded"
+        path = os.path.join(data_path(self.directory, createdir=True), name)
+        root = f"spider={self.spider.name};run={self.run_id}"
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.counts.items(), key=lambda kv: -kv[1]):
+                f.write(f"{root};{stack} {count}\n")
+        self.stats.inc_value('profiler/sessions')
+        self.stats.inc_value('profiler/samples', self.samples)
+        logger.info(f"Sampling profiler stopped: {self.samples} samples over {duration:.0f}s written to {path}")
+        return path
+
+    def _sample(self, stopping):
+        interval = 1.0 / self.hz
+        own = threading.get_ident()
+        names = {}
+        while not stopping.wait(interval):
+            frames = sys._current_frames()
+            if self.all_threads:
+                selected = [(ident, frame) for ident, frame in frames.items() if ident != own]
+            else:
+                selected = [(self.reactor_thread, frames.get(self.reactor_thread))]
+            for ident, frame in selected:
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({'/'.join(code.co_filename.split(os.sep)[-2:])}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if self.all_threads:
+                    if ident not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stack.append(f"thread={names.get(ident, ident)}")
+                key = ';'.join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def spider_closed(self, spider):
+        self.stop()
+        if self in SamplingProfiler._open:
+            SamplingProfiler._open.remove(self)
+
+
+# -------------------------------------------------------------------
+# Run ledger
+# -------------------------------------------------------------------
+# Writes one row per finished crawl to the crawl_runs table (see
+# aidid_house.ledger). The row is written on engine_stopped, after every
+# spider_closed handler has published its stats (timing/..., items/...).
+class CrawlRunLedger:
+    def __init__(self, crawler):
+        self.stats = crawler.stats
+        self.run_id = crawler.settings.get('CRAWL_RUN_ID')
+        self.shard = crawler.settings.get('CRAWL_SHARD')
+        self.spider = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('RUN_LEDGER_ENABLED', True):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.engine_stopped, signal=signals.engine_stopped)
+        return s
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.run_id = self.run_id or time.strftime('%Y%m%d-%H%M%S')
+
+    def engine_stopped(self):
+        if self.spider is None:
+            return
+        row = crawl_row(self.spider, self.stats.get_stats(), shard=self.shard, run_id=self.run_id)
+        try:
+            ledger = RunLedger(acquire())
+        except Exception as e:
+            logger.warning(f"Run ledger: cannot connect, run not recorded: {e}")
+            return
+        try:
+            ledger.ensure_table()
+            ledger.record(row)
+            logger.info(f"Run ledger: {row['spider']} {row['items']} items, {row['items_per_sec'] or 0:.2f} items/s, "
+                        f"{row['errors']} errors")
+        except Exception as e:
+            ledger.conn.rollback()
+            logger.warning(f"Run ledger: run not recorded: {e}")
+        finally:
+            ledger.close()
+
+
+# -------------------------------------------------------------------
+# Live metrics endpoint
+# -------------------------------------------------------------------
+# Opt-in (METRICS_PORT): serves the crawl's live counters and histograms in
+# Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics (see
+# aidid_house.metrics). Requests, responses and latency per domain, items
+# per class and a per-class items/sec over the last METRICS_RATE_WINDOW
+# seconds; at scrape time also scheduler depth, requests in flight, the
+# scraper's queue and proxy pool health. Every series carries a spider label.
+class MetricsEndpoint:
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.port = crawler.settings.getint('METRICS_PORT')
+        self.host = crawler.settings.get('METRICS_HOST', '127.0.0.1')
+        self.rate_window = crawler.settings.getfloat('METRICS_RATE_WINDOW', 10)
+        self.spider = None
+        self.item_counts = {}
+        self.last_counts = {}
+        self.loop = None
+        r = REGISTRY
+        self.requests = r.counter('scrapy_requests_total', 'Requests sent to the downloader.', ('spider', 'domain'))
+        self.responses = r.counter('scrapy_responses_total', 'Responses downloaded.', ('spider', 'domain', 'status'))
+        self.latency = r.histogram('scrapy_response_latency_seconds', 'Download latency.', ('spider', 'domain'))
+        self.items = r.counter('scrapy_items_total', 'Items that went through the pipelines.',
+                               ('spider', 'item', 'outcome'))
+        self.item_rate = r.gauge('scrapy_items_per_second', 'Scraped items per second over the rate window.',
+                                 ('spider', 'item'))
+        self.scheduler = r.gauge('scrapy_scheduler_pending', 'Requests waiting in the scheduler.', ('spider',))
+        self.in_flight = r.gauge('scrapy_downloader_in_flight', 'Requests being downloaded.', ('spider', 'slot'))
+        self.scraper_queue = r.gauge('scrapy_scraper_queue', 'Responses waiting for or in a callback.', ('spider',))
+        self.pipeline_queue = r.gauge('scrapy_pipeline_items', 'Items in the item pipelines.', ('spider',))
+        self.proxy_success = r.gauge('aidid_proxy_success_ratio', 'Smoothed success rate.', ('pool', 'proxy'))
+        self.proxy_latency = r.gauge('aidid_proxy_latency_seconds', 'Smoothed latency.', ('pool', 'proxy'))
+        self.proxy_in_flight = r.gauge('aidid_proxy_in_flight', 'Requests in flight.', ('pool', 'proxy'))
+        self.proxy_cooling = r.gauge('aidid_proxy_cooling_down', '1 while the endpoint is cooling down.',
+                                     ('pool', 'proxy'))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getint('METRICS_PORT'):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(s.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(s.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(s.item_dropped, signal=signals.item_dropped)
+        return s
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        REGISTRY.collectors.append(self.collect)
+        port = start_server(self.port, self.host)
+        logger.info(f"Metrics on http://{self.host}:{port}/metrics")
+        self.loop = task.LoopingCall(self.update_rates)
+        self.loop.start(self.rate_window, now=False)
+
+    def spider_closed(self, spider):
+        if self.loop and self.loop.running:
+            self.loop.stop()
+        if self.collect in REGISTRY.collectors:
+            REGISTRY.collectors.remove(self.collect)
+        return stop_server()
+
+    def request_reached_downloader(self, request, spider):
+        self.requests.inc(spider=spider.name, domain=urlparse_cached(request).hostname or '')
+
+    def response_downloaded(self, response, request, spider):
+        domain = urlparse_cached(request).hostname or ''
+        self.responses.inc(spider=spider.name, domain=domain, status=response.status)
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.latency.observe(latency, spider=spider.name, domain=domain)
+
+    def item_scraped(self, item, spider):
+        name = type(item).__name__
+        self.items.inc(spider=spider.name, item=name, outcome='scraped')
+        self.item_counts[name] = self.item_counts.get(name, 0) + 1
+
+    def item_dropped(self, item, spider, exception):
+        self.items.inc(spider=spider.name, item=type(item).__name__, outcome='dropped')
+
+    def update_rates(self):
+        for name, count in self.item_counts.items():
+            rate = (count - self.last_counts.get(name, 0)) / self.rate_window
+            self.item_rate.set(round(rate, 3), spider=self.spider.name, item=name)
+        self.last_counts = dict(self.item_counts)
+
+    def collect(self):
+        engine, name = self.crawler.engine, self.spider.name
+        if engine is None or engine.slot is None:
+            return
+        try:
+            self.scheduler.set(len(engine.slot.scheduler), spider=name)
+        except TypeError:
+            pass
+        self.in_flight.clear()
+        for key, slot in engine.downloader.slots.items():
+            self.in_flight.set(len(slot.transferring) + len(slot.queue), spider=name, slot=key)
+        scraper = engine.scraper.slot
+        if scraper is not None:
+            self.scraper_queue.set(len(scraper.queue) + len(scraper.active), spider=name)
+            self.pipeline_queue.set(scraper.itemproc_size, spider=name)
+        now = time.time()
+        for pool in ProxyPool._pools.values():
+            for proxy in pool.proxies:
+                labels = {'pool': pool.name, 'proxy': proxy.label}
+                self.proxy_success.set(round(proxy.success, 4), **labels)
+                if proxy.latency is not None:
+                    self.proxy_latency.set(round(proxy.latency, 4), **labels)
+                self.proxy_in_flight.set(proxy.in_flight, **labels)
+                self.proxy_cooling.set(0 if proxy.available(now) else 1, **labels)
+
+
+# -------------------------------------------------------------------
+# Event log summaries
+# -------------------------------------------------------------------
+# Sampled events (see aidid_house.logs) are still counted: every
+# LOG_SUMMARY_INTERVAL seconds one line per run says how many events each
+# category had and how many were written, and at close the totals go to the
+# log_events/<category>/seen|written stats. LOG_JSON switches every log
+# handler to one JSON object per record once the spider opens.
+class LogSummary:
+    def __init__(self, crawler):
+        self.interval = crawler.settings.getfloat('LOG_SUMMARY_INTERVAL', 60)
+        self.json = crawler.settings.getbool('LOG_JSON')
+        self.stats = crawler.stats
+        self.events = None
+        self.loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        if self.json:
+            # The crawler replaces the root handler after loading extensions.
+            for handler in logging.root.handlers:
+                handler.setFormatter(JsonFormatter())
+        self.events = EventLog.of(spider)
+        if self.interval:
+            self.loop = task.LoopingCall(self.summarize, spider)
+            self.loop.start(self.interval, now=False)
+
+    def summarize(self, spider):
+        window = self.events.take_window()
+        if window:
+            counts = ', '.join(f"{category} {seen} ({written} written)"
+                               for category, (seen, written) in sorted(window.items()))
+            spider.logger.info(f"Log events in the last {self.interval:g}s: {counts}")
+
+    def spider_closed(self, spider):
+        if self.loop and self.loop.running:
+            self.loop.stop()
+        for category, (seen, written) in self.events.totals.items():
+            self.stats.set_value(f'log_events/{category}/seen', seen)
+            self.stats.set_value(f'log_events/{category}/written', written)
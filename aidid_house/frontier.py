@@ -0,0 +1,138 @@
+import sys
+from psycopg2.extras import execute_values
+from aidid_house.db import acquire, release
+from aidid_house.metrics import DB_WRITE_SECONDS, timed
+
+
+# -------------------------------------------------------------------
+# Persistent crawl frontier
+# -------------------------------------------------------------------
+# One row per tracked request (city / page / listing) of a run. A request is
+# 'PENDING' once it has been scheduled and 'DONE' once its callback and every
+# tracked request it spawned have finished. Re-running a spider with the same
+# CRAWL_RUN_ID skips everything already marked 'DONE'.
+# A request whose callback raised, or that never reached its callback in a
+# finished run (download error, blocked, HTTP error), is 'FAILED'. Its
+# ancestors stay 'PENDING' on purpose: resuming the run calls them again,
+# and they re-issue the failed request while skipping their done siblings.
+# Listings seen by earlier attempts stay live, see aidid_house.liveness.
+class CrawlFrontier:
+    table_name = "crawl_frontier"
+
+    def __init__(self, conn, run_id, spider_name, flush_size=100):
+        self.conn = conn
+        self.cur = conn.cursor()
+        self.run_id = run_id
+        self.spider_name = spider_name
+        self.flush_size = flush_size
+        self.pending_rows = {}
+        self.done_rows = set()
+        self.failed_rows = set()
+
+    def ensure_table(self):
+        self.cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            run_id TEXT NOT NULL,
+            spider TEXT NOT NULL,
+            request_key TEXT NOT NULL,
+            city TEXT,
+            page INTEGER,
+            status VARCHAR(10) NOT NULL DEFAULT 'PENDING',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_id, spider, request_key)
+        )
+        """)
+        self.conn.commit()
+
+    def load_done(self):
+        """Return the request keys already completed for this run."""
+        self.cur.execute(
+            f"SELECT request_key FROM {self.table_name} WHERE run_id = %s AND spider = %s AND status = 'DONE'",
+            (self.run_id, self.spider_name)
+        )
+        return {row[0] for row in self.cur.fetchall()}
+
+    def mark_pending(self, key, city=None, page=None):
+        self.pending_rows[key] = (self.run_id, self.spider_name, key, city, page)
+        if len(self.pending_rows) >= self.flush_size:
+            self.flush()
+
+    def mark_done(self, key):
+        self.done_rows.add(key)
+        if len(self.done_rows) >= self.flush_size:
+            self.flush()
+
+    def mark_failed(self, key):
+        self.failed_rows.add(key)
+        if len(self.failed_rows) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        with timed(DB_WRITE_SECONDS, table=self.table_name):
+            self._flush()
+
+    def _flush(self):
+        # Pending rows first so a request scheduled and finished within the
+        # same batch still ends up 'DONE'.
+        if self.pending_rows:
+            execute_values(self.cur, f"""
+            INSERT INTO {self.table_name} (run_id, spider, request_key, city, page)
+            VALUES %s
+            ON CONFLICT (run_id, spider, request_key) DO NOTHING
+            """, list(self.pending_rows.values()))
+            self.pending_rows = {}
+        if self.done_rows:
+            execute_values(self.cur, f"""
+            INSERT INTO {self.table_name} (run_id, spider, request_key, status)
+            VALUES %s
+            ON CONFLICT (run_id, spider, request_key) DO UPDATE SET
+            status = 'DONE', updated_at = CURRENT_TIMESTAMP
+            """, [(self.run_id, self.spider_name, key, 'DONE') for key in self.done_rows])
+            self.done_rows = set()
+        if self.failed_rows:
+            execute_values(self.cur, f"""
+            INSERT INTO {self.table_name} (run_id, spider, request_key, status)
+            VALUES %s
+            ON CONFLICT (run_id, spider, request_key) DO UPDATE SET
+            status = 'FAILED', updated_at = CURRENT_TIMESTAMP
+            WHERE {self.table_name}.status <> 'DONE'
+            """, [(self.run_id, self.spider_name, key, 'FAILED') for key in self.failed_rows])
+            self.failed_rows = set()
+        self.conn.commit()
+
+    def report(self):
+        """Per-city completion: list of (city, done, failed, total)."""
+        self.cur.execute(f"""
+        SELECT COALESCE(city, '-'), COUNT(*) FILTER (WHERE status = 'DONE'),
+               COUNT(*) FILTER (WHERE status = 'FAILED'), COUNT(*)
+        FROM {self.table_name}
+        WHERE run_id = %s AND spider = %s
+        GROUP BY COALESCE(city, '-')
+        ORDER BY 1
+        """, (self.run_id, self.spider_name))
+        return self.cur.fetchall()
+
+    def close(self):
+        self.flush()
+        self.cur.close()
+        release(self.conn)
+
+
+def main():
+    if len(sys.argv) != 3:
+        print("Usage: python -m aidid_house.frontier <spider> <run_id>")
+        sys.exit(1)
+    spider_name, run_id = sys.argv[1], sys.argv[2]
+    frontier = CrawlFrontier(acquire(), run_id, spider_name)
+    try:
+        rows = frontier.report()
+        if not rows:
+            print(f"No frontier rows for {spider_name} run {run_id}.")
+        for city, done, failed, total in rows:
+            print(f"{city}\t{done}/{total}\t{done * 100.0 / total:.1f}%\t{failed} failed")
+    finally:
+        frontier.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import sys
+import time
+from urllib.parse import urlencode
+import requests
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_PATH = os.path.join(os.path.dirname(__file__), 'data', 'browser_headers.json')
+
+
+# -------------------------------------------------------------------
+# Browser-header pool
+# -------------------------------------------------------------------
+# The ScrapeOps header list is kept in a local cache file so a crawl starts
+# without waiting on the API:
+#   * startup loads the cache file (even when stale), or the small list
+#     bundled in aidid_house/data/ when there is no cache yet;
+#   * a stale or missing cache is refreshed in a reactor thread after the
+#     spider opens, and the new list replaces the old one in place.
+# One pool per (endpoint, num_results) is shared by every crawler of a process.
+class HeaderPool:
+    _pools = {}
+
+    def __init__(self, endpoint, api_key, num_results, cache_path, ttl, timeout=30):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.num_results = num_results
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.headers = []
+        self.source = None
+        self.fetched_at = 0
+        self.refreshing = None
+
+    @classmethod
+    def shared(cls, endpoint, api_key, num_results, cache_path, ttl):
+        key = (endpoint, num_results, cache_path)
+        if key not in cls._pools:
+            pool = cls(endpoint, api_key, num_results, cache_path, ttl)
+            pool.load()
+            cls._pools[key] = pool
+        return cls._pools[key]
+
+    def load(self):
+        """Fill the pool from the cache file, falling back to the bundled list."""
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('endpoint') == self.endpoint and cached.get('headers'):
+                self.headers = cached['headers']
+                self.fetched_at = cached.get('fetched_at', 0)
+                self.source = 'cache'
+                return
+        except (OSError, ValueError):
+            pass
+        with open(FALLBACK_PATH, encoding='utf-8') as f:
+            self.headers = json.load(f)
+        self.fetched_at = 0
+        self.source = 'fallback'
+
+    def is_stale(self):
+        return time.time() - self.fetched_at > self.ttl
+
+    def fetch(self):
+        """Download a fresh list and write it to the cache file. Blocking."""
+        payload = {'api_key': self.api_key}
+        if self.num_results is not None:
+            payload['num_results'] = self.num_results
+        response = requests.get(self.endpoint, params=urlencode(payload), timeout=self.timeout)
+        response.raise_for_status()
+        headers = response.json().get('result', [])
+        if not headers:
+            raise ValueError(f"{self.endpoint} returned no headers")
+        fetched_at = time.time()
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'endpoint': self.endpoint, 'fetched_at': fetched_at, 'headers': headers}, f)
+        os.replace(tmp_path, self.cache_path)
+        return headers, fetched_at
+
+    def refresh_in_background(self):
+        """Start a refresh in the reactor thread pool unless one is running. Returns its Deferred."""
+        if self.refreshing is None:
+            from twisted.internet import threads
+            self.refreshing = threads.deferToThread(self.fetch)
+            self.refreshing.addCallbacks(self._refreshed, self._refresh_failed)
+        return self.refreshing
+
+    def _refreshed(self, result):
+        self.headers, self.fetched_at = result
+        self.source = 'api'
+        self.refreshing = None
+        logger.info(f"Browser-header pool refreshed from {self.endpoint}: {len(self.headers)} headers")
+
+    def _refresh_failed(self, failure):
+        self.refreshing = None
+        logger.warning(f"Browser-header refresh from {self.endpoint} failed, keeping {self.source} "
+                       f"pool of {len(self.headers)}: {failure.getErrorMessage()}")
+
+
+def main():
+    # python -m aidid_house.headers [endpoint]  -- refresh the cache now
+    from scrapy.utils.project import data_path, get_project_settings
+    settings = get_project_settings()
+    endpoint = sys.argv[1] if len(sys.argv) > 1 else settings.get('SCRAPEOPS_FAKE_BROWSER_HEADER_ENDPOINT')
+    pool = HeaderPool(endpoint, settings.get('SCRAPEOPS_API_KEY'), settings.get('SCRAPEOPS_NUM_RESULTS'),
+                      data_path(settings.get('SCRAPEOPS_HEADERS_CACHE_FILE')), settings.getint('SCRAPEOPS_HEADERS_TTL'))
+    headers, _ = pool.fetch()
+    print(f"Cached {len(headers)} headers from {endpoint} in {pool.cache_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import os
+import pickle
+import re
+import sqlite3
+import time
+import zlib
+from scrapy.extensions.httpcache import RFC2616Policy
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+
+from aidid_house.blocking import classify_block
+
+STORED_AT_HEADER = b'X-Cache-Stored-At'
+
+
+# -------------------------------------------------------------------
+# Per-endpoint TTL cache policy
+# -------------------------------------------------------------------
+# Only URLs matching HTTPCACHE_TTL_POLICIES (first match wins) are cached,
+# whatever Cache-Control the site sends. A cached response younger than
+# its TTL is served without touching the network. An older one is
+# revalidated with If-None-Match / If-Modified-Since when the site gave an
+# ETag or Last-Modified, otherwise it is fetched again.
+class EndpointTTLPolicy(RFC2616Policy):
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.ttls = [(re.compile(pattern), int(ttl)) for pattern, ttl in settings.getlist('HTTPCACHE_TTL_POLICIES')]
+
+    def ttl(self, request):
+        for pattern, ttl in self.ttls:
+            if pattern.search(request.url):
+                return ttl
+        return None
+
+    def should_cache_request(self, request):
+        return self.ttl(request) is not None and super().should_cache_request(request)
+
+    def should_cache_response(self, response, request):
+        # Never keep a block page around for an hour.
+        return response.status == 200 and classify_block(response, request) is None
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        stored_at = float(cachedresponse.headers.get(STORED_AT_HEADER, 0))
+        if time.time() - stored_at < self.ttl(request):
+            return True
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+    def is_cached_response_valid(self, cachedresponse, response, request):
+        return response.status == 304
+
+
+# -------------------------------------------------------------------
+# Compressed SQLite cache storage
+# -------------------------------------------------------------------
+# One SQLite file per spider under .scrapy/<HTTPCACHE_DIR>/, one row per
+# request fingerprint holding the zlib-compressed status, headers and body.
+# Entries unused for HTTPCACHE_MAX_AGE seconds are pruned when the spider
+# opens; stale entries are otherwise kept so they can be revalidated.
+class SqliteCacheStorage:
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.max_age = settings.getint('HTTPCACHE_MAX_AGE', 7 * 24 * 3600)
+        self.level = settings.getint('HTTPCACHE_COMPRESSION_LEVEL', 6)
+        self.db = None
+        self._fingerprinter = None
+
+    def open_spider(self, spider):
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        self.db = sqlite3.connect(os.path.join(self.cachedir, f"{spider.name}.sqlite"))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            fingerprint TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            stored_at REAL NOT NULL,
+            data BLOB NOT NULL
+        )
+        """)
+        if self.max_age:
+            self.db.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.max_age,))
+        self.db.commit()
+
+    def close_spider(self, spider):
+        self.db.commit()
+        self.db.close()
+
+    def retrieve_response(self, spider, request):
+        row = self.db.execute(
+            "SELECT stored_at, data FROM responses WHERE fingerprint = ?", (self._fingerprint(request),)
+        ).fetchone()
+        if row is None:
+            return None
+        stored_at, data = row
+        data = pickle.loads(zlib.decompress(data))
+        headers = Headers(data['headers'])
+        headers[STORED_AT_HEADER] = str(stored_at)
+        respcls = responsetypes.from_args(headers=headers, url=data['url'], body=data['body'])
+        return respcls(url=data['url'], headers=headers, status=data['status'], body=data['body'])
+
+    def store_response(self, spider, request, response):
+        data = {
+            'status': response.status,
+            'url': response.url,
+            'headers': {k: v for k, v in response.headers.items() if k != STORED_AT_HEADER},
+            'body': response.body,
+        }
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses (fingerprint, url, stored_at, data) VALUES (?, ?, ?, ?)",
+            (self._fingerprint(request), request.url, time.time(),
+             zlib.compress(pickle.dumps(data, protocol=4), self.level))
+        )
+        self.db.commit()
+
+    def touch(self, spider, request):
+        """Restart the TTL of an entry the site confirmed as unchanged (304)."""
+        self.db.execute(
+            "UPDATE responses SET stored_at = ? WHERE fingerprint = ?", (time.time(), self._fingerprint(request))
+        )
+        self.db.commit()
+
+    def _fingerprint(self, request):
+        return self._fingerprinter.fingerprint(request).hex()
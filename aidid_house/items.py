@@ -24,11 +24,13 @@ class AididHouseItem(scrapy.Item):
     review = scrapy.Field()
     images = scrapy.Field()
     house_id = scrapy.Field()
+    card_fingerprint = scrapy.Field()  # list card at the time of the detail fetch (see aidid_house.delta)
 
 class HouseUpdateItem(scrapy.Item):
     # This is a lightweight item used only to update the 'last_seen'
     # timestamp for an existing house URL.
     url = scrapy.Field()
+    card_fingerprint = scrapy.Field()
 
 class SalesmanItem(scrapy.Item):
     # This item is currently not used but kept for potential future use.
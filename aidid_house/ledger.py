@@ -0,0 +1,183 @@
+import argparse
+import statistics
+import sys
+from datetime import datetime, timezone
+from psycopg2.extras import Json
+from aidid_house.db import acquire, release
+
+
+# -------------------------------------------------------------------
+# Run ledger
+# -------------------------------------------------------------------
+# One row per finished crawl (CrawlRunLedger extension) and per
+# postgres2Azure sync: timings, volume, item outcomes, p95 pipeline latency
+# and error counts. `python -m aidid_house.ledger` compares the latest run of
+# every spider with the median of its previous runs and exits 1 when
+# throughput (items/sec) or coverage (listings seen) dropped by more than
+# --threshold.
+class RunLedger:
+    table_name = "crawl_runs"
+    columns = (
+        'kind', 'spider', 'run_id', 'shard', 'started_at', 'finished_at', 'duration_s', 'finish_reason',
+        'requests', 'responses', 'bytes', 'items', 'items_new', 'items_updated', 'items_unchanged',
+        'items_delisted', 'items_per_sec', 'pipeline_p95_ms', 'errors', 'download_errors',
+        'spider_exceptions', 'stats',
+    )
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cur = conn.cursor()
+
+    def ensure_table(self):
+        self.cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            id SERIAL PRIMARY KEY,
+            kind VARCHAR(10) NOT NULL,
+            spider TEXT NOT NULL,
+            run_id TEXT,
+            shard TEXT,
+            started_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ,
+            duration_s DOUBLE PRECISION,
+            finish_reason TEXT,
+            requests INTEGER,
+            responses INTEGER,
+            bytes BIGINT,
+            items INTEGER,
+            items_new INTEGER,
+            items_updated INTEGER,
+            items_unchanged INTEGER,
+            items_delisted INTEGER,
+            items_per_sec DOUBLE PRECISION,
+            pipeline_p95_ms DOUBLE PRECISION,
+            errors INTEGER,
+            download_errors INTEGER,
+            spider_exceptions INTEGER,
+            stats JSONB
+        )
+        """)
+        self.cur.execute(f"CREATE INDEX IF NOT EXISTS {self.table_name}_spider_idx "
+                         f"ON {self.table_name} (kind, spider, finished_at)")
+        self.conn.commit()
+
+    def record(self, row):
+        row = dict(row, stats=Json(row.get('stats') or {}))
+        self.cur.execute(f"""
+        INSERT INTO {self.table_name} ({', '.join(self.columns)})
+        VALUES ({', '.join(f'%({col})s' for col in self.columns)})
+        """, {col: row.get(col) for col in self.columns})
+        self.conn.commit()
+
+    def history(self, kind, spider, shard, limit):
+        """The latest `limit` runs of a spider (or sync table) and shard, newest first, as dicts."""
+        self.cur.execute(f"""
+        SELECT finished_at, run_id, shard, finish_reason, duration_s, items, items_new, items_updated,
+               items_unchanged, items_per_sec, pipeline_p95_ms, errors
+        FROM {self.table_name}
+        WHERE kind = %s AND spider = %s AND shard IS NOT DISTINCT FROM %s
+        ORDER BY finished_at DESC
+        LIMIT %s
+        """, (kind, spider, shard, limit))
+        names = [d[0] for d in self.cur.description]
+        return [dict(zip(names, row)) for row in self.cur.fetchall()]
+
+    def series(self, kind):
+        """(spider, shard) pairs with runs of this kind; shards of a sharded run are compared separately."""
+        self.cur.execute(f"SELECT DISTINCT spider, shard FROM {self.table_name} WHERE kind = %s ORDER BY 1, 2",
+                         (kind,))
+        return self.cur.fetchall()
+
+    def close(self):
+        self.cur.close()
+        release(self.conn)
+
+
+def crawl_row(spider, stats, shard=None, run_id=None):
+    """A ledger row for a finished crawl, from its Scrapy stats."""
+    started, finished = stats.get('start_time'), stats.get('finish_time') or datetime.now(timezone.utc)
+    duration = stats.get('elapsed_time_seconds') or ((finished - started).total_seconds() if started else None)
+    items = stats.get('item_scraped_count', 0)
+    # HouseUpdateItems are dropped after refreshing last_seen, so they count
+    # as processed listings too.
+    processed = items + stats.get('items/unchanged', 0)
+    return {
+        'kind': 'crawl',
+        'spider': spider.name,
+        'run_id': run_id,
+        'shard': shard,
+        'started_at': started,
+        'finished_at': finished,
+        'duration_s': duration,
+        'finish_reason': stats.get('finish_reason'),
+        'requests': stats.get('downloader/request_count', 0),
+        'responses': stats.get('downloader/response_count', 0),
+        'bytes': stats.get('downloader/response_bytes', 0),
+        'items': items,
+        'items_new': stats.get('items/new', 0),
+        'items_updated': stats.get('items/updated', 0),
+        'items_unchanged': stats.get('items/unchanged', 0),
+        'items_delisted': stats.get('items/delisted', 0),
+        'items_per_sec': round(processed / duration, 3) if duration else None,
+        'pipeline_p95_ms': stats.get('timing/pipeline/wall_ms_p95'),
+        'errors': stats.get('log_count/ERROR', 0) + stats.get('pipeline/errors', 0),
+        'download_errors': stats.get('downloader/exception_count', 0),
+        'spider_exceptions': sum(v for k, v in stats.items() if k.startswith('spider_exceptions/')),
+        'stats': {k: v for k, v in stats.items() if isinstance(v, (int, float, str))},
+    }
+
+
+def coverage(run):
+    """Listings seen by a run: new, updated and unchanged, or its items for pipelines that don't tell."""
+    seen = (run['items_new'] or 0) + (run['items_updated'] or 0) + (run['items_unchanged'] or 0)
+    return seen or run['items'] or 0
+
+
+def check(runs, threshold):
+    """Drops of the newest of `runs` against the median of the others: (metric, median, latest, change)."""
+    latest, previous = runs[0], runs[1:]
+    flags = []
+    for metric, value in (('items_per_sec', lambda r: r['items_per_sec']), ('coverage', coverage)):
+        history = [value(r) for r in previous if value(r) is not None]
+        current = value(latest)
+        if not history or current is None:
+            continue
+        median = statistics.median(history)
+        if median and (median - current) / median > threshold:
+            flags.append((metric, median, current, (current - median) / median))
+    return flags
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the latest runs with the trailing median.")
+    parser.add_argument('spiders', nargs='*', help="spiders (or synced tables) to check; default all")
+    parser.add_argument('--kind', choices=('crawl', 'sync'), default='crawl')
+    parser.add_argument('--window', type=int, default=10, help="previous runs in the median (default 10)")
+    parser.add_argument('--threshold', type=float, default=0.3, help="flagged relative drop (default 0.3)")
+    args = parser.parse_args()
+
+    ledger = RunLedger(acquire())
+    flagged = False
+    try:
+        for spider, shard in ledger.series(args.kind):
+            if args.spiders and spider not in args.spiders:
+                continue
+            runs = ledger.history(args.kind, spider, shard, args.window + 1)
+            name = f"{spider}/{shard}" if shard and shard != spider else spider
+            if len(runs) < 2:
+                print(f"{name:<16} not enough runs to compare")
+                continue
+            latest = runs[0]
+            print(f"{name:<16} {latest['finished_at']:%Y-%m-%d %H:%M} {latest['finish_reason'] or '-':<10} "
+                  f"{latest['items_per_sec'] or 0:>8.2f} items/s {coverage(latest):>8} listings "
+                  f"{latest['errors'] or 0:>5} errors (vs median of {len(runs) - 1})")
+            for metric, median, current, change in check(runs, args.threshold):
+                flagged = True
+                print(f"DROP {name} {metric}: median {median:g} -> {current:g} ({change:+.0%})")
+    finally:
+        ledger.close()
+    if flagged:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+from urllib.parse import urlparse
+from psycopg2.extras import execute_values
+
+
+# -------------------------------------------------------------------
+# Run-scoped liveness and delisting
+# -------------------------------------------------------------------
+# A listing is delisted when it was ACTIVE at the start of a run but nobody
+# saw it during the run. "Nobody" must cover every process of the run:
+#   * shards declared up front with CRAWL_SHARDS (e.g. one process per city
+#     group or per site), each identifying itself with CRAWL_SHARD;
+#   * workers sharing the Postgres queue (see aidid_house.scheduler);
+#   * earlier attempts of a resumed run (CRAWL_RUN_ID, see
+#     aidid_house.frontier), whose finished requests are skipped and so never
+#     yield their listings again.
+# Live URLs are published to crawl_live_urls and delisting is computed once,
+# by whichever process completes the run.
+
+def delist_domains(manifest, reported):
+    """
+    Domains to delist on once every shard of `manifest` has reported;
+    `reported` is {shard: (domains, live_count)}. Shards share domains (one
+    site split by city), so a shard that saw no listings, e.g. because it
+    was blocked, would otherwise lose its listings to a sibling's report:
+    then nothing is delisted.
+    """
+    if any(not reported[shard][1] for shard in manifest):
+        return []
+    return sorted({d for shard in manifest for d in reported[shard][0]})
+
+
+def spider_domains(spider):
+    return [d.lstrip('.') for d in (getattr(spider, 'allowed_domains', None) or [])]
+
+
+def in_domains(url, domains):
+    host = urlparse(url).hostname or ''
+    return any(host == d or host.endswith('.' + d) for d in domains)
+
+
+class RunLiveness:
+    def __init__(self, conn, run_id, table_name, shard, manifest):
+        self.conn = conn
+        self.cur = conn.cursor()
+        self.run_id = run_id
+        self.table_name = table_name
+        self.shard = shard
+        self.manifest = sorted(manifest)
+        self.empty_shards = []
+
+    def ensure_tables(self):
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS crawl_live_urls (
+            run_id TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            url TEXT NOT NULL,
+            PRIMARY KEY (run_id, table_name, url)
+        )
+        """)
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS crawl_shard_manifest (
+            run_id TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            shards TEXT[] NOT NULL,
+            delisted_at TIMESTAMP,
+            PRIMARY KEY (run_id, table_name)
+        )
+        """)
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS crawl_shards (
+            run_id TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            shard TEXT NOT NULL,
+            domains TEXT[] NOT NULL,
+            live_count INTEGER,
+            reported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_id, table_name, shard)
+        )
+        """)
+        self.conn.commit()
+
+    def publish(self, live_urls):
+        if live_urls:
+            execute_values(self.cur, """
+            INSERT INTO crawl_live_urls (run_id, table_name, url) VALUES %s
+            ON CONFLICT DO NOTHING
+            """, [(self.run_id, self.table_name, url) for url in live_urls])
+        self.conn.commit()
+
+    def report_shard(self, domains, live_count):
+        """
+        Record this shard as reported. Returns the domains to delist on (see
+        delist_domains) if this report completes the manifest (exactly one
+        process gets it), otherwise None.
+        """
+        self.cur.execute("""
+        INSERT INTO crawl_shard_manifest (run_id, table_name, shards) VALUES (%s, %s, %s)
+        ON CONFLICT DO NOTHING
+        """, (self.run_id, self.table_name, self.manifest))
+        # Row lock serialises concurrently finishing shards.
+        self.cur.execute("""
+        SELECT shards, delisted_at FROM crawl_shard_manifest
+        WHERE run_id = %s AND table_name = %s FOR UPDATE
+        """, (self.run_id, self.table_name))
+        shards, delisted_at = self.cur.fetchone()
+        if sorted(shards) != self.manifest:
+            self.conn.rollback()
+            raise ValueError(f"CRAWL_SHARDS {self.manifest} does not match run manifest {sorted(shards)}")
+        self.cur.execute("""
+        INSERT INTO crawl_shards (run_id, table_name, shard, domains, live_count) VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (run_id, table_name, shard) DO UPDATE SET
+        domains = ARRAY(SELECT DISTINCT unnest(crawl_shards.domains || EXCLUDED.domains)),
+        live_count = GREATEST(crawl_shards.live_count, EXCLUDED.live_count),
+        reported_at = CURRENT_TIMESTAMP
+        """, (self.run_id, self.table_name, self.shard, domains, live_count))
+        self.cur.execute("""
+        SELECT shard, domains, live_count FROM crawl_shards WHERE run_id = %s AND table_name = %s
+        """, (self.run_id, self.table_name))
+        reported = {shard: (domains, live_count) for shard, domains, live_count in self.cur.fetchall()}
+        if delisted_at is not None or not set(self.manifest) <= set(reported):
+            self.conn.commit()
+            return None
+        self.cur.execute("""
+        UPDATE crawl_shard_manifest SET delisted_at = CURRENT_TIMESTAMP
+        WHERE run_id = %s AND table_name = %s
+        """, (self.run_id, self.table_name))
+        self.conn.commit()
+        self.empty_shards = [shard for shard in self.manifest if not reported[shard][1]]
+        return delist_domains(self.manifest, reported)
+
+    def live_urls(self):
+        self.cur.execute(
+            "SELECT url FROM crawl_live_urls WHERE run_id = %s AND table_name = %s",
+            (self.run_id, self.table_name)
+        )
+        return {row[0] for row in self.cur.fetchall()}
+
+
+def urls_to_delist(conn, spider, table_name, initial_active_urls, live_urls):
+    """
+    Return the URLs of table_name that this process should mark as no longer
+    listed. Only listings on the spider's own domains are considered, and a
+    run that saw no listings at all delists nothing; nor does a sharded run
+    in which any shard saw none. For sharded
+    or shared-queue runs an empty set is returned until the run is complete.
+    With a CRAWL_RUN_ID, the live URLs of earlier attempts of the run count too.
+    """
+    settings = spider.crawler.settings
+    run_id = settings.get('CRAWL_RUN_ID')
+    manifest = settings.getlist('CRAWL_SHARDS')
+    worker = getattr(spider, 'crawl_worker', None)
+
+    if worker is None and not manifest and not run_id:
+        domains = spider_domains(spider) if live_urls else []
+        return {url for url in initial_active_urls - live_urls if in_domains(url, domains)}
+
+    if not run_id:
+        spider.logger.error("CRAWL_SHARDS requires CRAWL_RUN_ID; skipping delisting.")
+        return set()
+
+    shard = settings.get('CRAWL_SHARD') or spider.name
+    liveness = RunLiveness(conn, run_id, table_name, shard, manifest or [shard])
+    liveness.ensure_tables()
+    liveness.publish(live_urls)
+
+    if worker is not None and not worker.finish():
+        spider.logger.info(f"Other workers of run {run_id} are still running; leaving delisting to them.")
+        return set()
+
+    run_live_urls = liveness.live_urls()
+    if not manifest:
+        domains = spider_domains(spider) if run_live_urls else []
+    else:
+        seen_any = bool(run_live_urls if worker is not None else live_urls)
+        domains = liveness.report_shard(spider_domains(spider) if seen_any else [],
+                                        len(run_live_urls) if worker is not None else len(live_urls))
+        if domains is None:
+            spider.logger.info(f"Shard {shard} of run {run_id} reported; waiting for the other shards of {manifest}.")
+            return set()
+        if liveness.empty_shards:
+            spider.logger.warning(f"Shards {liveness.empty_shards} of run {run_id} saw no listings; skipping delisting.")
+            return set()
+        spider.logger.info(f"All shards of run {run_id} reported; computing delisting for {domains}.")
+    return {url for url in initial_active_urls - run_live_urls if in_domains(url, domains)}
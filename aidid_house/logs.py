@@ -0,0 +1,167 @@
+import json
+import logging
+import random
+import time
+import weakref
+from itemadapter import ItemAdapter
+from scrapy.logformatter import LogFormatter
+from scrapy.settings import Settings
+
+from aidid_house.items import HouseUpdateItem
+
+
+# -------------------------------------------------------------------
+# Sampled, structured event logging
+# -------------------------------------------------------------------
+# High-volume log lines (one per request, item or listing) go through
+# log_event() instead of a logger. Each event has a category and key=value
+# fields; per category it is
+#   * sampled: only a LOG_SAMPLING share of INFO/DEBUG events is written,
+#   * rate limited: at most LOG_RATE_LIMIT written per second,
+#   * counted: the LogSummary extension logs every LOG_SUMMARY_INTERVAL
+#     seconds how many events each category had and how many were written,
+#     and puts the totals in the log_events/... stats.
+# Warnings and errors are always written. Full detail for one listing or one
+# spider, whatever the sampling:
+#   scrapy crawl buyYungChing -s LOG_DETAIL_URLS=https://buy.yungching.com.tw/house/12345
+#   scrapy crawl buyYungChing -s LOG_DETAIL_SPIDERS=buyYungChing
+# With LOG_JSON every log record is written as one JSON object, with the
+# event's category and fields as keys.
+
+# Share of events written per category; categories not listed are written
+# in full. LOG_SAMPLING in the settings is merged over these.
+DEFAULT_SAMPLING = {
+    'headers': 0.0,
+    'item': 0.01,
+    'listing': 0.01,
+    'page': 0.1,
+    'response': 0.01,
+}
+
+
+def _value(value):
+    if isinstance(value, str) and (not value or ' ' in value or '=' in value):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class EventLog:
+    _logs = weakref.WeakKeyDictionary()
+
+    def __init__(self, settings):
+        self.sampling = {**DEFAULT_SAMPLING, **settings.getdict('LOG_SAMPLING')}
+        self.rate_limit = settings.getfloat('LOG_RATE_LIMIT', 10)
+        self.detail_urls = settings.getlist('LOG_DETAIL_URLS')
+        self.detail_spiders = set(settings.getlist('LOG_DETAIL_SPIDERS'))
+        # category -> [seen, written] since the last summary, and in total
+        self.window = {}
+        self.totals = {}
+        # category -> [tokens, last refill]
+        self.buckets = {}
+
+    @classmethod
+    def of(cls, spider):
+        """The event log of the spider's crawler (a settings-less default without one, e.g. in benchmarks)."""
+        crawler = getattr(spider, 'crawler', None)
+        key = crawler if crawler is not None else cls
+        if key not in cls._logs:
+            cls._logs[key] = cls(crawler.settings if crawler is not None else Settings())
+        return cls._logs[key]
+
+    def allow(self, spider_name, category, level=logging.INFO, url=None):
+        """Count an event and decide whether it is written."""
+        window = self.window.setdefault(category, [0, 0])
+        total = self.totals.setdefault(category, [0, 0])
+        window[0] += 1
+        total[0] += 1
+        if not self._wanted(spider_name, category, level, url):
+            return False
+        window[1] += 1
+        total[1] += 1
+        return True
+
+    def log(self, logger, spider_name, category, message, level=logging.INFO, **fields):
+        if not self.allow(spider_name, category, level, fields.get('url')):
+            return False
+        if logger.isEnabledFor(level):
+            text = ' '.join(f'{key}={_value(value)}' for key, value in fields.items())
+            logger.log(level, f"{message} {text}" if text else message,
+                       extra={'event': category, 'fields': fields})
+        return True
+
+    def _wanted(self, spider_name, category, level, url):
+        if level >= logging.WARNING or spider_name in self.detail_spiders:
+            return True
+        if url and any(detail in url for detail in self.detail_urls):
+            return True
+        rate = self.sampling.get(category, 1.0)
+        if rate < 1.0 and (rate <= 0 or random.random() >= rate):
+            return False
+        if self.rate_limit:
+            now = time.monotonic()
+            bucket = self.buckets.setdefault(category, [self.rate_limit, now])
+            bucket[0] = min(self.rate_limit, bucket[0] + (now - bucket[1]) * self.rate_limit)
+            bucket[1] = now
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+        return True
+
+    def take_window(self):
+        """Counts since the last call: {category: (seen, written)}."""
+        window, self.window = self.window, {}
+        return {category: tuple(counts) for category, counts in window.items()}
+
+
+def log_event(spider, category, message, level=logging.INFO, **fields):
+    """Log an event through the spider's logger, subject to its category's sampling and rate limit."""
+    return EventLog.of(spider).log(spider.logger, spider.name, category, message, level, **fields)
+
+
+class SampledLogFormatter(LogFormatter):
+    """
+    Scrapy's per-response and per-item messages, sampled like events: "Crawled"
+    lines as 'response' (or 'response_error' from status 400 on), "Scraped"
+    lines and the drops of unchanged listings (HouseUpdateItem) as 'item'.
+    """
+
+    def crawled(self, request, response, spider):
+        category = 'response' if response.status < 400 else 'response_error'
+        if EventLog.of(spider).allow(spider.name, category, logging.DEBUG, request.url):
+            return super().crawled(request, response, spider)
+        return None
+
+    def scraped(self, item, response, spider):
+        url = getattr(response, 'url', None)
+        if EventLog.of(spider).allow(spider.name, 'item', logging.DEBUG, url):
+            return super().scraped(item, response, spider)
+        return None
+
+    def dropped(self, item, exception, response, spider):
+        if not isinstance(item, HouseUpdateItem):
+            return super().dropped(item, exception, response, spider)
+        if EventLog.of(spider).allow(spider.name, 'item', logging.DEBUG, ItemAdapter(item).get('url')):
+            return dict(super().dropped(item, exception, response, spider), level=logging.DEBUG)
+        return None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and the event fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        event = getattr(record, 'event', None)
+        if event is not None:
+            entry['event'] = event
+            entry.update({key: value for key, value in record.fields.items() if key not in entry})
+        spider = getattr(record, 'spider', None)
+        if spider is not None:
+            entry['spider'] = spider.name
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
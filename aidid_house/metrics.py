@@ -0,0 +1,195 @@
+import bisect
+import time
+
+
+# -------------------------------------------------------------------
+# Live metrics in Prometheus text format
+# -------------------------------------------------------------------
+# A small process-wide registry of counters, gauges and histograms, served
+# as plain text (exposition format 0.0.4) by the MetricsEndpoint extension
+# on METRICS_PORT:
+#   scrapy crawl rakuya_trades -s METRICS_PORT=9410
+#   curl -s localhost:9410/metrics | grep -v '^#'
+# Gauges that describe the current state (scheduler depth, requests in
+# flight, proxy health) are read by collector callbacks at scrape time.
+# Anything in the process may record into REGISTRY; without an endpoint
+# the values are simply never read.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def clear(self):
+        self.values = {}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_labels(self.labelnames, key)} {_number(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        row = self.values.get(key)
+        if row is None:
+            # per-bucket counts (not cumulative; the last one is +Inf), sum
+            row = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        row[0][bisect.bisect_left(self.buckets, value)] += 1
+        row[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", _number(bound))])} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def _add(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        for collect in list(self.collectors):
+            collect()
+        lines = []
+        for metric in self.metrics.values():
+            if metric.values:
+                lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Recorded outside the extension (pipelines, frontier).
+DB_WRITE_SECONDS = REGISTRY.histogram(
+    'aidid_db_write_seconds', 'Time to write and commit a batch or item to Postgres.', ('table',),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+
+class timed:
+    """Context manager observing the time spent in its block into a histogram."""
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+# -------------------------------------------------------------------
+# HTTP endpoint
+# -------------------------------------------------------------------
+# One listener per process, shared by every crawler in it (see
+# aidid_house.runner) and closed with the last of them.
+_listener = None
+_users = 0
+
+
+def _resource(registry):
+    from twisted.web.resource import Resource
+
+    class MetricsResource(Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+            return registry.render().encode('utf-8')
+
+    return MetricsResource()
+
+
+def start_server(port, host='127.0.0.1', registry=REGISTRY):
+    """Serve `registry` on http://host:port/metrics (any path works); returns the bound port."""
+    global _listener, _users
+    from twisted.internet import reactor
+    from twisted.web.server import Site
+
+    _users += 1
+    if _listener is None:
+        site = Site(_resource(registry))
+        site.noisy = False
+        _listener = reactor.listenTCP(port, site, interface=host)
+    return _listener.getHost().port
+
+
+def stop_server():
+    global _listener, _users
+    _users = max(0, _users - 1)
+    if _users == 0 and _listener is not None:
+        listener, _listener = _listener, None
+        return listener.stopListening()
@@ -3,59 +3,214 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import json
+import logging
+import os
+import time
+import weakref
 from scrapy import signals
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.downloadermiddlewares.retry import get_retry_request
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Request
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.misc import load_object
 from urllib.parse import urlencode
 from random import randint
 import requests
+from scrapy.utils.project import data_path
+from twisted.internet import task
+
+from aidid_house.blocking import classify_block, response_classified
+from aidid_house.db import acquire
+from aidid_house.frontier import CrawlFrontier
+from aidid_house.headers import HeaderPool
+from aidid_house.items import AididHouseItem, RakuyaTradeItem
+from aidid_house.logs import log_event
+from aidid_house.proxies import ProxyPool, proxy_label
+from aidid_house.scheduler import PostgresScheduler
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+# Values kept for percentiles (reservoir sample): pipeline latencies per item
+# class, time-to-first-capture.
+LATENCY_SAMPLES = 10000
+# Parse times are grouped by response size: (upper bound in bytes, label).
+SIZE_BUCKETS = ((16 * 1024, '0-16k'), (64 * 1024, '16-64k'), (256 * 1024, '64-256k'), (1024 * 1024, '256k-1m'))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
 class AididHouseSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    # Lightweight instrumentation of the spider callbacks. It sits next to
+    # the spider (SPIDER_MIDDLEWARES 990), so the generator it iterates is the
+    # callback itself: the time spent inside each next() is the callback's
+    # wall and CPU time, without the rest of the middleware chain. Also
+    # counts items and requests per response, groups parse time by response
+    # size, and times each item class from its yield to item_scraped or
+    # item_dropped: the scraper's item queue plus the pipelines. Figures go
+    # to the timing/... stats; with CALLBACK_TIMING_DUMP_INTERVAL they are
+    # also appended every so often to
+    # .scrapy/<CALLBACK_TIMING_DIR>/<spider>-<run id>.jsonl.
+
+    def __init__(self, crawler):
+        self.stats = crawler.stats
+        self.interval = crawler.settings.getfloat('CALLBACK_TIMING_DUMP_INTERVAL', 0)
+        self.directory = crawler.settings.get('CALLBACK_TIMING_DIR', 'timing')
+        self.run_id = crawler.settings.get('CRAWL_RUN_ID')
+        # callback -> [responses, wall, cpu, max wall, items, requests, bytes]
+        self.callbacks = {}
+        # size bucket -> [responses, wall]
+        self.sizes = {}
+        # item class -> [items, wall, max wall]
+        self.pipeline = {}
+        # item class -> sampled latencies
+        self.latencies = {}
+        # item -> (item class, yielded at); weak, so items that never reach
+        # item_scraped/item_dropped (filtered further down) do not pile up
+        self.pending = weakref.WeakKeyDictionary()
+        self.dump_file = None
+        self.loop = None
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
+        if not crawler.settings.getbool('CALLBACK_TIMING_ENABLED', True):
+            raise NotConfigured
+        s = cls(crawler)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.item_done, signal=signals.item_scraped)
+        crawler.signals.connect(s.item_done, signal=signals.item_dropped)
+        crawler.signals.connect(s.item_done, signal=signals.item_error)
         return s
 
-    def process_spider_input(self, response, spider):
-        # Called for each response that goes through the spider
-        # middleware and into the spider.
-
-        # Should return None or raise an exception.
-        return None
+    def spider_opened(self, spider):
+        if self.interval:
+            run_id = self.run_id or time.strftime('%Y%m%d-%H%M%S')
+            path = os.path.join(data_path(self.directory, createdir=True), f"{spider.name}-{run_id}.jsonl")
+            self.dump_file = open(path, 'a', encoding='utf-8')
+            self.loop = task.LoopingCall(self.dump, spider)
+            self.loop.start(self.interval, now=False)
 
     def process_spider_output(self, response, result, spider):
-        # Called with the results returned from the Spider, after
-        # it has processed the response.
-
-        # Must return an iterable of Request, or item objects.
-        for i in result:
-            yield i
-
-    def process_spider_exception(self, response, exception, spider):
-        # Called when a spider or process_spider_input() method
-        # (from other spider middleware) raises an exception.
-
-        # Should return either None or an iterable of Request or item objects.
-        pass
-
-    def process_start_requests(self, start_requests, spider):
-        # Called with the start requests of the spider, and works
-        # similarly to the process_spider_output() method, except
-        # that it doesn’t have a response associated.
-
-        # Must return only requests (not items).
-        for r in start_requests:
-            yield r
-
-    def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
+        request = response.request
+        callback = getattr(request.callback, '__name__', None) if request is not None else None
+        wall = cpu = 0.0
+        items = requests = 0
+        result = iter(result)
+        try:
+            while True:
+                started, started_cpu = time.perf_counter(), time.thread_time()
+                try:
+                    output = next(result)
+                except StopIteration:
+                    break
+                finally:
+                    wall += time.perf_counter() - started
+                    cpu += time.thread_time() - started_cpu
+                if isinstance(output, Request):
+                    requests += 1
+                    yield output
+                    continue
+                items += 1
+                try:
+                    self.pending[output] = (type(output).__name__, time.perf_counter())
+                except TypeError:
+                    pass  # plain dicts cannot be weakly referenced; not timed
+                try:
+                    yield output
+                except BaseException:
+                    # The rest of the chain failed on (or abandoned) this item.
+                    self.pending.pop(output, None)
+                    raise
+        finally:
+            self._record(callback or 'parse', len(response.body), wall, cpu, items, requests)
+
+    def item_done(self, item, spider, **kwargs):
+        try:
+            pending = self.pending.pop(item, None)
+        except TypeError:
+            return
+        if pending is None:
+            return
+        name, yielded_at = pending
+        elapsed = time.perf_counter() - yielded_at
+        row = self.pipeline.setdefault(name, [0, 0.0, 0.0])
+        row[0] += 1
+        row[1] += elapsed
+        row[2] = max(row[2], elapsed)
+        samples = self.latencies.setdefault(name, [])
+        if len(samples) < LATENCY_SAMPLES:
+            samples.append(elapsed)
+        else:
+            slot = randint(0, row[0] - 1)
+            if slot < LATENCY_SAMPLES:
+                samples[slot] = elapsed
+
+    def _record(self, callback, size, wall, cpu, items, requests):
+        row = self.callbacks.setdefault(callback, [0, 0.0, 0.0, 0.0, 0, 0, 0])
+        row[0] += 1
+        row[1] += wall
+        row[2] += cpu
+        row[3] = max(row[3], wall)
+        row[4] += items
+        row[5] += requests
+        row[6] += size
+        bucket = next((label for limit, label in SIZE_BUCKETS if size < limit), '1m+')
+        size_row = self.sizes.setdefault(bucket, [0, 0.0])
+        size_row[0] += 1
+        size_row[1] += wall
+
+    def snapshot(self):
+        callbacks = {name: {
+            'responses': n, 'wall_ms': round(wall * 1000, 1), 'cpu_ms': round(cpu * 1000, 1),
+            'wall_ms_avg': round(wall * 1000 / n, 3), 'wall_ms_max': round(max_wall * 1000, 3),
+            'items': items, 'requests': requests,
+            'items_per_response': round(items / n, 2), 'requests_per_response': round(requests / n, 2),
+            'kb_avg': round(size / n / 1024, 1),
+        } for name, (n, wall, cpu, max_wall, items, requests, size) in self.callbacks.items()}
+        sizes = {bucket: {'responses': n, 'wall_ms_avg': round(wall * 1000 / n, 3)}
+                 for bucket, (n, wall) in self.sizes.items()}
+        pipeline = {name: {'items': n, 'wall_ms': round(wall * 1000, 1), 'wall_ms_avg': round(wall * 1000 / n, 3),
+                           'wall_ms_p95': round(percentile(self.latencies[name], 0.95) * 1000, 3),
+                           'wall_ms_max': round(max_wall * 1000, 3)}
+                    for name, (n, wall, max_wall) in self.pipeline.items()}
+        return {'callback': callbacks, 'size': sizes, 'pipeline': pipeline}
+
+    def publish(self):
+        for group, rows in self.snapshot().items():
+            for name, values in rows.items():
+                for key, value in values.items():
+                    self.stats.set_value(f'timing/{group}/{name}/{key}', value)
+        samples = [t for latencies in self.latencies.values() for t in latencies]
+        if samples:
+            self.stats.set_value('timing/pipeline/wall_ms_p95', round(percentile(samples, 0.95) * 1000, 3))
+
+    def dump(self, spider):
+        self.publish()
+        self.dump_file.write(json.dumps({'ts': round(time.time(), 3), 'spider': spider.name, **self.snapshot()},
+                                        ensure_ascii=False) + '\n')
+        self.dump_file.flush()
+
+    def spider_closed(self, spider):
+        if self.loop and self.loop.running:
+            self.loop.stop()
+        self.publish()
+        if self.dump_file:
+            self.dump(spider)
+            self.dump_file.close()
+        snapshot = self.snapshot()
+        for name, row in sorted(snapshot['callback'].items(), key=lambda kv: -kv[1]['wall_ms']):
+            spider.logger.info(f"Callback {name:<24} {row['responses']:>7} responses {row['wall_ms'] / 1000:>8.1f}s wall "
+                               f"{row['cpu_ms'] / 1000:>8.1f}s cpu {row['wall_ms_avg']:>8.2f} ms/response "
+                               f"{row['items_per_response']:>6.2f} items/response")
+        for name, row in sorted(snapshot['pipeline'].items(), key=lambda kv: -kv[1]['wall_ms']):
+            spider.logger.info(f"Pipeline {name:<24} {row['items']:>7} items {row['wall_ms_avg']:>8.2f} ms/item")
+        self.pending.clear()
 
 
 class AididHouseDownloaderMiddleware:
@@ -143,15 +298,20 @@ class ScrapeOpsFakeUserAgentMiddleware:
         random_user_agent = self._get_random_user_agent()
         request.headers['User-Agent'] = random_user_agent
 
-        print("************ NEW HEADER ATTACHED *******")
-        print(request.headers['User-Agent'])
+        log_event(spider, 'headers', "User agent attached", logging.DEBUG,
+                  url=request.url, user_agent=random_user_agent)
 
 
 class ScrapeOpsFakeBrowserHeaderAgentMiddleware:
+    # Headers come from a HeaderPool: the on-disk cache (or the bundled list)
+    # is used immediately and a stale pool is refreshed once the spider opens,
+    # so starting a crawl never waits on the ScrapeOps API.
 
     @classmethod
     def from_crawler(cls, crawler):
-        return cls(crawler.settings)
+        s = cls(crawler.settings)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
 
     def __init__(self, settings):
         self.scrapeops_api_key = settings.get('SCRAPEOPS_API_KEY')
@@ -159,17 +319,23 @@ class ScrapeOpsFakeBrowserHeaderAgentMiddleware:
                                                'http://headers.scrapeops.io/v1/browser-headers')
         self.scrapeops_fake_browser_headers_active = settings.get('SCRAPEOPS_FAKE_BROWSER_HEADER_ENABLED', True)
         self.scrapeops_num_results = settings.get('SCRAPEOPS_NUM_RESULTS')
-        self.headers_list = []
-        self._get_headers_list()
+        self.header_pool = HeaderPool.shared(
+            self.scrapeops_endpoint,
+            self.scrapeops_api_key,
+            self.scrapeops_num_results,
+            data_path(settings.get('SCRAPEOPS_HEADERS_CACHE_FILE', 'scrapeops_browser_headers.json')),
+            settings.getint('SCRAPEOPS_HEADERS_TTL', 24 * 3600),
+        )
         self._scrapeops_fake_browser_headers_enabled()
 
-    def _get_headers_list(self):
-        payload = {'api_key': self.scrapeops_api_key}
-        if self.scrapeops_num_results is not None:
-            payload['num_results'] = self.scrapeops_num_results
-        response = requests.get(self.scrapeops_endpoint, params=urlencode(payload))
-        json_response = response.json()
-        self.headers_list = json_response.get('result', [])
+    @property
+    def headers_list(self):
+        return self.header_pool.headers
+
+    def spider_opened(self, spider):
+        spider.logger.info(f"Browser-header pool: {len(self.headers_list)} headers from {self.header_pool.source}")
+        if self.scrapeops_fake_browser_headers_active and self.header_pool.is_stale():
+            self.header_pool.refresh_in_background()
 
     def _get_random_browser_header(self):
         random_index = randint(0, len(self.headers_list) - 1)
@@ -189,5 +355,429 @@ class ScrapeOpsFakeBrowserHeaderAgentMiddleware:
         request.headers['user-agent'] = random_browser_header['user-agent']
         request.headers['upgrade-insecure-requests'] = random_browser_header.get('upgrade-insecure-requests')
 
-        print("************ NEW HEADER ATTACHED *******")
-        print(request.headers)
\ No newline at end of file
+        log_event(spider, 'headers', "Browser header attached", logging.DEBUG,
+                  url=request.url, user_agent=random_browser_header['user-agent'])
+
+
+class CrawlFrontierMiddleware:
+    # Checkpoint/resume for long crawls. Requests carrying meta['frontier_key']
+    # are recorded in the crawl_frontier table; a request is marked done once
+    # its callback and all the tracked requests it spawned have completed.
+    # Restarting with the same CRAWL_RUN_ID skips done requests. Requests
+    # whose callback failed or never ran are marked failed and keep their
+    # parents pending, so a restart retries them (see aidid_house.frontier).
+
+    def __init__(self, crawler, run_id):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.run_id = run_id
+        self.flush_size = crawler.settings.getint('FRONTIER_FLUSH_SIZE', 100)
+        self.frontier = None
+        self.done_keys = set()
+        self.parents = {}
+        self.open_children = {}
+        self.finished_callbacks = set()
+        # keys scheduled in this process whose callback has not run yet
+        self.waiting = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        run_id = crawler.settings.get('CRAWL_RUN_ID')
+        if not run_id:
+            raise NotConfigured
+        # Parent/child state lives in this process, which cannot follow
+        # requests another worker of the shared queue picks up. The queue
+        # keeps unfinished requests of the run itself, so it resumes without us.
+        if issubclass(load_object(crawler.settings['SCHEDULER']), PostgresScheduler):
+            raise NotConfigured("CrawlFrontierMiddleware does not run with the shared Postgres queue")
+        s = cls(crawler, run_id)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.request_dropped, signal=signals.request_dropped)
+        return s
+
+    def spider_opened(self, spider):
+        self._open(spider)
+
+    def _open(self, spider):
+        if self.frontier is not None:
+            return
+        self.frontier = CrawlFrontier(acquire(), self.run_id, spider.name, self.flush_size)
+        self.frontier.ensure_table()
+        self.done_keys = self.frontier.load_done()
+        spider.logger.info(f"Frontier run {self.run_id}: {len(self.done_keys)} requests already done.")
+
+    def process_start_requests(self, start_requests, spider):
+        self._open(spider)
+        for r in start_requests:
+            if self._track(r, parent=None):
+                yield r
+
+    def process_spider_output(self, response, result, spider):
+        key = response.meta.get('frontier_key')
+        for i in result:
+            if isinstance(i, Request) and not self._track(i, parent=key):
+                continue
+            yield i
+        if key:
+            self.waiting.discard(key)
+            self.finished_callbacks.add(key)
+            self._maybe_done(key)
+
+    def process_spider_exception(self, response, exception, spider):
+        key = response.meta.get('frontier_key')
+        if key and key in self.waiting:
+            self.waiting.discard(key)
+            self._fail(key)
+
+    def request_dropped(self, request, spider):
+        # Duplicates filtered by the scheduler never reach a callback;
+        # stop the parent from waiting on them.
+        key = request.meta.get('frontier_key')
+        self.waiting.discard(key)
+        if key and self.parents.get(key):
+            self._release(self.parents[key].pop())
+
+    def spider_closed(self, spider, reason):
+        if self.frontier is None:
+            return
+        if reason == 'finished':
+            # Lost to download errors, blocks or HTTP errors: nothing of the
+            # run will call them any more.
+            for key in self.waiting:
+                self._fail(key)
+            self.waiting = set()
+        self.frontier.flush()
+        for city, done, failed, total in self.frontier.report():
+            spider.logger.info(f"Frontier {city}: {done}/{total} requests done, {failed} failed.")
+        self.frontier.close()
+
+    def _track(self, request, parent):
+        key = request.meta.get('frontier_key')
+        if not key:
+            return True
+        if key in self.done_keys:
+            self.stats.inc_value('frontier/skipped')
+            return False
+        if parent:
+            self.parents.setdefault(key, []).append(parent)
+            self.open_children[parent] = self.open_children.get(parent, 0) + 1
+        self.frontier.mark_pending(key, request.meta.get('frontier_city'), request.meta.get('frontier_page'))
+        self.waiting.add(key)
+        return True
+
+    def _fail(self, key):
+        self.frontier.mark_failed(key)
+        self.stats.inc_value('frontier/failed')
+
+    def _maybe_done(self, key):
+        if key not in self.finished_callbacks or self.open_children.get(key, 0) > 0:
+            return
+        self.finished_callbacks.discard(key)
+        self.open_children.pop(key, None)
+        self.done_keys.add(key)
+        self.frontier.mark_done(key)
+        self.stats.inc_value('frontier/completed')
+        for parent in self.parents.pop(key, []):
+            self._release(parent)
+
+    def _release(self, parent):
+        self.open_children[parent] -= 1
+        self._maybe_done(parent)
+
+
+class RequestPriorityMiddleware:
+    # Orders requests by what they are for, as tagged by the spiders in
+    # meta['request_type']: new-listing detail pages/APIs first (every hop
+    # before the item is yielded), then list pages, then enrichment (requests
+    # that complete no item). Also measures time-to-first-capture: from the
+    # moment a new listing or trade is discovered on a list page until its
+    # AididHouseItem or RakuyaTradeItem is yielded. Percentiles come from a reservoir of LATENCY_SAMPLES values.
+
+    def __init__(self, stats, priorities):
+        self.stats = stats
+        self.priorities = priorities
+        self.ttfc_count = 0
+        self.ttfc_total = 0.0
+        self.ttfc_max = 0.0
+        self.ttfc_samples = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler.stats, crawler.settings.getdict('REQUEST_TYPE_PRIORITIES'))
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_start_requests(self, start_requests, spider):
+        for r in start_requests:
+            yield self._prioritize(r)
+
+    def process_spider_output(self, response, result, spider):
+        discovered_at = response.meta.get('discovered_at')
+        for i in result:
+            if isinstance(i, Request):
+                self._prioritize(i)
+                if 'discovered_at' not in i.meta:
+                    if discovered_at is not None:
+                        i.meta['discovered_at'] = discovered_at
+                    elif i.meta.get('request_type') in ('detail', 'enrichment'):
+                        # First request made for a listing found on a list page.
+                        i.meta['discovered_at'] = time.time()
+            elif isinstance(i, (AididHouseItem, RakuyaTradeItem)) and discovered_at is not None:
+                self._sample(time.time() - discovered_at)
+            yield i
+
+    def spider_closed(self, spider):
+        if not self.ttfc_count:
+            return
+        samples = sorted(self.ttfc_samples)
+        self.stats.set_value('freshness/ttfc_count', self.ttfc_count)
+        self.stats.set_value('freshness/ttfc_avg', round(self.ttfc_total / self.ttfc_count, 3))
+        self.stats.set_value('freshness/ttfc_p50', round(samples[len(samples) // 2], 3))
+        self.stats.set_value('freshness/ttfc_p95', round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3))
+        self.stats.set_value('freshness/ttfc_max', round(self.ttfc_max, 3))
+
+    def _sample(self, ttfc):
+        self.ttfc_count += 1
+        self.ttfc_total += ttfc
+        self.ttfc_max = max(self.ttfc_max, ttfc)
+        if len(self.ttfc_samples) < LATENCY_SAMPLES:
+            self.ttfc_samples.append(ttfc)
+        else:
+            slot = randint(0, self.ttfc_count - 1)
+            if slot < LATENCY_SAMPLES:
+                self.ttfc_samples[slot] = ttfc
+
+    def _prioritize(self, request):
+        request_type = request.meta.get('request_type')
+        if request_type in self.priorities:
+            request.priority = self.priorities[request_type]
+            self.stats.inc_value(f'request_type/{request_type}')
+        return request
+
+
+class ProxyPoolMiddleware:
+    # Routes requests through the spider's proxy pool (`proxy_pool` attribute,
+    # a key of PROXY_POOLS) instead of a proxy hardcoded in meta. Runs before
+    # HttpProxyMiddleware, so every attempt, retries included, picks an
+    # endpoint and a retry goes to a different one. A proxy set explicitly in
+    # meta is left alone. Its process_response runs first, before
+    # HttpCompressionMiddleware and RetryMiddleware: ban statuses and 5xx are
+    # scored here, everything else once BlockDetectionMiddleware has judged
+    # the decompressed body (response_classified). Endpoint URLs may refer to
+    # environment variables (${NAME}) for their credentials. A spider whose
+    # pool is undefined or has no usable endpoint is closed rather than
+    # crawling without a proxy. While every endpoint is cooling down,
+    # requests are held back until the first one comes back.
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.pools = crawler.settings.getdict('PROXY_POOLS')
+        self.ban_codes = set(crawler.settings.getlist('PROXY_BAN_CODES', [403, 429]))
+        self.cooldown = crawler.settings.getfloat('PROXY_COOLDOWN', 30)
+        self.max_cooldown = crawler.settings.getfloat('PROXY_MAX_COOLDOWN', 600)
+        self.max_failures = crawler.settings.getint('PROXY_MAX_FAILURES', 3)
+        # One downloader slot per domain and proxy, so AdaptiveConcurrency
+        # tunes each proxy's load on each site separately.
+        self.slot_per_proxy = crawler.settings.getbool('ADAPTIVE_CONCURRENCY_PER_PROXY')
+        self.deferred = crawler.settings.getbool('BLOCK_DETECTION_ENABLED', True)
+        self.pool = None
+        self.unconfigured = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PROXY_POOL_ENABLED', True):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        if s.deferred:
+            crawler.signals.connect(s.response_classified, signal=response_classified)
+        return s
+
+    def spider_opened(self, spider):
+        name = getattr(spider, 'proxy_pool', None)
+        if not name:
+            return
+        if name not in self.pools:
+            self._unconfigured(spider, f"Proxy pool {name!r} is not defined in PROXY_POOLS")
+            return
+        urls = [os.path.expandvars(url) for url in self.pools[name]]
+        missing = [proxy_label(url) for url in urls if '${' in url]
+        if missing:
+            spider.logger.error(f"Proxy pool {name!r}: credentials for {missing} are not set in the environment; "
+                                f"skipping those endpoints.")
+        urls = [url for url in urls if '${' not in url]
+        if not urls:
+            self._unconfigured(spider, f"Proxy pool {name!r} has no usable endpoints")
+            return
+        self.pool = ProxyPool.shared(name, urls, cooldown=self.cooldown,
+                                     max_cooldown=self.max_cooldown, max_failures=self.max_failures)
+        spider.logger.info(f"Proxy pool {name}: {len(self.pool.proxies)} endpoints")
+
+    def process_request(self, request, spider):
+        if self.unconfigured:
+            raise IgnoreRequest(f"Proxy pool {spider.proxy_pool!r} is not configured")
+        if self.pool is None:
+            return None
+        self._settle(request)
+        previous = request.meta.get('proxy_pool_proxy')
+        if 'proxy' in request.meta and request.meta['proxy'] != previous:
+            return None
+        proxy = self.pool.choose(exclude=previous)
+        if proxy is None:
+            from twisted.internet import reactor
+            self.stats.inc_value('proxy/backoff')
+            return task.deferLater(reactor, self.pool.wait(), self.process_request, request, spider)
+        request.meta['proxy'] = proxy.url
+        request.meta['proxy_pool_proxy'] = proxy.url
+        request.meta['proxy_pool_start'] = time.time()
+        if self.slot_per_proxy:
+            request.meta['download_slot'] = f"{urlparse_cached(request).hostname}@{proxy.label}"
+        self.pool.started(proxy.url)
+        self.stats.inc_value(f'proxy/{proxy.label}/requests')
+        return None
+
+    def process_response(self, request, response, spider):
+        url, started_at = self._attempt(request)
+        if url is None:
+            return response
+        latency = None if 'cached' in response.flags else time.time() - started_at
+        label = self.pool.by_url[url].label
+        if response.status in self.ban_codes:
+            self.pool.banned(url, latency)
+            self.stats.inc_value(f'proxy/{label}/bans')
+        elif response.status >= 500:
+            self.pool.failed(url, latency)
+            self.stats.inc_value(f'proxy/{label}/errors')
+        elif self.deferred:
+            # The body may still be compressed; scored in response_classified().
+            request.meta['proxy_pool_pending'] = (url, latency)
+        elif classify_block(response, request):
+            self.pool.banned(url, latency)
+            self.stats.inc_value(f'proxy/{label}/bans')
+        else:
+            self.pool.succeeded(url, latency)
+        return response
+
+    def response_classified(self, request, response, block, spider):
+        pending = request.meta.pop('proxy_pool_pending', None)
+        if pending is None or self.pool is None:
+            return
+        url, latency = pending
+        if block is None:
+            self.pool.succeeded(url, latency)
+        else:
+            self.pool.banned(url, latency)
+            self.stats.inc_value(f'proxy/{self.pool.by_url[url].label}/bans')
+
+    def process_exception(self, request, exception, spider):
+        url, _ = self._attempt(request)
+        if url is not None:
+            self.pool.failed(url)
+            self.stats.inc_value(f'proxy/{self.pool.by_url[url].label}/errors')
+        return None
+
+    def spider_closed(self, spider):
+        if self.pool is None:
+            return
+        for row in self.pool.snapshot():
+            if row['latency'] is not None:
+                self.stats.set_value(f"proxy/{row['proxy']}/latency", row['latency'])
+            self.stats.set_value(f"proxy/{row['proxy']}/success", row['success'])
+            spider.logger.info(f"Proxy {row['proxy']}: {row['requests']} requests, {row['errors']} errors, "
+                               f"{row['bans']} bans, success {row['success']}, latency {row['latency']}")
+
+    def _unconfigured(self, spider, message):
+        # Fail closed: a spider that names a pool never goes out directly.
+        from twisted.internet import reactor
+        spider.logger.error(f"{message}; closing the spider.")
+        self.unconfigured = True
+        reactor.callLater(0, self.crawler.engine.close_spider, spider, 'proxy_pool_unconfigured')
+
+    def _settle(self, request):
+        # A response redirected (or refreshed) before BlockDetectionMiddleware
+        # saw it comes back as a new request: the endpoint did deliver it.
+        pending = request.meta.pop('proxy_pool_pending', None)
+        if pending is not None and pending[0] in self.pool.by_url:
+            self.pool.succeeded(*pending)
+
+    def _attempt(self, request):
+        # (endpoint, start time) of this attempt; reported only once per attempt.
+        url = request.meta.get('proxy_pool_proxy')
+        started_at = request.meta.pop('proxy_pool_start', None)
+        if self.pool is None or started_at is None or url not in self.pool.by_url:
+            return None, None
+        return url, started_at
+
+
+class BlockDetectionMiddleware:
+    # Catches block and soft-block responses (see aidid_house.blocking) before
+    # they reach a callback. They are retried, which gives them another proxy
+    # and header set, up to BLOCK_RETRY_TIMES per request. Across the run,
+    # block retries are capped at BLOCK_RETRY_BUDGET of all requests. Once
+    # either limit is hit the request is dropped. Every class is counted in
+    # blocked/<class>, blocked/retried/<class> and blocked/gave_up/<class>.
+
+    def __init__(self, stats, signals, retry_times, budget, budget_min):
+        self.stats = stats
+        self.signals = signals
+        self.retry_times = retry_times
+        self.budget = budget
+        self.budget_min = budget_min
+        self.retried = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('BLOCK_DETECTION_ENABLED', True):
+            raise NotConfigured
+        return cls(crawler.stats, crawler.signals, settings.getint('BLOCK_RETRY_TIMES', 2),
+                   settings.getfloat('BLOCK_RETRY_BUDGET', 0.2), settings.getint('BLOCK_RETRY_BUDGET_MIN', 20))
+
+    def process_response(self, request, response, spider):
+        block = classify_block(response, request)
+        self.signals.send_catch_log(response_classified, request=request, response=response, block=block,
+                                    spider=spider)
+        if block is None:
+            return response
+        self.stats.inc_value(f'blocked/{block}')
+        if self.retried < max(self.budget_min, self.budget * self.stats.get_value('downloader/request_count', 0)):
+            # Logs the give-up itself once the request is out of retries.
+            retry = get_retry_request(request, spider=spider, reason=f'blocked:{block}',
+                                      max_retry_times=self.retry_times, stats_base_key='blocked/retry')
+            if retry is not None:
+                self.retried += 1
+                self.stats.inc_value(f'blocked/retried/{block}')
+                return retry
+        else:
+            spider.logger.warning(f"Block retry budget used up; dropping {request.url} ({block})")
+        self.stats.inc_value(f'blocked/gave_up/{block}')
+        raise IgnoreRequest(f"blocked: {block}")
+
+
+class ConditionalHttpCacheMiddleware(HttpCacheMiddleware):
+    # Scrapy's cache middleware, placed before ProxyPoolMiddleware so cache
+    # hits never take a proxy, and after HttpCompressionMiddleware so it
+    # stores (and block-checks) decompressed bodies. A 304 restarts the
+    # entry's TTL (storage touch()); hit ratios are added to the stats.
+
+    def process_response(self, request, response, spider):
+        cachedresponse = request.meta.get('cached_response')
+        result = super().process_response(request, response, spider)
+        if cachedresponse is not None and result is cachedresponse and hasattr(self.storage, 'touch'):
+            self.storage.touch(spider, request)
+        return result
+
+    def spider_closed(self, spider):
+        hit = self.stats.get_value('httpcache/hit', 0)
+        revalidated = self.stats.get_value('httpcache/revalidate', 0)
+        lookups = hit + self.stats.get_value('httpcache/miss', 0) + revalidated \
+            + self.stats.get_value('httpcache/invalidate', 0)
+        if lookups:
+            # Served from disk without the body crossing the network, with or
+            # without a conditional request.
+            self.stats.set_value('httpcache/hit_ratio', round(hit / lookups, 3))
+            self.stats.set_value('httpcache/body_saved_ratio', round((hit + revalidated) / lookups, 3))
+        super().spider_closed(spider)
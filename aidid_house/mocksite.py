@@ -0,0 +1,601 @@
+import argparse
+import gzip
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+import zlib
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.exceptions import NotConfigured
+
+
+# -------------------------------------------------------------------
+# Local mock of the crawled sites
+# -------------------------------------------------------------------
+# MockSiteServer answers the endpoints the spiders use with synthetic but
+# well-formed data, so a whole crawl (scheduler, middlewares, pipelines,
+# Postgres) runs without network access:
+#   www.sinyi.com.tw        list pages and detail pages with __NEXT_DATA__
+#   www.rakuya.com.tw       window.sellSearch pages, items, environment and
+#                           realprice APIs
+#   buy.houseprice.tw       BuyCaseList and BuyCaseDetail JSON, list and detail
+#                           pages
+#   www.hbhousing.com.tw    dataService.aspx POST, map and detail pages
+#   buy.yungching.com.tw    list and detail pages, POI API
+#   headers.scrapeops.io    browser-header list (for HeaderPool tests)
+# Latency, error rate, ban rate (403/429/captcha) and dataset size are
+# configurable. MockSiteDownloadHandler (MOCK_SITE_URL) sends every request
+# to http://<server>/<original host><original path> and hands the response
+# back under the original URL, so spiders run unchanged:
+#   python -m aidid_house.mocksite crawl buyXinyi --latency 0.05 --ban-rate 0.02
+#   python -m aidid_house.mocksite serve --port 8780 --size 50
+#   python -m aidid_house.mocksite shared buyXinyi --workers 3   # needs Postgres
+
+CITIES = ['台北市', '新北市', '桃園市', '台中市', '台南市', '高雄市', '基隆市', '新竹市']
+DISTRICTS = ['中正區', '大安區', '信義區', '中山區', '北屯區', '東區', '前鎮區', '板橋區']
+LAYOUTS = ['2房1廳1衛', '3房2廳2衛', '4房2廳2衛', '1房1廳1衛']
+POI_CATEGORIES = ['交通', '醫療', '學校', '超商', '購物', '停車場']
+CAPTCHA_PAGE = b'<html><head><title>Access Denied</title></head><body>captcha required</body></html>'
+
+
+def _html(body, head=''):
+    return f'<!DOCTYPE html><html><head><meta charset="utf-8">{head}</head><body>{body}</body></html>'
+
+
+def _city_key(city):
+    # Stable across processes, unlike hash().
+    return zlib.crc32(city.encode()) % 1000
+
+
+def _listing(site, key):
+    """Deterministic fields of one synthetic listing."""
+    rng = random.Random(f'{site}:{key}')
+    city = rng.choice(CITIES)
+    return {
+        'rng': rng,
+        'name': f'{rng.choice(["陽光", "綠意", "幸福", "河岸", "學府"])}{rng.choice(["華廈", "大樓", "公寓"])} {key}',
+        'city': city,
+        'district': rng.choice(DISTRICTS),
+        'address': f'{city}{rng.choice(DISTRICTS)}{rng.choice(["中山", "民生", "復興", "光明"])}路{rng.randint(1, 400)}號',
+        'price': rng.randint(500, 8000),
+        'space': round(rng.uniform(15, 80), 2),
+        'layout': rng.choice(LAYOUTS),
+        'age': round(rng.uniform(0, 45), 1),
+        'floor': rng.randint(1, 20),
+        'floors': rng.randint(20, 30),
+        'lat': round(rng.uniform(22.0, 25.2), 6),
+        'lon': round(rng.uniform(120.1, 121.9), 6),
+        'community': f'社區{rng.randint(1, 500)}',
+    }
+
+
+def _card(h):
+    # Title, area and price as list cards show them: the unit price and the
+    # struck-through old price come before the total.
+    return (f'<div class="title">{h["name"]}</div><span>{h["space"]}坪</span>'
+            f'<span class="unit">{h["price"] / h["space"]:.1f}萬/坪</span>'
+            f'<span class="price"><del>{h["price"] + 120:,}萬</del> {h["price"]:,}萬</span>')
+
+
+def _pois(rng, n=6):
+    return [{'poiSubName': f'POI {i}', 'poiTitle': rng.choice(POI_CATEGORIES), 'poiLat': round(rng.uniform(22, 25), 6),
+             'poiLng': round(rng.uniform(120, 122), 6), 'distance': rng.randint(50, 1500),
+             'walkTime': rng.randint(1, 20), 'walkDistance': rng.randint(50, 1500)} for i in range(n)]
+
+
+class MockSite:
+    def __init__(self, size=200, latency=0.05, error_rate=0.0, ban_rate=0.0, seed=0):
+        self.size = size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.ban_rate = ban_rate
+        self.random = random.Random(seed)
+        self.routes = [
+            ('GET', 'www.sinyi.com.tw', r'/buy/list/(?P<city>[^/]+)/default-desc/(?P<page>\d+)', self.sinyi_list),
+            ('GET', 'www.sinyi.com.tw', r'/buy/house/(?P<id>\w+)', self.sinyi_case),
+            ('GET', 'www.rakuya.com.tw', r'/sell/result', self.rakuya_result),
+            ('GET', 'www.rakuya.com.tw', r'/sell_item/info', self.rakuya_case),
+            ('GET', 'www.rakuya.com.tw', r'/sell_item/api/item-environment/list', self.rakuya_environment),
+            ('GET', 'www.rakuya.com.tw', r'/realprice/realprice_sell_search/get-result', self.rakuya_realprice),
+            ('GET', 'www.rakuya.com.tw', r'/realprice/api/info/history', self.rakuya_history),
+            ('GET', 'buy.houseprice.tw', r'/ws/BuyCaseList/Search/(?P<city>[^/]+)_city/', self.houseprice_api),
+            ('GET', 'buy.houseprice.tw', r'/list/(?P<city>[^/]+)_city/', self.houseprice_list),
+            ('GET', 'buy.houseprice.tw', r'/ws/BuyCaseDetail/(?P<id>\w+)', self.houseprice_case_api),
+            ('GET', 'buy.houseprice.tw', r'/house/(?P<id>\w+)', self.houseprice_case),
+            ('GET', 'www.hbhousing.com.tw', r'/BuyHouse/', self.hb_start),
+            ('POST', 'www.hbhousing.com.tw', r'/ajax/dataService\.aspx', self.hb_search),
+            ('GET', 'www.hbhousing.com.tw', r'/Detail/map\.aspx', self.hb_map),
+            ('GET', 'www.hbhousing.com.tw', r'/detail/', self.hb_case),
+            ('GET', 'buy.yungching.com.tw', r'/list/(?P<city>[^/]+)-_c', self.yungching_list),
+            ('GET', 'buy.yungching.com.tw', r'/house/(?P<id>\w+)', self.yungching_case),
+            ('GET', 'buy.yungching.com.tw', r'/api/v2/information/poi', self.yungching_poi),
+            ('GET', 'headers.scrapeops.io', r'/v1/browser-headers', self.scrapeops_headers),
+        ]
+        self.routes = [(method, host, re.compile(pattern + '$'), fn) for method, host, pattern, fn in self.routes]
+
+    def pages(self, per_page):
+        return max(1, math.ceil(self.size / per_page))
+
+    def handle(self, method, host, path, query, form):
+        """(status, content type, body) for one request."""
+        for route_method, route_host, pattern, fn in self.routes:
+            match = pattern.match(path)
+            if route_method == method and route_host == host and match:
+                break
+        else:
+            return 404, 'text/plain', b'not found'
+        if self.random.random() < self.ban_rate:
+            return self.random.choice([(403, 'text/html', CAPTCHA_PAGE), (429, 'text/plain', b'Too Many Requests'),
+                                       (200, 'text/html', CAPTCHA_PAGE)])
+        if self.random.random() < self.error_rate:
+            return self.random.choice([500, 502, 503]), 'text/plain', b'error'
+        params = {k: v[0] for k, v in {**query, **form}.items()}
+        params.update({k: unquote(v) for k, v in match.groupdict().items()})
+        body = fn(params)
+        if isinstance(body, str):
+            return 200, 'text/html; charset=utf-8', body.encode()
+        return 200, 'application/json; charset=utf-8', json.dumps(body, ensure_ascii=False).encode()
+
+    # --- Sinyi ---
+    def sinyi_list(self, p):
+        city, page = p['city'], int(p['page'])
+        ids = [f'{_city_key(city)}{(page - 1) * 20 + i:05d}' for i in range(20) if (page - 1) * 20 + i < self.size]
+        cards = ''.join(f'<div class="buy-list-item"><a href="/buy/house/{i}">{_card(_listing("sinyi", i))}</a></div>'
+                        for i in ids)
+        next_data = '<script id="__NEXT_DATA__" type="application/json">{"props":{}}</script>'
+        return _html(f'<div>全部 ({self.size})</div>{cards}{next_data}')
+
+    def sinyi_case(self, p):
+        h = _listing('sinyi', p['id'])
+        basic_info = [('車位', '無'), ('管理費', '2000元')]
+        content = {'latitude': h['lat'], 'longitude': h['lon'], 'name': h['name'], 'address': h['address'],
+                   'totalPrice': h['price'], 'areaBuilding': h['space'], 'layout': h['layout'], 'age': h['age'],
+                   'floor': h['floor'], 'totalFloor': h['floors'], 'communityName': h['community'],
+                   'images': [{'url': f'https://res.sinyi.com.tw/{p["id"]}/1.jpg'}]}
+        detail = {'lifeInfo': _pois(h['rng'], 4), 'utilitylifeInfo': _pois(h['rng'], 4),
+                  'basicInfo': [{'title': t, 'value': v} for t, v in basic_info], 'features': ['近捷運']}
+        # Some pages lack a field in the state, so the spider's XPath fallback runs too.
+        missing = h['rng'].choice(['community', 'features', None, None, None])
+        if missing == 'community':
+            del content['communityName']
+        elif missing == 'features':
+            del detail['features']
+        next_data = {'props': {'initialReduxState': {'buyReducer': {
+            'contentData': content,
+            'detailData': detail,
+            'tradeData': {'list': [{'date': '2023-05', 'price': h['price'] - 100}]},
+        }}}}
+        basic = ''.join(f'<div class="buy-content-basic-cell"><div class="basic-title">{t}</div>'
+                        f'<div class="basic-value">{v}</div></div>' for t, v in basic_info)
+        return _html(
+            f'<span class="buy-content-title-name">{h["name"]}</span>'
+            f'<span class="buy-content-title-address">{h["address"]}</span>'
+            f'<div class="buy-content-title-total-price">{h["price"]}萬</div>'
+            f'<div class="buy-content-detail-area"><div><div><span>{h["space"]}坪</span></div></div></div>'
+            f'<div class="buy-content-detail-layout"><div>{h["layout"]}</div></div>'
+            f'<div class="buy-content-detail-type"><div><div><span>{h["age"]}年</span></div></div></div>'
+            f'<div class="buy-content-detail-floor">{h["floor"]}/{h["floors"]}樓</div>'
+            f'<div class="communityButton"><span>{h["community"]}社區</span></div>{basic}'
+            f'<div class="buy-content-obj-feature"><div class="description-cell-text">近捷運</div></div>'
+            f'<div class="carousel-thumbnail-img"><img src="https://res.sinyi.com.tw/{p["id"]}/1.jpg"></div>'
+            f'<script id="__NEXT_DATA__" type="application/json">{json.dumps(next_data, ensure_ascii=False)}</script>'
+        )
+
+    # --- Rakuya ---
+    def rakuya_result(self, p):
+        city = p.get('city', '1')
+        if 'page' not in p:
+            search = {'pagination': {'pageCount': self.pages(20)}}
+            return _html(f'<script>window.sellSearch = {json.dumps(search)};</script>')
+        page = int(p['page'])
+        ehids = [f'r{city}x{n:05d}' for n in range((page - 1) * 20, min(page * 20, self.size))]
+        cards = ''.join(f'<div class="box__communityIntro"><section><a href="/sell_item/info?ehid={e}">case</a>'
+                        f'{_card(_listing("rakuya", e))}</section></div>' for e in ehids)
+        return _html(f'<div class="box__communityIntro"></div>{cards}')
+
+    def rakuya_case(self, p):
+        h = _listing('rakuya', p['ehid'])
+        layer = {'itemData': {'item_name': h['name'], 'price': h['price'], 'age': h['age'], 'item_variant': h['space'],
+                              'object_tag': '近公園', 'object_floor': h['floor']}}
+        ld = {'address': {'addressLocality': h['city'], 'addressRegion': h['district'], 'streetAddress': '民生路1號'}}
+        head = (f'<meta property="og:image" content="https://img.rakuya.com.tw/{p["ehid"]}.jpg">'
+                f'<script type="application/ld+json">{json.dumps(ld, ensure_ascii=False)}</script>')
+        return _html(f'<script>window.tmpDataLayer = {json.dumps(layer, ensure_ascii=False)};</script>'
+                     f'<p>格局為{h["layout"]}</p><a href="/community/{h["community"]}">{h["community"]}</a>',
+                     head)
+
+    def rakuya_environment(self, p):
+        h = _listing('rakuya', p['ehid'])
+        rng = h['rng']
+        data = {'itemLat': h['lat'], 'itemLng': h['lon']}
+        for key in ('medical', 'transport', 'school', 'avoid', 'food', 'market', 'park'):
+            data[key] = {'poiList': _pois(rng, 2)}
+        return {'status': True, 'data': data}
+
+    def rakuya_realprice(self, p):
+        city, page = p.get('city', '0'), int(p.get('page', 1))
+        deals, formatted = [], []
+        for n in range((page - 1) * 20, min(page * 20, self.size)):
+            sn = f'{city}{n:06d}'
+            h = _listing('realprice', sn)
+            history = h['rng'].choice([1, 1, 2, 3])
+            deals.append({'dealId': sn, 'addr': h['address'], 'zipcodeArea': h['district'], 'community': h['community'],
+                          'closePrice': f'{h["price"]:,}', 'unitPrice': str(round(h['price'] / h['space'], 1)),
+                          'totalSize': h['space'], 'buildYear': f'{int(h["age"])}年', 'snGrountCnt': history,
+                          'transFloor': str(h['floor']), 'surFloor': str(h['floors']), 'closeDate': '2024-03-01',
+                          'bedrooms': h['layout'][0] + '房'})
+            formatted.append({'sn': sn, 'address': h['address'], 'areaName': h['district'], 'historyTotal': history,
+                              'url': f'https://www.rakuya.com.tw/realprice/info/{sn}', 'sellType': '大樓'})
+        return {'dealTotal': self.size, 'dealList': deals, 'formatDealList': formatted}
+
+    def rakuya_history(self, p):
+        h = _listing('realprice', p['sn'])
+        history = [{'closeDate': f'20{10 + i}-01-01', 'closePrice': h['price'] - 50 * i} for i in range(h['rng'].randint(1, 3))]
+        return {'status': True, 'data': {'history': history, 'total': len(history)}}
+
+    # --- houseprice (buy5168) ---
+    def houseprice_api(self, p):
+        return {'page': {'totalPageCount': self.pages(30)}, 'webCaseList': []}
+
+    def houseprice_list(self, p):
+        page = int(p.get('p', 1))
+        city = _city_key(p['city'])
+        links = ''.join(f'<a href="/house/{city}{n:06d}">{_card(_listing("houseprice", f"{city}{n:06d}"))}</a>'
+                        for n in range((page - 1) * 30, min(page * 30, self.size)))
+        return _html(links)
+
+    def houseprice_case_api(self, p):
+        h = _listing('houseprice', p['id'])
+        # A few cases come back without details, as delisted ones do, and the
+        # spider falls back to the page.
+        if h['rng'].random() < 0.05:
+            return {'webCaseInfo': None}
+        return {'webCaseInfo': {
+            'caseName': h['name'], 'address': h['address'], 'totalPrice': h['price'], 'buildPin': h['space'],
+            'floor': h['floor'], 'totalFloor': h['floors'], 'pattern': h['layout'], 'houseAge': h['age'],
+            'lat': h['lat'], 'lng': h['lon'], 'communityName': h['community'],
+            'photos': [{'url': f'https://img.houseprice.tw/{p["id"]}.jpg'}], 'caseDescription': '採光佳',
+            'basicInfo': [{'title': '車位', 'value': '無'}],
+        }, 'caseOwnerInfo': {'name': '王小明', 'phone': '0912-345-678'}}
+
+    def houseprice_case(self, p):
+        h = _listing('houseprice', p['id'])
+        rows = ''.join(f'<li><div>{t}</div><div>{v}</div></li>' for t, v in
+                       [('建坪', f'{h["space"]}坪'), ('樓層', f'{h["floor"]}/{h["floors"]}樓'),
+                        ('格局', h['layout']), ('屋齡', f'{h["age"]}年')])
+        return _html(
+            f'<div><h1>{h["name"]}</h1></div><div class="text-[18px]">{h["address"]}</div>'
+            f'<div class="w-[145px] shrink-0"><span class="font-bold">{h["price"]:,}</span></div><ul>{rows}</ul>'
+            f'<a href="https://www.google.com/maps/search/?api=1&query={h["lat"]},{h["lon"]}">map</a>'
+            f'<div><span>社區</span><a href="/community">{h["community"]}</a></div>'
+            f'<div class="house_images"><img src="https://img.houseprice.tw/{p["id"]}.jpg"></div>'
+            f'<div class="line-clamp-6 mb-7 text-lg whitespace-pre-line">採光佳</div>'
+            f'<div class="grid grid-cols-3 gap-2 text-lg"><div><span>車位</span>無</div></div>'
+        )
+
+    # --- hbhousing ---
+    def hb_start(self, p):
+        return _html('<div id="search"></div>')
+
+    def hb_search(self, p):
+        page = int(p.get('q', '').split('^')[-2] or 1)
+        houses = []
+        for n in range((page - 1) * 10, min(page * 10, self.size)):
+            h = _listing('hb', f'hb{n:06d}')
+            houses.append({'s': f'hb{n:06d}', 'i': [f'//img.hbhousing.com.tw/{n}.jpg'], 'n': h['name'],
+                           'np': h['price'], 'a': h['space']})
+        return {'data': houses}
+
+    def hb_map(self, p):
+        h = _listing('hb', p['sn'])
+        return f'<script>var pos = {{lon={h["lon"]},lat={h["lat"]};}}</script>'
+
+    def hb_case(self, p):
+        h = _listing('hb', p['sn'])
+        rows = ''.join(f'<tr><td>{t}</td><td>{v}</td></tr>' for t, v in [('社區', h['community']), ('車位', '無')])
+        return _html(
+            f'<div class="item-info"><p class="item_name">{h["name"]}</p><p class="item_add">{h["address"]}</p></div>'
+            f'<div class="item_price"><span class="hightlightprice">{h["price"]:,}</span></div>'
+            f'<ul class="item_other"><li class="icon_space">{h["space"]}坪</li><li class="icon_room">{h["layout"]}</li>'
+            f'<li class="icon_age">{h["age"]}年</li><li class="icon_floor">{h["floor"]}/{h["floors"]}</li></ul>'
+            f'<div class="basicinfo-box"><table>{rows}</table></div><ul class="features-other"><li>近市場</li></ul>'
+        )
+
+    # --- YungChing ---
+    def yungching_list(self, p):
+        page = int(p.get('pg', 1))
+        city = _city_key(p['city'])
+        cards = ''.join(f'<yc-ng-buy-house-card><a href="house/{city}{n:06d}">{_card(_listing("yungching", f"{city}{n:06d}"))}'
+                        f'</a></yc-ng-buy-house-card>' for n in range((page - 1) * 30, min(page * 30, self.size)))
+        more = '<div class="paginationNext">next</div>' if page < self.pages(30) else ''
+        return _html(cards + more)
+
+    def yungching_case(self, p):
+        h = _listing('yungching', p['id'])
+        return _html(
+            f'<h1>{h["name"]}</h1><h3>{h["address"]}</h3><div class="price">{h["price"]}萬</div>'
+            f'<span>建物{h["space"]}坪</span><div class="room">{h["layout"]}</div><div>{h["age"]}年</div>'
+            f'<div>{h["floor"]}/{h["floors"]}樓</div><a class="community"><h3>{h["community"]}</h3></a>'
+            f'<div class="tag">近學校</div><img src="https://yccdn.yungching.com.tw/{p["id"]}.jpg">',
+            f'<meta name="latitude" content="{h["lat"]}"><meta name="longitude" content="{h["lon"]}">'
+        )
+
+    def yungching_poi(self, p):
+        rng = _listing('yungching', p['id'])['rng']
+        pois = [{'poiItem': category, 'poiDetails': _pois(rng, 2)} for category in POI_CATEGORIES]
+        return {'data': {'pois': pois}}
+
+    # --- ScrapeOps ---
+    def scrapeops_headers(self, p):
+        n = min(int(p.get('num_results') or 10), 50)
+        return {'result': [{
+            'upgrade-insecure-requests': '1',
+            'user-agent': f'Mozilla/5.0 (X11; Linux x86_64) MockBrowser/{i}.0',
+            'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'accept-language': 'zh-TW,zh;q=0.9,en;q=0.8',
+        } for i in range(n)]}
+
+
+class MockSiteServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, site):
+        super().__init__(address, MockSiteRequestHandler)
+        self.site = site
+
+
+class MockSiteRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.respond(parse_qs(self.rfile.read(length).decode()))
+
+    def respond(self, form):
+        site = self.server.site
+        # /<original host>/<original path>
+        host, _, rest = self.path.lstrip('/').partition('/')
+        url = urlparse('/' + rest)
+        if site.latency:
+            time.sleep(site.latency * random.uniform(0.5, 1.5))
+        status, content_type, body = site.handle(self.command, host, url.path, parse_qs(url.query), form)
+        gzipped = 'gzip' in (self.headers.get('Accept-Encoding') or '')
+        if gzipped:
+            body = gzip.compress(body, compresslevel=5)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockSiteDownloadHandler:
+    lazy = False
+
+    def __init__(self, crawler):
+        self.base = crawler.settings.get('MOCK_SITE_URL')
+        if not self.base:
+            raise NotConfigured
+        self.base = self.base.rstrip('/')
+        self.handler = HTTP11DownloadHandler.from_crawler(crawler)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def download_request(self, request, spider):
+        parsed = urlparse(request.url)
+        target = f"{self.base}/{parsed.netloc}{parsed.path or '/'}" + (f"?{parsed.query}" if parsed.query else '')
+        mocked = request.replace(url=target)
+        d = self.handler.download_request(mocked, spider)
+
+        def restore(response):
+            request.meta['download_latency'] = mocked.meta.get('download_latency')
+            return response.replace(url=request.url, request=request)
+        return d.addCallback(restore)
+
+    def close(self):
+        return self.handler.close()
+
+
+def mock_settings(settings, url):
+    """Settings that send a crawl to the mock server at `url` instead of the network."""
+    handler = 'aidid_house.mocksite.MockSiteDownloadHandler'
+    return {
+        'EXTENSIONS': {**settings.getdict('EXTENSIONS'), 'scrapeops_scrapy.extension.ScrapeOpsMonitor': None},
+        'MOCK_SITE_URL': url,
+        'DOWNLOAD_HANDLERS': {'http': handler, 'https': handler},
+        'HTTPCACHE_ENABLED': False,
+        'PROXY_POOL_ENABLED': False,
+        'WARC_CAPTURE_DIR': None,
+        'RUN_LEDGER_ENABLED': False,
+        'SCRAPEOPS_FAKE_BROWSER_HEADER_ENABLED': False,
+    }
+
+
+def _server_args(parser):
+    parser.add_argument('--size', type=int, default=200, help="listings per city (buyHB: in total)")
+    parser.add_argument('--latency', type=float, default=0.05, help="mean response time in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of 5xx responses")
+    parser.add_argument('--ban-rate', type=float, default=0.0, help="share of 403/429/captcha responses")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def serve(args):
+    site = MockSite(args.size, args.latency, args.error_rate, args.ban_rate, args.seed)
+    server = MockSiteServer((args.host, args.port), site)
+    print(f"Mock sites on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def _start_server(args):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen([sys.executable, '-m', 'aidid_house.mocksite', 'serve', '--port', str(port),
+                               '--size', str(args.size), '--latency', str(args.latency),
+                               '--error-rate', str(args.error_rate), '--ban-rate', str(args.ban_rate),
+                               '--seed', str(args.seed)], stdout=subprocess.PIPE)
+    server.stdout.readline()  # listening
+    return server, f'http://127.0.0.1:{port}'
+
+
+def crawl(args):
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import data_path, get_project_settings
+
+    if args.mock_url:
+        server, url = None, args.mock_url
+    else:
+        server, url = _start_server(args)
+
+    settings = get_project_settings()
+    settings.setdict(mock_settings(settings, url), priority='cmdline')
+    if args.no_pipelines:
+        settings.set('ITEM_PIPELINES', {}, priority='cmdline')
+    for override in args.set:
+        name, _, value = override.partition('=')
+        settings.set(name, value, priority='cmdline')
+    spider_args = dict(a.partition('=')[::2] for a in args.spider_args)
+    if args.spider == 'buyHB':
+        # buyHB walks a fixed page range instead of reading a page count.
+        spider_args.setdefault('shard_pages', f'1-{math.ceil(args.size / 10)}')
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(args.spider)
+    try:
+        process.crawl(crawler, **spider_args)
+        process.start()
+    finally:
+        if server:
+            server.terminate()
+
+    stats = crawler.stats.get_stats()
+    elapsed = (stats['finish_time'] - stats['start_time']).total_seconds()
+    summary = {
+        'spider': args.spider,
+        'size': args.size, 'latency': args.latency, 'error_rate': args.error_rate, 'ban_rate': args.ban_rate,
+        'elapsed': round(elapsed, 2),
+        'responses': stats.get('downloader/response_count', 0),
+        'items': stats.get('item_scraped_count', 0),
+        'responses_per_sec': round(stats.get('downloader/response_count', 0) / elapsed, 1) if elapsed else None,
+        'items_per_sec': round(stats.get('item_scraped_count', 0) / elapsed, 1) if elapsed else None,
+        'stats': {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in stats.items()},
+    }
+    path = os.path.join(data_path('mocksite', createdir=True), f"{args.spider}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"{args.spider}: {summary['items']} items, {summary['responses']} responses in {summary['elapsed']}s "
+          f"({summary['items_per_sec']} items/s, {summary['responses_per_sec']} responses/s); details in {path}")
+
+
+def shared(args):
+    """
+    Smoke test for the shared Postgres queue: run several worker processes of
+    one spider against one mock server and check that every listing was
+    scraped exactly once. Uses the database in config.ini, so point it at a
+    throwaway database; the run's rows are deleted afterwards.
+    """
+    from scrapy.utils.project import data_path
+    from aidid_house.db import get_connection
+
+    run_id = f"smoke-{datetime.now():%Y%m%d-%H%M%S}"
+    server, url = _start_server(args)
+    feeds = []
+    workers = []
+    try:
+        for i in range(args.workers):
+            feed = os.path.join(data_path('mocksite', createdir=True), f"{run_id}-w{i}.jl")
+            feeds.append(feed)
+            workers.append(subprocess.Popen([
+                sys.executable, '-m', 'aidid_house.mocksite', 'crawl', args.spider, '--no-pipelines',
+                '--mock-url', url, '--size', str(args.size),
+                '-s', f'CRAWL_RUN_ID={run_id}', '-s', f'CRAWL_WORKER_ID=w{i}',
+                '-s', 'SCHEDULER=aidid_house.scheduler.PostgresScheduler',
+                '-s', 'DUPEFILTER_CLASS=aidid_house.scheduler.PostgresDupeFilter',
+                '-s', 'FEEDS=' + json.dumps({feed: {'format': 'jsonlines'}}),
+                *[arg for override in args.set for arg in ('-s', override)],
+            ]))
+        codes = [worker.wait() for worker in workers]
+    finally:
+        server.terminate()
+
+    counts = {}
+    per_worker = []
+    for feed in feeds:
+        n = 0
+        if os.path.exists(feed):
+            with open(feed, encoding='utf-8') as f:
+                for line in f:
+                    item_url = json.loads(line).get('url')
+                    counts[item_url] = counts.get(item_url, 0) + 1
+                    n += 1
+            os.remove(feed)
+        per_worker.append(n)
+    duplicates = sorted(url for url, n in counts.items() if n > 1)
+
+    conn = get_connection()
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM crawl_queue WHERE run_id = %s", (run_id,))
+        left = cur.fetchone()[0]
+        for table in ('crawl_queue', 'crawl_seen', 'crawl_workers'):
+            cur.execute(f"DELETE FROM {table} WHERE run_id = %s", (run_id,))
+    conn.close()
+
+    print(f"{args.spider}: {len(counts)} listings from {args.workers} workers {per_worker}, "
+          f"{len(duplicates)} scraped twice, {left} requests left in the queue, exit codes {codes}")
+    for item_url in duplicates[:10]:
+        print(f"  duplicate: {item_url}")
+    failed = duplicates or left or any(codes) or sum(per_worker) == 0
+    sys.exit(1 if failed else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the crawled sites.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help="run the mock server")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8780)
+    _server_args(serve_parser)
+
+    crawl_parser = commands.add_parser('crawl', help="run a spider against a fresh mock server")
+    crawl_parser.add_argument('spider')
+    _server_args(crawl_parser)
+    crawl_parser.add_argument('--no-pipelines', action='store_true', help="do not write items to Postgres")
+    crawl_parser.add_argument('-a', dest='spider_args', action='append', default=[], metavar='NAME=VALUE')
+    crawl_parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE')
+    crawl_parser.add_argument('--mock-url', help="use a running mock server instead of starting one")
+
+    shared_parser = commands.add_parser('shared', help="run several workers of a spider on the shared queue")
+    shared_parser.add_argument('spider')
+    _server_args(shared_parser)
+    shared_parser.add_argument('--workers', type=int, default=3)
+    shared_parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE')
+
+    args = parser.parse_args()
+    {'serve': serve, 'crawl': crawl, 'shared': shared}[args.command](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,14 @@
 from itemadapter import ItemAdapter
 import re
 import json
-import configparser
 from datetime import datetime
-import psycopg2
 from psycopg2.extras import Json
-import os
 from scrapy.exceptions import DropItem
+from aidid_house.db import acquire, release
 from aidid_house.items import AididHouseItem, HouseUpdateItem, RakuyaTradeItem
+from aidid_house.liveness import urls_to_delist
+from aidid_house.logs import log_event
+from aidid_house.metrics import DB_WRITE_SECONDS, timed
 
 
 # -------------------------------------------------------------------
@@ -36,17 +37,7 @@ class RakuyaTradePipeline:
     def open_spider(self, spider):
         self.master_table_name = f"master_{spider.name.lower()}"
 
-        config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
-        config = configparser.ConfigParser()
-        config.read(config_path)
-
-        self.conn = psycopg2.connect(
-            host=config['postgres']['host'],
-            database=config['postgres']['database'],
-            user=config['postgres']['user'],
-            password=config['postgres']['password'],
-            port=config['postgres']['port']
-        )
+        self.conn = acquire()
         self.cur = self.conn.cursor()
 
         # Create the master table with all fields + data_status (支援新的統一欄位結構)
@@ -124,7 +115,9 @@ class RakuyaTradePipeline:
             spider.logger.warning(f"無法載入現有 URLs，可能是新建的表: {e}")
             self.initial_active_urls = set()
 
-        spider.existing_urls = self.initial_active_urls
+        # Not existing_urls: DeltaScrapePipeline has already filled that with
+        # the listings the delta skip (aidid_house.delta) looks up.
+        spider.existing_trade_urls = self.initial_active_urls
 
     def process_item(self, item, spider):
         adapter = ItemAdapter(item)
@@ -170,22 +163,26 @@ class RakuyaTradePipeline:
                 VALUES ({', '.join(placeholders)})
                 ON CONFLICT (url) DO UPDATE SET
                 {', '.join(update_columns)}
+                RETURNING (xmax = 0)
                 """
                 
-                self.cur.execute(insert_sql, insert_data)
-                
-                self.conn.commit()
-                spider.logger.info(f"Inserted/Updated trade data for {adapter.get('address')}")
+                with timed(DB_WRITE_SECONDS, table=self.master_table_name):
+                    self.cur.execute(insert_sql, insert_data)
+                    inserted = self.cur.fetchone()[0]
+                    self.conn.commit()
+                spider.crawler.stats.inc_value('items/new' if inserted else 'items/updated')
+                log_event(spider, 'item', "Upserted trade", url=url, address=adapter.get('address'), new=inserted)
                 
             except Exception as e:
                 spider.logger.error(f"Error inserting trade data: {e}")
                 self.conn.rollback()
+                spider.crawler.stats.inc_value('pipeline/errors')
 
         return item
 
     def close_spider(self, spider):
         # Mark inactive URLs
-        inactive_urls = self.initial_active_urls - self.live_urls
+        inactive_urls = urls_to_delist(self.conn, spider, self.master_table_name, self.initial_active_urls, self.live_urls)
         if inactive_urls:
             placeholders = ','.join(['%s'] * len(inactive_urls))
             self.cur.execute(f"""
@@ -195,11 +192,11 @@ class RakuyaTradePipeline:
             """, list(inactive_urls))
             self.conn.commit()
             spider.logger.info(f"Marked {len(inactive_urls)} URLs as inactive")
+        spider.crawler.stats.set_value('items/delisted', len(inactive_urls))
 
         if self.cur:
             self.cur.close()
-        if self.conn:
-            self.conn.close()
+        release(self.conn)
 
 
 # -------------------------------------------------------------------
@@ -216,17 +213,7 @@ class DeltaScrapePipeline:
     def open_spider(self, spider):
         self.master_table_name = f"master_buyxinyi"
 
-        config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
-        config = configparser.ConfigParser()
-        config.read(config_path)
-
-        self.conn = psycopg2.connect(
-            host=config['postgres']['host'],
-            database=config['postgres']['database'],
-            user=config['postgres']['user'],
-            password=config['postgres']['password'],
-            port=config['postgres']['port']
-        )
+        self.conn = acquire()
         self.cur = self.conn.cursor()
 
         # Create the master table with all original fields + data_status
@@ -255,17 +242,22 @@ class DeltaScrapePipeline:
             review TEXT,
             images JSONB,
             house_id TEXT,
+            card_fingerprint TEXT,
             last_seen DATE,
             data_status VARCHAR(10) DEFAULT 'ACTIVE'
         )
         """)
+        self.cur.execute(f"ALTER TABLE {self.master_table_name} ADD COLUMN IF NOT EXISTS card_fingerprint TEXT")
         self.conn.commit()
 
-        self.cur.execute(f"SELECT url FROM {self.master_table_name} WHERE data_status = 'ACTIVE'")
-        self.initial_active_urls = {row[0] for row in self.cur.fetchall()}
+        self.cur.execute(f"SELECT url, card_fingerprint FROM {self.master_table_name} WHERE data_status = 'ACTIVE'")
+        rows = self.cur.fetchall()
+        self.initial_active_urls = {row[0] for row in rows}
         spider.logger.info(f"Loaded {len(self.initial_active_urls)} active URLs from {self.master_table_name}.")
 
         spider.existing_urls = self.initial_active_urls
+        # List-card fingerprints for change detection (see aidid_house.delta)
+        spider.existing_cards = {url: card for url, card in rows if card}
 
     def process_item(self, item, spider):
         adapter = ItemAdapter(item)
@@ -296,26 +288,35 @@ class DeltaScrapePipeline:
             sql = f"""
                 INSERT INTO {self.master_table_name} ({cols})
                 VALUES ({placeholders})
-                ON CONFLICT (url) DO UPDATE SET {update_cols};
+                ON CONFLICT (url) DO UPDATE SET {update_cols}
+                RETURNING (xmax = 0);
             """
 
             try:
-                self.cur.execute(sql, list(insert_data.values()))
-                self.conn.commit()
-                spider.logger.info(f"Upserted full item: {url}")
+                with timed(DB_WRITE_SECONDS, table=self.master_table_name):
+                    self.cur.execute(sql, list(insert_data.values()))
+                    inserted = self.cur.fetchone()[0]
+                    self.conn.commit()
+                spider.crawler.stats.inc_value('items/new' if inserted else 'items/updated')
+                log_event(spider, 'item', "Upserted item", url=url, new=inserted)
             except Exception as e:
                 self.conn.rollback()
                 spider.logger.error(f"Failed to upsert item {url}: {e}")
+                spider.crawler.stats.inc_value('pipeline/errors')
 
             return item
 
         elif isinstance(item, HouseUpdateItem):
-            # This is an existing, active item. Just update its timestamp.
-            self.cur.execute(
-                f"UPDATE {self.master_table_name} SET last_seen = %s WHERE url = %s",
-                (datetime.now().date(), url)
-            )
-            self.conn.commit()
+            # This is an existing, active item. Just update its timestamp
+            # (and the list card fingerprint, when the spider has one).
+            with timed(DB_WRITE_SECONDS, table=self.master_table_name):
+                self.cur.execute(
+                    f"UPDATE {self.master_table_name} "
+                    f"SET last_seen = %s, card_fingerprint = COALESCE(%s, card_fingerprint) WHERE url = %s",
+                    (datetime.now().date(), adapter.get('card_fingerprint'), url)
+                )
+                self.conn.commit()
+            spider.crawler.stats.inc_value('items/unchanged')
             raise DropItem(f"Updated last_seen for existing item: {url}")
         
         # For other item types (like RakuyaTradeItem), pass through unchanged
@@ -325,7 +326,7 @@ class DeltaScrapePipeline:
         spider.logger.info(
             f"Spider finished. Initial Active URLs: {len(self.initial_active_urls)}, Live URLs found: {len(self.live_urls)}")
 
-        delisted_urls = self.initial_active_urls - self.live_urls
+        delisted_urls = urls_to_delist(self.conn, spider, self.master_table_name, self.initial_active_urls, self.live_urls)
 
         if delisted_urls:
             spider.logger.info(f"Found {len(delisted_urls)} delisted URLs to mark as 'DELISTED'.")
@@ -341,6 +342,7 @@ class DeltaScrapePipeline:
                 f"Successfully marked {len(delisted_urls)} URLs as 'DELISTED' in {self.master_table_name}.")
         else:
             spider.logger.info("No active URLs were delisted in this run.")
+        spider.crawler.stats.set_value('items/delisted', len(delisted_urls))
 
         if self.cur: self.cur.close()
-        if self.conn: self.conn.close()
+        release(self.conn)
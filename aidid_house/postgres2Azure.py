@@ -4,6 +4,16 @@ import pandas as pd
 import requests
 from azure.core.credentials import AzureKeyCredential
 import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+if not __package__:
+    # Run as `python postgres2Azure.py` from inside aidid_house/.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aidid_house.ledger import RunLedger
 
 def safe_float(val):
     """Try to convert a value to float; return None if conversion fails."""
@@ -469,6 +479,10 @@ def get_postgres_connection(config_file='config.ini'):
 # Function: Update (MergeOrUpload) Documents in Azure AI Search Index using REST API
 # -------------------------------------------------------------------
 def update_azure_index_rest(df, service_name, index_name, api_version, admin_key, update_batch_size=1000):
+    """
+    Uploads df in batches. Returns (uploaded, failed, batch_seconds): documents
+    accepted and rejected by the index, and the time each batch took.
+    """
     endpoint = f"https://{service_name}.search.windows.net"
     headers = {
         "Content-Type": "application/json",
@@ -477,8 +491,10 @@ def update_azure_index_rest(df, service_name, index_name, api_version, admin_key
     update_url = f"{endpoint}/indexes/{index_name}/docs/index?api-version={api_version}"
     total_docs = len(df)
     print(f"Uploading {total_docs} documents using mergeOrUpload...")
+    uploaded, failed, batch_seconds = 0, 0, []
 
     for i in range(0, total_docs, update_batch_size):
+        started = time.perf_counter()
         batch = df.iloc[i:i + update_batch_size]
         documents = []
         for _, row in batch.iterrows():
@@ -527,12 +543,51 @@ def update_azure_index_rest(df, service_name, index_name, api_version, admin_key
             documents.append(doc)
         payload = {"value": documents}
         resp = requests.post(update_url, headers=headers, json=payload)
-        if resp.status_code in (200, 201):
+        batch_seconds.append(time.perf_counter() - started)
+        if resp.status_code in (200, 201, 207):
+            results = resp.json().get("value", [])
+            rejected = sum(1 for r in results if not r.get("status"))
+            uploaded += len(documents) - rejected
+            failed += rejected
             print(f"Uploaded update batch {i // update_batch_size + 1}: {resp.json()}")
         else:
+            failed += len(documents)
             print(f"Error uploading update batch {i // update_batch_size + 1}: {resp.text}")
 
     print("All documents in this batch updated successfully.")
+    return uploaded, failed, batch_seconds
+
+# -------------------------------------------------------------------
+# Function: Record the Sync in the Run Ledger (see aidid_house.ledger)
+# -------------------------------------------------------------------
+def record_sync(conn, table_name, started_at, duration, finish_reason, uploaded, failed, batch_seconds):
+    batch_ms = sorted(t * 1000 for t in batch_seconds)
+    ledger = None
+    try:
+        ledger = RunLedger(conn)
+        ledger.ensure_table()
+        ledger.record({
+            'kind': 'sync',
+            'spider': table_name,
+            'started_at': started_at,
+            'finished_at': datetime.now(timezone.utc),
+            'duration_s': duration,
+            'finish_reason': finish_reason,
+            'requests': len(batch_seconds),
+            'items': uploaded,
+            'items_per_sec': round(uploaded / duration, 3) if duration else None,
+            'pipeline_p95_ms': round(batch_ms[min(len(batch_ms) - 1, int(len(batch_ms) * 0.95))], 1) if batch_ms else None,
+            'errors': failed,
+            'stats': {'batches': len(batch_ms), 'batch_ms_median': statistics.median(batch_ms) if batch_ms else None},
+        })
+        print(f"Recorded sync in {ledger.table_name}: {uploaded} uploaded, {failed} failed.")
+    except Exception as e:
+        conn.rollback()
+        print("Error recording sync in run ledger:", e)
+    finally:
+        if ledger is not None:
+            ledger.cur.close()
+
 
 # -------------------------------------------------------------------
 # Main Function: Delete Azure Index Data and Update from PostgreSQL in Batches
@@ -564,6 +619,10 @@ def main():
     # Assuming that in config.ini the key 'table_name' is stored under the [postgres] section.
     # If your table is in the public schema, you can prepend "public." to the table name.
     table_name = f"public.{config['postgres']['table_name']}"
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    uploaded, failed, batch_seconds = 0, 0, []
+    finish_reason = 'failed'
     try:
         total_records = get_postgres_total_count(conn, table_name)
         print(f"Total records in PostgreSQL table{table_name}: {total_records}")
@@ -573,8 +632,15 @@ def main():
             print(f"Fetching records {offset} to {offset + fetch_batch_size} from PostgreSQL...")
             df_batch = fetch_data_batch(conn, table_name, offset, fetch_batch_size)
             print(f"Fetched {len(df_batch)} records; updating Azure index...")
-            update_azure_index_rest(df_batch, SERVICE_NAME, INDEX_NAME, API_VERSION, ADMIN_KEY, update_batch_size=1000)
+            ok, rejected, seconds = update_azure_index_rest(df_batch, SERVICE_NAME, INDEX_NAME, API_VERSION,
+                                                            ADMIN_KEY, update_batch_size=1000)
+            uploaded += ok
+            failed += rejected
+            batch_seconds += seconds
+        finish_reason = 'finished'
     finally:
+        record_sync(conn, config['postgres']['table_name'], started_at, time.perf_counter() - started,
+                    finish_reason, uploaded, failed, batch_seconds)
         conn.close()
         print("PostgreSQL connection closed.")
 
@@ -0,0 +1,137 @@
+import random
+import time
+from urllib.parse import urlparse
+
+
+# -------------------------------------------------------------------
+# Proxy pool with health scoring
+# -------------------------------------------------------------------
+# Each endpoint keeps exponentially weighted latency and success rates.
+# Requests go to the better of two randomly drawn endpoints that are not
+# cooling down. A ban, or several failures in a row, puts an endpoint on a
+# cooldown that doubles with every further strike. When every endpoint is
+# cooling down there is nothing to choose; the caller waits for the first one
+# to come back. This is always the case once a single-endpoint pool (such as
+# a rotating gateway) is banned, so there scoring does nothing and the
+# cooldown acts as a backoff for the whole spider. One pool per name is
+# shared by all crawlers of a process (see aidid_house.runner).
+
+def proxy_label(url):
+    """host:port of a proxy URL, without credentials (for stats and logs)."""
+    parsed = urlparse(url)
+    return f"{parsed.hostname}:{parsed.port}" if parsed.port else (parsed.hostname or url)
+
+
+class ProxyState:
+    def __init__(self, url, alpha=0.2):
+        self.url = url
+        self.label = proxy_label(url)
+        self.alpha = alpha
+        self.latency = None
+        self.success = 1.0
+        self.requests = 0
+        self.errors = 0
+        self.bans = 0
+        self.in_flight = 0
+        self.failures_in_row = 0
+        self.strikes = 0
+        self.cooldown_until = 0
+
+    def score(self):
+        # Higher is better: success rate per second of latency, discounted
+        # by the requests already waiting on this endpoint. Untried
+        # endpoints score as fast so each one gets measured.
+        latency = self.latency if self.latency is not None else 0.05
+        return self.success / (max(latency, 0.05) * (1 + self.in_flight))
+
+    def available(self, now):
+        return self.cooldown_until <= now
+
+    def record(self, ok, latency=None):
+        self.success += self.alpha * ((1.0 if ok else 0.0) - self.success)
+        if latency is not None:
+            self.latency = latency if self.latency is None else self.latency + self.alpha * (latency - self.latency)
+
+
+class ProxyPool:
+    _pools = {}
+
+    def __init__(self, name, urls, cooldown=30, max_cooldown=600, max_failures=3):
+        self.name = name
+        self.proxies = [ProxyState(url) for url in dict.fromkeys(urls)]
+        self.by_url = {p.url: p for p in self.proxies}
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_failures = max_failures
+
+    @classmethod
+    def shared(cls, name, urls, **kwargs):
+        if name not in cls._pools:
+            cls._pools[name] = cls(name, urls, **kwargs)
+        return cls._pools[name]
+
+    def choose(self, exclude=None):
+        """Pick an endpoint; `exclude` (a URL) is avoided when there is another choice.
+
+        None when every endpoint is cooling down (see wait()).
+        """
+        now = time.time()
+        candidates = [p for p in self.proxies if p.available(now) and p.url != exclude]
+        if not candidates:
+            candidates = [p for p in self.proxies if p.available(now)]
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+        return max(random.sample(candidates, 2), key=ProxyState.score)
+
+    def wait(self):
+        """Seconds until the first endpoint comes back from its cooldown."""
+        return max(0.0, min(p.cooldown_until for p in self.proxies) - time.time())
+
+    def started(self, url):
+        proxy = self.by_url[url]
+        proxy.requests += 1
+        proxy.in_flight += 1
+
+    def succeeded(self, url, latency):
+        proxy = self._finished(url)
+        proxy.record(True, latency)
+        proxy.failures_in_row = 0
+        proxy.strikes = 0
+
+    def failed(self, url, latency=None):
+        proxy = self._finished(url)
+        proxy.errors += 1
+        proxy.record(False, latency)
+        proxy.failures_in_row += 1
+        if proxy.failures_in_row >= self.max_failures:
+            self._cool_down(proxy)
+
+    def banned(self, url, latency=None):
+        proxy = self._finished(url)
+        proxy.bans += 1
+        proxy.record(False, latency)
+        self._cool_down(proxy)
+
+    def snapshot(self):
+        now = time.time()
+        return [{
+            'proxy': p.label,
+            'requests': p.requests,
+            'errors': p.errors,
+            'bans': p.bans,
+            'success': round(p.success, 3),
+            'latency': round(p.latency, 3) if p.latency is not None else None,
+            'cooling_down': not p.available(now),
+        } for p in self.proxies]
+
+    def _finished(self, url):
+        proxy = self.by_url[url]
+        proxy.in_flight = max(0, proxy.in_flight - 1)
+        return proxy
+
+    def _cool_down(self, proxy):
+        proxy.strikes += 1
+        proxy.failures_in_row = 0
+        proxy.cooldown_until = time.time() + min(self.max_cooldown, self.cooldown * 2 ** (proxy.strikes - 1))
@@ -0,0 +1,102 @@
+import argparse
+import json
+import logging
+from datetime import datetime
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from aidid_house.db import close_pool, enable_pool
+
+logger = logging.getLogger(__name__)
+
+
+# -------------------------------------------------------------------
+# Single-process multi-spider runner
+# -------------------------------------------------------------------
+# Runs several spiders concurrently in one CrawlerProcess so they share the
+# interpreter, the parsed config.ini, the ScrapeOps header list and a
+# Postgres connection pool. Each spider gets its own concurrency budget
+# (RUNNER_SPIDER_CONCURRENCY) so a slow site cannot starve the others, and
+# RUNNER_MAX_RUNTIME bounds the whole refresh.
+#
+#   python -m aidid_house.runner                 # RUNNER_SPIDERS
+#   python -m aidid_house.runner buyXinyi buyHB --max-runtime 14400
+
+def build_crawler(process, spider_name, concurrency, max_runtime):
+    # The crawler holds its own copy of the settings until crawl() freezes it.
+    crawler = process.create_crawler(spider_name)
+    crawler.settings.set('CONCURRENT_REQUESTS', concurrency, priority='cmdline')
+    crawler.settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', concurrency, priority='cmdline')
+    if max_runtime:
+        crawler.settings.set('CLOSESPIDER_TIMEOUT', max_runtime, priority='cmdline')
+    return crawler
+
+
+def summarize(results):
+    """Combine per-spider stats into one run summary."""
+    totals = {}
+    for stats in results.values():
+        for key in ('downloader/request_count', 'downloader/response_bytes', 'item_scraped_count',
+                    'item_dropped_count', 'log_count/ERROR'):
+            totals[key] = totals.get(key, 0) + stats.get(key, 0)
+    return {'spiders': results, 'totals': totals}
+
+
+def main():
+    settings = get_project_settings()
+    parser = argparse.ArgumentParser(description="Run several spiders in one process.")
+    parser.add_argument('spiders', nargs='*', help="spider names (default: RUNNER_SPIDERS)")
+    parser.add_argument('--max-runtime', type=int, default=settings.getint('RUNNER_MAX_RUNTIME'),
+                        help="seconds after which every spider is closed (0 = unbounded)")
+    parser.add_argument('--stats-file', default=settings.get('RUNNER_STATS_FILE'),
+                        help="write the combined stats of the run to this JSON file")
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE',
+                        help="override a setting for every spider")
+    args = parser.parse_args()
+
+    for override in args.set:
+        name, _, value = override.partition('=')
+        settings.set(name, value, priority='cmdline')
+
+    spider_names = args.spiders or settings.getlist('RUNNER_SPIDERS')
+    budgets = settings.getdict('RUNNER_SPIDER_CONCURRENCY')
+    default_budget = settings.getint('RUNNER_DEFAULT_CONCURRENCY', 16)
+
+    enable_pool(settings.getint('RUNNER_DB_POOL_SIZE', 2 * len(spider_names) + 2))
+    process = CrawlerProcess(settings)
+    results = {}
+    # Signal receivers are weakly referenced; keep the collectors alive.
+    collectors = []
+    started_at = datetime.now()
+
+    for name in spider_names:
+        crawler = build_crawler(process, name, int(budgets.get(name, default_budget)), args.max_runtime)
+
+        def collect(spider, reason, crawler=crawler):
+            stats = dict(crawler.stats.get_stats())
+            stats['finish_reason'] = reason
+            results[spider.name] = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in stats.items()}
+
+        collectors.append(collect)
+        crawler.signals.connect(collect, signal=signals.spider_closed)
+        process.crawl(crawler)
+
+    try:
+        process.start()
+    finally:
+        close_pool()
+
+    summary = summarize(results)
+    summary['started_at'] = started_at.isoformat()
+    summary['finished_at'] = datetime.now().isoformat()
+    for name, stats in sorted(results.items()):
+        logger.info(f"{name}: {stats.get('finish_reason')}, {stats.get('item_scraped_count', 0)} items, "
+                    f"{stats.get('downloader/request_count', 0)} requests")
+    logger.info(f"Run totals: {summary['totals']}")
+    if args.stats_file:
+        with open(args.stats_file, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
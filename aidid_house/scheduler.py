@@ -0,0 +1,503 @@
+import os
+import pickle
+import socket
+import logging
+import psycopg2
+from psycopg2.extras import execute_values
+from scrapy import signals
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.utils.misc import load_object
+from scrapy.utils.request import request_from_dict
+from twisted.internet import task, threads
+from aidid_house.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+
+# -------------------------------------------------------------------
+# Shared request queue for multi-process / multi-node crawling
+# -------------------------------------------------------------------
+# Enable with, on every worker:
+#   scrapy crawl buyXinyi -s CRAWL_RUN_ID=2024-06-01 \
+#       -s SCHEDULER=aidid_house.scheduler.PostgresScheduler \
+#       -s DUPEFILTER_CLASS=aidid_house.scheduler.PostgresDupeFilter
+# Workers with the same spider and CRAWL_RUN_ID pull from one frontier
+# (crawl_queue) and share deduplication (crawl_seen). A worker only closes once
+# the queue is empty and no other worker is still busy.
+#
+# Enqueued requests are buffered and written in batches: one round trip
+# records the new fingerprints in crawl_seen (dropping those another worker
+# already has) and queues the rest, in the same transaction. The rows of
+# requests whose callback has finished (PostgresQueueMiddleware) are deleted
+# in that transaction too, so a worker that dies only hands back what it had
+# not finished, and never loses the requests a finished callback spawned.
+class PostgresDupeFilter(BaseDupeFilter):
+    # request_seen() only answers for this process; PostgresScheduler settles
+    # duplicates across workers with claim() when it flushes its buffer.
+    table_name = "crawl_seen"
+
+    def __init__(self, crawler, run_id):
+        self.crawler = crawler
+        self.run_id = run_id
+        self.fingerprinter = crawler.request_fingerprinter
+        self.debug = crawler.settings.getbool('DUPEFILTER_DEBUG')
+        self.seen_locally = set()
+        self.conn = None
+        self.cur = None
+        self.spider_name = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        run_id = crawler.settings.get('CRAWL_RUN_ID')
+        if not run_id:
+            raise NotConfigured("PostgresDupeFilter requires CRAWL_RUN_ID")
+        return cls(crawler, run_id)
+
+    def open(self):
+        self.spider_name = self.crawler.spider.name
+        self.conn = get_connection()
+        self.cur = self.conn.cursor()
+        self.cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            run_id TEXT NOT NULL,
+            spider TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            PRIMARY KEY (run_id, spider, fingerprint)
+        )
+        """)
+        self.conn.commit()
+
+    def request_fingerprint(self, request):
+        return self.fingerprinter.fingerprint(request).hex()
+
+    def request_seen(self, request):
+        fp = self.request_fingerprint(request)
+        if fp in self.seen_locally:
+            return True
+        self.seen_locally.add(fp)
+        return False
+
+    def claim(self, cur, fingerprints):
+        """Record fingerprints in crawl_seen with `cur` (uncommitted); returns those no worker had recorded yet."""
+        if not fingerprints:
+            return set()
+        rows = execute_values(cur, f"""
+        INSERT INTO {self.table_name} (run_id, spider, fingerprint) VALUES %s
+        ON CONFLICT DO NOTHING RETURNING fingerprint
+        """, [(self.run_id, self.spider_name, fp) for fp in fingerprints], fetch=True)
+        return {row[0] for row in rows}
+
+    def log(self, request, spider):
+        if self.debug:
+            logger.debug(f"Filtered duplicate request: {request}")
+        self.crawler.stats.inc_value('dupefilter/filtered')
+
+    def close(self, reason):
+        if self.cur:
+            self.cur.close()
+        if self.conn:
+            self.conn.close()
+
+
+class CrawlWorkerRegistry:
+    # One row per worker process of a run in crawl_workers. Heartbeats let
+    # surviving workers reclaim the queue rows of a crashed worker.
+    table_name = "crawl_workers"
+
+    def __init__(self, conn, run_id, spider_name, worker_id, timeout):
+        self.conn = conn
+        self.cur = conn.cursor()
+        self.run_id = run_id
+        self.spider_name = spider_name
+        self.worker_id = worker_id
+        self.timeout = timeout
+        self.state = None
+
+    def ensure_table(self):
+        self.cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            run_id TEXT NOT NULL,
+            spider TEXT NOT NULL,
+            worker_id TEXT NOT NULL,
+            state VARCHAR(10) NOT NULL,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            heartbeat TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_id, spider, worker_id)
+        )
+        """)
+        self.conn.commit()
+
+    def set_state(self, state):
+        if state == self.state:
+            return
+        self.cur.execute(f"""
+        INSERT INTO {self.table_name} (run_id, spider, worker_id, state)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (run_id, spider, worker_id) DO UPDATE SET
+        state = EXCLUDED.state, heartbeat = CURRENT_TIMESTAMP
+        """, (self.run_id, self.spider_name, self.worker_id, state))
+        self.conn.commit()
+        self.state = state
+
+    def heartbeat(self):
+        self.cur.execute(
+            f"UPDATE {self.table_name} SET heartbeat = CURRENT_TIMESTAMP "
+            f"WHERE run_id = %s AND spider = %s AND worker_id = %s",
+            (self.run_id, self.spider_name, self.worker_id)
+        )
+        self.conn.commit()
+
+    def expire_stale(self):
+        """Mark workers without a recent heartbeat as DEAD and return their ids."""
+        self.cur.execute(f"""
+        UPDATE {self.table_name} SET state = 'DEAD'
+        WHERE run_id = %s AND spider = %s AND state IN ('BUSY', 'IDLE')
+        AND heartbeat < CURRENT_TIMESTAMP - make_interval(secs => %s)
+        RETURNING worker_id
+        """, (self.run_id, self.spider_name, self.timeout))
+        dead = [row[0] for row in self.cur.fetchall()]
+        self.conn.commit()
+        return dead
+
+    def others_busy(self):
+        self.cur.execute(
+            f"SELECT 1 FROM {self.table_name} WHERE run_id = %s AND spider = %s "
+            f"AND worker_id <> %s AND state = 'BUSY' LIMIT 1",
+            (self.run_id, self.spider_name, self.worker_id)
+        )
+        return self.cur.fetchone() is not None
+
+    def finish(self):
+        """Mark this worker FINISHED. Returns True if no other worker of the run is still running."""
+        # Lock all rows of the run so two workers finishing together cannot
+        # both see the other one as still running.
+        self.cur.execute(
+            f"SELECT worker_id FROM {self.table_name} WHERE run_id = %s AND spider = %s FOR UPDATE",
+            (self.run_id, self.spider_name)
+        )
+        self.cur.execute(
+            f"UPDATE {self.table_name} SET state = 'FINISHED', heartbeat = CURRENT_TIMESTAMP "
+            f"WHERE run_id = %s AND spider = %s AND worker_id = %s",
+            (self.run_id, self.spider_name, self.worker_id)
+        )
+        self.cur.execute(
+            f"SELECT COUNT(*) FROM {self.table_name} WHERE run_id = %s AND spider = %s "
+            f"AND state NOT IN ('FINISHED', 'DEAD')",
+            (self.run_id, self.spider_name)
+        )
+        last = self.cur.fetchone()[0] == 0
+        self.conn.commit()
+        self.state = 'FINISHED'
+        return last
+
+
+class PostgresScheduler:
+    table_name = "crawl_queue"
+
+    def __init__(self, crawler, dupefilter, run_id, worker_id):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.df = dupefilter
+        self.run_id = run_id
+        self.worker_id = worker_id
+        self.batch_size = crawler.settings.getint('PGQUEUE_BATCH_SIZE', 16)
+        self.timeout = crawler.settings.getint('CRAWL_WORKER_TIMEOUT', 120)
+        self.spider = None
+        self.conn = None
+        self.cur = None
+        self.registry = None
+        self.buffer = []
+        self.pending = []
+        # ids of claimed rows that are finished (or superseded by a retry)
+        self.done = set()
+        self.flush_size = crawler.settings.getint('PGQUEUE_FLUSH_SIZE', 100)
+        self.poll_interval = crawler.settings.getfloat('PGQUEUE_POLL_INTERVAL', 1)
+        self.queued_cached = False
+        self.poll_conn = None
+        self.poll_loop = None
+        self.polling = False
+        self.heartbeat_loop = None
+        self.last_of_run = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        run_id = settings.get('CRAWL_RUN_ID')
+        if not run_id:
+            raise NotConfigured("PostgresScheduler requires CRAWL_RUN_ID")
+        worker_id = settings.get('CRAWL_WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+        dupefilter_cls = load_object(settings['DUPEFILTER_CLASS'])
+        if hasattr(dupefilter_cls, 'from_crawler'):
+            dupefilter = dupefilter_cls.from_crawler(crawler)
+        else:
+            dupefilter = dupefilter_cls.from_settings(settings)
+        s = cls(crawler, dupefilter, run_id, worker_id)
+        crawler.signals.connect(s.spider_idle, signal=signals.spider_idle)
+        return s
+
+    def open(self, spider):
+        self.spider = spider
+        self.conn = get_connection()
+        self.cur = self.conn.cursor()
+        self.cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            id BIGSERIAL PRIMARY KEY,
+            run_id TEXT NOT NULL,
+            spider TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            payload BYTEA NOT NULL,
+            state VARCHAR(10) NOT NULL DEFAULT 'QUEUED',
+            worker_id TEXT,
+            claimed_at TIMESTAMP
+        )
+        """)
+        self.cur.execute(f"""
+        CREATE INDEX IF NOT EXISTS {self.table_name}_next_idx
+        ON {self.table_name} (run_id, spider, state, priority DESC, id)
+        """)
+        self.conn.commit()
+
+        self.registry = CrawlWorkerRegistry(get_connection(), self.run_id, spider.name, self.worker_id, self.timeout)
+        self.registry.ensure_table()
+        self.registry.set_state('BUSY')
+        self._reclaim_dead_workers()
+        spider.crawl_worker = self
+
+        self.heartbeat_loop = task.LoopingCall(self.registry.heartbeat)
+        self.heartbeat_loop.start(max(self.timeout // 4, 1), now=False)
+        # has_pending_requests() is asked on every engine tick; it answers
+        # from a flag that a thread refreshes (other workers may queue more).
+        self.poll_conn = get_connection()
+        self.poll_loop = task.LoopingCall(self._poll)
+        self.poll_loop.start(self.poll_interval, now=False)
+        spider.logger.info(f"Joined shared queue for run {self.run_id} as worker {self.worker_id}.")
+        return self.df.open()
+
+    def close(self, reason):
+        for loop in (self.heartbeat_loop, self.poll_loop):
+            if loop and loop.running:
+                loop.stop()
+        self.flush()
+        self.finish()
+        if reason == 'finished':
+            # Every claimed row has been crawled.
+            self.cur.execute(
+                f"DELETE FROM {self.table_name} WHERE run_id = %s AND spider = %s AND worker_id = %s AND state = 'CLAIMED'",
+                (self.run_id, self.spider.name, self.worker_id)
+            )
+        else:
+            # Interrupted: hand everything back so other workers redo it.
+            self.cur.execute(
+                f"UPDATE {self.table_name} SET state = 'QUEUED', worker_id = NULL "
+                f"WHERE run_id = %s AND spider = %s AND worker_id = %s AND state = 'CLAIMED'",
+                (self.run_id, self.spider.name, self.worker_id)
+            )
+        self.conn.commit()
+        self.buffer = []
+        self.registry.conn.close()
+        if self.poll_conn is not None and not self.polling:
+            self.poll_conn.close()
+        self.cur.close()
+        self.conn.close()
+        return self.df.close(reason)
+
+    def has_pending_requests(self):
+        return bool(self.buffer) or bool(self.pending) or self._queued_in_db()
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        fp = None if request.dont_filter else self.df.request_fingerprint(request)
+        # A retry or redirect of a claimed request replaces its row.
+        superseded = request.meta.pop('pgqueue_id', None)
+        if superseded is not None:
+            self.done.add(superseded)
+        self.pending.append((fp, request))
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+        return True
+
+    def request_done(self, request):
+        """The callback of a request has finished; its row goes with the next flush."""
+        row_id = request.meta.get('pgqueue_id')
+        if row_id is not None:
+            self.done.add(row_id)
+
+    def flush(self):
+        """Queue the buffered requests that no other worker has scheduled yet and drop finished rows, in one transaction."""
+        if not self.pending and not self.done:
+            return
+        pending, self.pending = self.pending, []
+        done, self.done = list(self.done), set()
+        if done:
+            self.cur.execute(
+                f"DELETE FROM {self.table_name} WHERE id = ANY(%s) AND worker_id = %s",
+                (done, self.worker_id)
+            )
+        new = self.df.claim(self.cur, [fp for fp, _ in pending if fp is not None])
+        rows = []
+        for fp, request in pending:
+            if fp is not None and fp not in new:
+                # another worker has already scheduled it
+                self.df.log(request, self.spider)
+                continue
+            payload = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+            rows.append((self.run_id, self.spider.name, request.priority, psycopg2.Binary(payload)))
+        if rows:
+            execute_values(
+                self.cur,
+                f"INSERT INTO {self.table_name} (run_id, spider, priority, payload) VALUES %s",
+                rows
+            )
+        self.conn.commit()
+        if rows:
+            self.queued_cached = True
+            self.stats.inc_value('scheduler/enqueued/postgres', len(rows), spider=self.spider)
+            self.stats.inc_value('scheduler/enqueued', len(rows), spider=self.spider)
+
+    def next_request(self):
+        # The engine asks for the next request once the requests of a callback
+        # have been enqueued, so this flushes roughly one batch per callback.
+        self.flush()
+        if not self.buffer:
+            self._claim_batch()
+        if not self.buffer:
+            return None
+        row_id, payload = self.buffer.pop(0)
+        request = request_from_dict(pickle.loads(payload), spider=self.spider)
+        request.meta['pgqueue_id'] = row_id
+        self.registry.set_state('BUSY')
+        self.stats.inc_value('scheduler/dequeued/postgres', spider=self.spider)
+        self.stats.inc_value('scheduler/dequeued', spider=self.spider)
+        return request
+
+    def __len__(self):
+        self.cur.execute(
+            f"SELECT COUNT(*) FROM {self.table_name} WHERE run_id = %s AND spider = %s AND state = 'QUEUED'",
+            (self.run_id, self.spider.name)
+        )
+        count = self.cur.fetchone()[0]
+        self.conn.commit()
+        return count + len(self.buffer)
+
+    def finish(self):
+        """
+        Leave the run. Returns True if this worker is the last one to finish
+        and nothing is left in the queue, i.e. the run is complete and
+        run-wide work such as delisting may happen now. Pipelines call this
+        from close_spider, before the scheduler itself is closed.
+        """
+        if self.last_of_run is None:
+            self.flush()
+            drained = not self.buffer and not self._queued_in_db(force=True)
+            self.last_of_run = self.registry.finish() and drained
+        return self.last_of_run
+
+    def spider_idle(self, spider):
+        # Another worker may still be running callbacks that enqueue more
+        # requests, so only close once everyone is idle and the queue is empty.
+        self.flush()
+        self.registry.set_state('IDLE')
+        self._reclaim_dead_workers()
+        if self._queued_in_db(force=True) or self.registry.others_busy():
+            raise DontCloseSpider
+
+    def _claim_batch(self):
+        self.cur.execute(f"""
+        UPDATE {self.table_name} SET state = 'CLAIMED', worker_id = %s, claimed_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM {self.table_name}
+            WHERE run_id = %s AND spider = %s AND state = 'QUEUED'
+            ORDER BY priority DESC, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, priority, payload
+        """, (self.worker_id, self.run_id, self.spider.name, self.batch_size))
+        rows = self.cur.fetchall()
+        self.conn.commit()
+        rows.sort(key=lambda row: (-row[1], row[0]))
+        self.buffer = [(row_id, bytes(payload)) for row_id, _, payload in rows]
+
+    def _queued_in_db(self, force=False):
+        if force:
+            self.queued_cached = self._queued_query(self.conn)
+        return self.queued_cached
+
+    def _queued_query(self, conn):
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT 1 FROM {self.table_name} WHERE run_id = %s AND spider = %s AND state = 'QUEUED' LIMIT 1",
+                (self.run_id, self.spider.name)
+            )
+            queued = cur.fetchone() is not None
+        conn.commit()
+        return queued
+
+    def _poll(self):
+        if self.polling:
+            return
+        self.polling = True
+        d = threads.deferToThread(self._queued_query, self.poll_conn)
+        d.addCallbacks(self._polled, self._poll_failed)
+
+    def _polled(self, queued):
+        self.polling = False
+        self.queued_cached = queued
+        self._close_poll_conn()
+
+    def _poll_failed(self, failure):
+        self.polling = False
+        logger.warning(f"Polling {self.table_name} failed: {failure.getErrorMessage()}")
+        self._close_poll_conn()
+
+    def _close_poll_conn(self):
+        # close() leaves the connection to a poll that is still running.
+        if self.poll_loop is not None and not self.poll_loop.running and not self.poll_conn.closed:
+            self.poll_conn.close()
+
+    def _reclaim_dead_workers(self):
+        dead = self.registry.expire_stale()
+        if not dead:
+            return
+        self.cur.execute(
+            f"UPDATE {self.table_name} SET state = 'QUEUED', worker_id = NULL "
+            f"WHERE run_id = %s AND spider = %s AND state = 'CLAIMED' AND worker_id = ANY(%s)",
+            (self.run_id, self.spider.name, dead)
+        )
+        self.conn.commit()
+        self.spider.logger.warning(f"Requeued {self.cur.rowcount} requests from dead workers: {dead}")
+
+
+class PostgresQueueMiddleware:
+    # Spider middleware next to the engine (below HttpErrorMiddleware), so
+    # its output ends only after the requests of a callback have reached the
+    # scheduler. It then tells PostgresScheduler the request is finished.
+    # Requests whose download failed stay claimed until the worker closes,
+    # and are retried if it dies. Off unless the shared queue is in use.
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not issubclass(load_object(crawler.settings['SCHEDULER']), PostgresScheduler):
+            raise NotConfigured
+        return cls()
+
+    def process_spider_output(self, response, result, spider):
+        try:
+            yield from result
+        except GeneratorExit:
+            raise
+        except Exception:
+            self._done(response, spider)
+            raise
+        self._done(response, spider)
+
+    def process_spider_exception(self, response, exception, spider):
+        self._done(response, spider)
+
+    def _done(self, response, spider):
+        worker = getattr(spider, 'crawl_worker', None)
+        if worker is not None and response.request is not None:
+            worker.request_done(response.request)
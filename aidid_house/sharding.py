@@ -0,0 +1,21 @@
+# Helpers for splitting one spider's crawl across several processes, e.g.
+#   scrapy crawl buyXinyi -a shard_cities=Taipei-city,NewTaipei-city \
+#       -s CRAWL_RUN_ID=2024-06-01 -s CRAWL_SHARD=north -s CRAWL_SHARDS=north,south
+# Delisting for such runs is coordinated in aidid_house.liveness.
+
+def select_cities(spider, cities):
+    """Restrict `cities` to the comma-separated `-a shard_cities=...` argument, if given."""
+    selected = getattr(spider, 'shard_cities', None)
+    if not selected:
+        return list(cities)
+    wanted = {c.strip() for c in selected.split(',') if c.strip()}
+    return [c for c in cities if str(c) in wanted]
+
+
+def select_pages(spider, first, last):
+    """Restrict the page range first..last to `-a shard_pages=FROM-TO`, if given."""
+    selected = getattr(spider, 'shard_pages', None)
+    if not selected:
+        return range(first, last + 1)
+    start, _, end = selected.partition('-')
+    return range(max(first, int(start)), min(last, int(end or last)) + 1)
@@ -1,5 +1,8 @@
 import scrapy
-from aidid_house.items import AididHouseItem, HouseUpdateItem
+from aidid_house.delta import card_update, fingerprint, list_card
+from aidid_house.embedded import embedded_state
+from aidid_house.items import AididHouseItem
+from aidid_house.sharding import select_cities
 import re
 import json
 
@@ -18,7 +21,11 @@ class BuyxinyiSpider(scrapy.Spider):
         'Tainan-city', 'Kaohsiung-city', 'Pingtung-county', 'Penghu-county',
         'Taitung-county', 'Hualien-county', 'Kinmen-county',
     ]
-    start_urls = [f"https://www.sinyi.com.tw/buy/list/{city}/default-desc/1" for city in cities]
+
+    def start_requests(self):
+        for city in select_cities(self, self.cities):
+            yield scrapy.Request(f"https://www.sinyi.com.tw/buy/list/{city}/default-desc/1", dont_filter=True,
+                                 meta={"block_expect": "__NEXT_DATA__"})
 
     def parse(self, response):
         city = response.url.split('/')[-3]
@@ -33,37 +40,45 @@ class BuyxinyiSpider(scrapy.Spider):
             for i in range(1, total_pages + 1):
                 yield scrapy.Request(
                     f"https://www.sinyi.com.tw/buy/list/{city}/default-desc/{i}",
-                    callback=self.parse_list_page
+                    callback=self.parse_list_page,
+                    meta={"request_type": "list", "block_expect": "__NEXT_DATA__"}
                 )
         else:
             self.logger.warning(f"Could not find total pages for city: {city}. Scraping first page only.")
             yield from self.parse_list_page(response)
 
     def parse_list_page(self, response):
-        urls = response.xpath('//div[contains(@class, "buy-list-item")]/a/@href').getall()
-        for url_path in urls:
+        for card in response.xpath('//div[contains(@class, "buy-list-item")]'):
+            url_path = card.xpath('./a/@href').get()
+            if not url_path:
+                continue
             full_url = response.urljoin(url_path)
+            card_fields = list_card(card)
 
             if full_url in self.existing_urls:
-                # It's an existing house, just send an update signal
-                yield HouseUpdateItem(url=full_url)
-            else:
-                # It's a new house, scrape the full details
-                yield scrapy.Request(full_url, callback=self.parse_case_page)
+                # It's an existing house: send an update signal, and scrape it again if its card changed
+                update, changed = card_update(self, full_url, card_fields)
+                yield update
+                if not changed:
+                    continue
+            # A new (or changed) house, scrape the full details
+            yield scrapy.Request(full_url, callback=self.parse_case_page,
+                                 meta={"request_type": "detail", "card_fingerprint": fingerprint(card_fields)})
 
     def parse_case_page(self, response):
         item = AididHouseItem(
             url=response.url, site='信義房屋', name='', address='', latitude=None, longitude=None,
             city='', district='', price='', layout='', age='', space='', floors='',
             community='', basic_info={}, features='', life_info=[], utility_info=[],
-            review='', images=[], trade_data={}, house_id=''
+            review='', images=[], trade_data={}, house_id='',
+            card_fingerprint=response.meta.get('card_fingerprint')
         )
 
         try:
             # --- Safely extract data from embedded JSON ---
-            script_text = response.xpath('//script[@id="__NEXT_DATA__"][@type="application/json"]/text()').get()
-            if script_text:
-                json_data = json.loads(script_text)
+            fields = {}
+            json_data = embedded_state(response).script_json('__NEXT_DATA__')
+            if json_data:
                 buy_reducer = json_data.get('props', {}).get('initialReduxState', {}).get('buyReducer', {})
                 content_data = buy_reducer.get('contentData', {})
                 detail_data = buy_reducer.get('detailData', {})
@@ -73,12 +88,18 @@ class BuyxinyiSpider(scrapy.Spider):
                 item['life_info'] = detail_data.get('lifeInfo', [])
                 item['utility_info'] = detail_data.get('utilitylifeInfo', [])
                 item['trade_data'] = buy_reducer.get('tradeData', {})
-
-            # --- Safely extract data using XPath ---
-            item['name'] = response.xpath('//span[contains(@class, "buy-content-title-name")]/text()').get(
-                default='').strip()
-            item['address'] = response.xpath('//span[contains(@class, "buy-content-title-address")]/text()').get(
-                default='').strip()
+                fields = self.state_fields(content_data, detail_data)
+
+            # --- XPath for what the JSON did not have, or had in an unexpected shape ---
+            for field, extract in CASE_XPATHS.items():
+                if field in fields and CASE_CHECKS[field](fields[field]):
+                    self.count_field('json', field)
+                    continue
+                if field in fields:
+                    self.count_field('invalid', field)
+                fields[field] = extract(response)
+                self.count_field('fallback', field)
+            item.update(fields)
 
             if item['address']:
                 city_district_match = re.search(r'(\w+(?:市|縣))(\w+(?:區|鄉|鎮|市))', item['address'])
@@ -86,37 +107,138 @@ class BuyxinyiSpider(scrapy.Spider):
                     item['city'] = city_district_match.group(1)
                     item['district'] = city_district_match.group(2)
 
-            item['price'] = ''.join(
-                response.xpath('//div[contains(@class, "buy-content-title-total-price")]/text()').getall()).strip()
-            item['space'] = ' '.join(response.xpath(
-                '//div[contains(@class, "buy-content-detail-area")]/div/div/span/text()').getall()).strip()
-            item['layout'] = response.xpath('//div[contains(@class, "buy-content-detail-layout")]/div/text()').get(
-                default='').strip()
-            item['age'] = ''.join(response.xpath(
-                '//div[contains(@class, "buy-content-detail-type")]/div/div/span/text()').getall()).strip()
-            item['floors'] = response.xpath('//div[contains(@class, "buy-content-detail-floor")]/text()').get(
-                default='').strip()
-            item['community'] = ''.join(
-                response.xpath('//div[contains(@class, "communityButton")]/span/text()').getall()).replace('社區',
-                                                                                                           '').strip()
-
-            basic_info_dict = {}
-            for basic_info in response.xpath('//div[contains(@class, "buy-content-basic-cell")]'):
-                title = basic_info.xpath('.//div[contains(@class, "basic-title")]/text()').get(default='').strip()
-                value = basic_info.xpath('.//div[contains(@class, "basic-value")]/text()').get(default='').strip()
-                if title:
-                    basic_info_dict[title] = value
-            item['basic_info'] = basic_info_dict
-
-            item['features'] = ' | '.join(response.xpath(
-                '//div[contains(@class, "buy-content-obj-feature")]//div[contains(@class, "description-cell-text")]/text()').getall())
-            item['images'] = response.xpath('//div[contains(@class, "carousel-thumbnail-img")]/img/@src').getall()
-
-            if response.xpath('//span[contains(@class, "buy-content-sameTrade")]/text()').get() == '非信義物件':
-                source = response.xpath('//div[contains(@class, "buy-content-store-title")]/text()').get(default='')
-                item['site'] = f'信義房屋 ({source})'
+            if '非信義物件'.encode() in response.body:
+                if response.xpath('//span[contains(@class, "buy-content-sameTrade")]/text()').get() == '非信義物件':
+                    source = response.xpath('//div[contains(@class, "buy-content-store-title")]/text()').get(default='')
+                    item['site'] = f'信義房屋 ({source})'
 
         except (json.JSONDecodeError, AttributeError, KeyError, TypeError) as e:
             self.logger.error(f"Error parsing case page {response.url}: {e}")
 
         yield item
+
+    @staticmethod
+    def state_fields(content_data, detail_data):
+        """Listing fields found in the Redux state, formatted like the page shows them."""
+        def first(data, *keys):
+            for key in keys:
+                value = data.get(key)
+                if value not in (None, '', [], {}):
+                    return value
+            return None
+
+        fields = {
+            'name': first(content_data, 'name', 'houseName'),
+            'address': first(content_data, 'address', 'fullAddress'),
+            'layout': first(content_data, 'layout'),
+        }
+        community = first(content_data, 'communityName', 'community')
+        # The page button is read without the word 社區; store it the same way
+        fields['community'] = community.replace('社區', '').strip() if isinstance(community, str) else community
+        price = first(content_data, 'totalPrice', 'price')
+        fields['price'] = f"{price}萬" if isinstance(price, (int, float)) else price
+        space = first(content_data, 'areaBuilding', 'totalArea')
+        fields['space'] = f"{space}坪" if isinstance(space, (int, float)) else space
+        age = first(content_data, 'age', 'houseAge')
+        fields['age'] = f"{age}年" if isinstance(age, (int, float)) else age
+        floor, total_floor = first(content_data, 'floor'), first(content_data, 'totalFloor')
+        fields['floors'] = f"{floor}/{total_floor}樓" if floor is not None and total_floor is not None else floor
+
+        basic_info = first(detail_data, 'basicInfo')
+        if isinstance(basic_info, list):
+            basic_info = {row.get('title'): row.get('value') for row in basic_info
+                          if isinstance(row, dict) and row.get('title')}
+        fields['basic_info'] = basic_info or None
+        features = first(detail_data, 'features', 'objFeature')
+        fields['features'] = ' | '.join(features) if isinstance(features, list) else features
+        images = first(content_data, 'images', 'imageList')
+        if isinstance(images, list):
+            images = [image.get('url') if isinstance(image, dict) else image for image in images]
+            images = [image for image in images if image]
+        fields['images'] = images or None
+        return {field: value for field, value in fields.items() if value not in (None, '', [], {})}
+
+    def count_field(self, source, field):
+        # extract/json/<field> and extract/fallback/<field>: where each field
+        # came from; extract/invalid/<field>: JSON values that failed
+        # CASE_CHECKS. The fallback rate is put in the stats at close.
+        if getattr(self, 'crawler', None) is not None:
+            self.crawler.stats.inc_value(f'extract/{source}/{field}')
+            self.crawler.stats.inc_value(f'extract/{source}')
+
+    def closed(self, reason):
+        if getattr(self, 'crawler', None) is None:
+            return
+        stats = self.crawler.stats
+        from_json, fallback = stats.get_value('extract/json', 0), stats.get_value('extract/fallback', 0)
+        if from_json + fallback:
+            rate = fallback / (from_json + fallback)
+            stats.set_value('extract/fallback_rate', round(rate, 4))
+            self.logger.info(f"Detail fields: {from_json} from __NEXT_DATA__, {fallback} from XPath ({rate:.1%} fallback)")
+
+
+def _basic_info(response):
+    basic_info_dict = {}
+    for basic_info in response.xpath('//div[contains(@class, "buy-content-basic-cell")]'):
+        title = basic_info.xpath('.//div[contains(@class, "basic-title")]/text()').get(default='').strip()
+        value = basic_info.xpath('.//div[contains(@class, "basic-value")]/text()').get(default='').strip()
+        if title:
+            basic_info_dict[title] = value
+    return basic_info_dict
+
+
+def _text(pattern=None):
+    regex = re.compile(pattern) if pattern else None
+    return lambda value: isinstance(value, str) and bool(value.strip()) and (regex is None or bool(regex.search(value)))
+
+
+def _amount(unit, low, high):
+    # One number in `unit` (as the page shows it) between low and high.
+    regex = re.compile(rf'^\s*(\d[\d,]*(?:\.\d+)?)\s*{unit}\s*$')
+
+    def check(value):
+        match = regex.match(value) if isinstance(value, str) else None
+        return bool(match) and low <= float(match.group(1).replace(',', '')) <= high
+    return check
+
+
+# What a usable value from BuyxinyiSpider.state_fields looks like; anything
+# else is taken from the page instead. Price must be a total in 萬 (not a
+# unit price per 坪 or a figure in 元), space a 坪 figure (not m²).
+CASE_CHECKS = {
+    'name': _text(),
+    'address': _text(r'^\s*[\u4e00-\u9fff]{2}[市縣]'),
+    'price': _amount('萬', 50, 500000),
+    'space': _amount('坪', 1, 3000),
+    'layout': _text(),
+    'age': _amount('年', 0, 100),
+    'floors': _text(r'^\s*[^/\s]+/\d+\s*樓\s*$'),
+    'community': _text(),
+    'basic_info': lambda value: isinstance(value, dict) and all(isinstance(key, str) for key in value),
+    'features': _text(),
+    'images': lambda value: isinstance(value, list) and all(isinstance(image, str) and image for image in value),
+}
+
+
+# Page fallbacks for the fields of BuyxinyiSpider.state_fields.
+CASE_XPATHS = {
+    'name': lambda r: r.xpath('//span[contains(@class, "buy-content-title-name")]/text()').get(default='').strip(),
+    'address': lambda r: r.xpath('//span[contains(@class, "buy-content-title-address")]/text()').get(
+        default='').strip(),
+    'price': lambda r: ''.join(
+        r.xpath('//div[contains(@class, "buy-content-title-total-price")]/text()').getall()).strip(),
+    'space': lambda r: ' '.join(r.xpath(
+        '//div[contains(@class, "buy-content-detail-area")]/div/div/span/text()').getall()).strip(),
+    'layout': lambda r: r.xpath('//div[contains(@class, "buy-content-detail-layout")]/div/text()').get(
+        default='').strip(),
+    'age': lambda r: ''.join(r.xpath(
+        '//div[contains(@class, "buy-content-detail-type")]/div/div/span/text()').getall()).strip(),
+    'floors': lambda r: r.xpath('//div[contains(@class, "buy-content-detail-floor")]/text()').get(
+        default='').strip(),
+    'community': lambda r: ''.join(
+        r.xpath('//div[contains(@class, "communityButton")]/span/text()').getall()).replace('社區', '').strip(),
+    'basic_info': _basic_info,
+    'features': lambda r: ' | '.join(r.xpath(
+        '//div[contains(@class, "buy-content-obj-feature")]//div[contains(@class, "description-cell-text")]/text()').getall()),
+    'images': lambda r: r.xpath('//div[contains(@class, "carousel-thumbnail-img")]/img/@src').getall(),
+}
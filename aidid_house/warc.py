@@ -0,0 +1,240 @@
+import argparse
+import gzip
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.python import to_unicode
+from twisted.internet import defer
+from twisted.web.http import RESPONSES
+
+from aidid_house.proxies import proxy_label
+
+
+# -------------------------------------------------------------------
+# WARC capture and offline replay
+# -------------------------------------------------------------------
+# Capture (WarcCapture extension, WARC_CAPTURE_DIR) writes every downloaded
+# response as it came off the wire, before decompression and redirects, to
+#   .scrapy/<WARC_CAPTURE_DIR>/<spider>-<run id>.warc.gz
+# as request/response/metadata WARC 1.0 records, one gzip member each. A
+# CDXJ index (.cdxj) next to it maps each request fingerprint to the offset
+# of its response record.
+#
+# Replay (WarcReplayDownloadHandler, WARC_REPLAY) serves those responses
+# instead of the network, so any spider runs offline at disk speed:
+#   python -m aidid_house.warc buyXinyi .scrapy/warc/buyXinyi-20240601-101500.warc.gz
+# A request recorded several times (retries) gets its responses in the
+# recorded order; requests that were never recorded are dropped and
+# counted in warc/replay_miss.
+
+# Never written to an archive.
+PRIVATE_HEADERS = {b'Proxy-Authorization', b'Authorization'}
+# Describe the transfer, not the stored body.
+TRANSFER_HEADERS = {b'Transfer-Encoding'}
+# JSON-safe request meta worth keeping with a record.
+META_KEYS = (
+    'request_type', 'frontier_key', 'block_expect', 'block_expect_json', 'retry_times',
+    # read by the callbacks themselves (see aidid_house.bench)
+    'city', 'page', 'city_code', 'city_name', 'total_pages', 'page_number', 'house_id',
+    'case_url', 'images', 'lon', 'lat', 'card_fingerprint',
+)
+
+
+def index_path(path):
+    """The CDXJ index belonging to an archive: x.warc.gz -> x.cdxj."""
+    base = path[:-3] if path.endswith('.gz') else path
+    return os.path.splitext(base)[0] + '.cdxj'
+
+
+def _headers_block(headers, skip):
+    lines = []
+    for name, values in headers.items():
+        if name in skip:
+            continue
+        for value in values:
+            lines.append(name + b': ' + value)
+    return b'\r\n'.join(lines) + (b'\r\n' if lines else b'')
+
+
+class WarcWriter:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'ab')
+        self.index = open(index_path(path), 'a', encoding='utf-8')
+
+    def write_exchange(self, request, response, fingerprint, extra=None):
+        """Write request, response and metadata records; index the response."""
+        date = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        response_id = f'<urn:uuid:{uuid.uuid4()}>'
+
+        path = request.url.split('://', 1)[-1]
+        path = path[path.find('/'):] if '/' in path else '/'
+        request_block = (f'{request.method} {path} HTTP/1.1\r\n'.encode()
+                         + _headers_block(request.headers, PRIVATE_HEADERS) + b'\r\n' + (request.body or b''))
+        status_line = f'HTTP/1.1 {response.status} {to_unicode(RESPONSES.get(response.status, b""))}'.rstrip()
+        response_block = (status_line.encode() + b'\r\n'
+                          + _headers_block(response.headers, TRANSFER_HEADERS) + b'\r\n' + response.body)
+        metadata = {'fingerprint': fingerprint, 'method': request.method}
+        metadata.update(extra or {})
+
+        offset = self.file.tell()
+        length = self._write_record('response', response.url, date, response_id,
+                                    'application/http; msgtype=response', response_block)
+        self._write_record('request', request.url, date, None, 'application/http; msgtype=request',
+                           request_block, concurrent_to=response_id)
+        self._write_record('metadata', response.url, date, None, 'application/json',
+                           json.dumps(metadata, ensure_ascii=False).encode(), concurrent_to=response_id)
+        self.index.write(f"{fingerprint} " + json.dumps({
+            'url': request.url, 'method': request.method, 'status': response.status,
+            'offset': offset, 'length': length,
+            'spider': metadata.get('spider'), 'callback': metadata.get('callback'), 'meta': metadata.get('meta', {}),
+        }, ensure_ascii=False) + '\n')
+
+    def _write_record(self, record_type, url, date, record_id, content_type, block, concurrent_to=None):
+        headers = [
+            'WARC/1.0',
+            f'WARC-Type: {record_type}',
+            f'WARC-Record-ID: {record_id or f"<urn:uuid:{uuid.uuid4()}>"}',
+            f'WARC-Date: {date}',
+            f'WARC-Target-URI: {url}',
+        ]
+        if concurrent_to:
+            headers.append(f'WARC-Concurrent-To: {concurrent_to}')
+        headers += [f'Content-Type: {content_type}', f'Content-Length: {len(block)}']
+        data = gzip.compress('\r\n'.join(headers).encode() + b'\r\n\r\n' + block + b'\r\n\r\n', compresslevel=6)
+        self.file.write(data)
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+
+class WarcArchive:
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        with open(index_path(path), encoding='utf-8') as f:
+            for line in f:
+                fingerprint, _, entry = line.partition(' ')
+                self.records.setdefault(fingerprint, []).append(json.loads(entry))
+        self.file = open(path, 'rb')
+
+    def entries(self):
+        for fingerprint, entries in self.records.items():
+            for entry in entries:
+                yield fingerprint, entry
+
+    def read(self, entry):
+        """(status, headers, body, url) of the response record at an index entry."""
+        self.file.seek(entry['offset'])
+        record = gzip.decompress(self.file.read(entry['length']))
+        _, _, content = record.partition(b'\r\n\r\n')
+        http_head, _, body = content[:-4].partition(b'\r\n\r\n')
+        status_line, *header_lines = http_head.split(b'\r\n')
+        headers = Headers()
+        for line in header_lines:
+            name, _, value = line.partition(b':')
+            headers.appendlist(name.strip(), value.strip())
+        return int(status_line.split()[1]), headers, body, entry['url']
+
+    def close(self):
+        self.file.close()
+
+
+class WarcReplayDownloadHandler:
+    lazy = False
+
+    def __init__(self, crawler):
+        path = crawler.settings.get('WARC_REPLAY')
+        if not path:
+            raise NotConfigured
+        self.stats = crawler.stats
+        self.fingerprinter = crawler.request_fingerprinter
+        self.archive = WarcArchive(path)
+        self.served = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def download_request(self, request, spider):
+        fingerprint = self.fingerprinter.fingerprint(request).hex()
+        entries = self.archive.records.get(fingerprint)
+        if not entries:
+            self.stats.inc_value('warc/replay_miss')
+            return defer.fail(IgnoreRequest(f"Not in WARC archive: {request.url}"))
+        n = self.served.get(fingerprint, 0)
+        self.served[fingerprint] = n + 1
+        status, headers, body, url = self.archive.read(entries[min(n, len(entries) - 1)])
+        self.stats.inc_value('warc/replay_hit')
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return defer.succeed(respcls(url=url, status=status, headers=headers, body=body,
+                                     request=request, flags=['warc']))
+
+    def close(self):
+        self.archive.close()
+
+
+def capture_extra(request, spider):
+    """Metadata stored next to a captured response."""
+    proxy = request.meta.get('proxy')
+    return {
+        'spider': spider.name,
+        'callback': getattr(request.callback, '__name__', None) or 'parse',
+        'proxy': proxy_label(proxy) if proxy else None,
+        'download_latency': request.meta.get('download_latency'),
+        'meta': {k: request.meta[k] for k in META_KEYS if k in request.meta},
+    }
+
+
+def replay_settings(settings, archive):
+    """Settings that make a crawl read from `archive` instead of the network."""
+    handler = 'aidid_house.warc.WarcReplayDownloadHandler'
+    return {
+        'EXTENSIONS': {**settings.getdict('EXTENSIONS'), 'scrapeops_scrapy.extension.ScrapeOpsMonitor': None},
+        'WARC_REPLAY': archive,
+        'DOWNLOAD_HANDLERS': {'http': handler, 'https': handler},
+        'HTTPCACHE_ENABLED': False,
+        'PROXY_POOL_ENABLED': False,
+        'ADAPTIVE_CONCURRENCY_ENABLED': False,
+        'WARC_CAPTURE_DIR': None,
+        'RUN_LEDGER_ENABLED': False,
+        'SCRAPEOPS_FAKE_BROWSER_HEADER_ENABLED': False,
+        'CONCURRENT_REQUESTS': 64,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 64,
+    }
+
+
+def main():
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    parser = argparse.ArgumentParser(description="Run a spider against a captured WARC archive.")
+    parser.add_argument('spider')
+    parser.add_argument('archive')
+    parser.add_argument('--no-pipelines', action='store_true', help="do not write items to Postgres")
+    parser.add_argument('-a', dest='spider_args', action='append', default=[], metavar='NAME=VALUE')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE')
+    args = parser.parse_args()
+
+    settings = get_project_settings()
+    settings.setdict(replay_settings(settings, args.archive), priority='cmdline')
+    if args.no_pipelines:
+        settings.set('ITEM_PIPELINES', {}, priority='cmdline')
+    for override in args.set:
+        name, _, value = override.partition('=')
+        settings.set(name, value, priority='cmdline')
+
+    process = CrawlerProcess(settings)
+    process.crawl(args.spider, **dict(a.partition('=')[::2] for a in args.spider_args))
+    process.start()
+
+
+if __name__ == '__main__':
+    main()
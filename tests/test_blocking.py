@@ -0,0 +1,83 @@
+import pytest
+from scrapy.http import HtmlResponse, Request, TextResponse
+
+from aidid_house.blocking import CAPTCHA_MAX_SIZE, classify_block
+
+URL = 'https://www.rakuya.com.tw/sell/result?city=0'
+PAGE = b'<html><body><script>window.sellSearch = {"items": []};</script></body></html>'
+
+
+def _response(body=PAGE, status=200, url=URL, headers=None, **meta):
+    request = Request(URL, meta=meta)
+    return HtmlResponse(url, status=status, body=body, headers=headers, request=request), request
+
+
+@pytest.mark.parametrize('status', [403, 429])
+def test_block_statuses(status):
+    response, request = _response(status=status)
+    assert classify_block(response, request) == f'status_{status}'
+
+
+def test_real_page_passes():
+    response, request = _response(block_expect='window.sellSearch')
+    assert classify_block(response, request) is None
+
+
+def test_other_errors_are_not_blocks():
+    response, request = _response(b'', status=500)
+    assert classify_block(response, request) is None
+
+
+def test_redirect_to_front_page():
+    response, request = _response(url='https://www.rakuya.com.tw/', redirect_urls=[URL])
+    assert classify_block(response, request) == 'redirect_home'
+
+
+def test_redirect_between_deep_links_is_fine():
+    response, request = _response(url='https://www.rakuya.com.tw/sell/result?city=1', redirect_urls=[URL])
+    assert classify_block(response, request) is None
+
+
+def test_empty_body():
+    response, request = _response(b'  \n ')
+    assert classify_block(response, request) == 'empty'
+
+
+def test_small_captcha_page():
+    response, request = _response(b'<html><title>Access Denied</title>captcha required</html>')
+    assert classify_block(response, request) == 'captcha'
+
+
+def test_large_page_mentioning_recaptcha_is_real():
+    body = PAGE + b'<script src="https://www.google.com/recaptcha/api.js"></script>' + b' ' * CAPTCHA_MAX_SIZE
+    response, request = _response(body, block_expect='window.sellSearch')
+    assert classify_block(response, request) is None
+
+
+def test_missing_expected_text_is_an_empty_shell():
+    response, request = _response(b'<html><body>loading...</body></html>', block_expect='window.sellSearch')
+    assert classify_block(response, request) == 'empty_shell'
+
+
+@pytest.mark.parametrize('body, block', [
+    (b'{"data": {"items": []}}', None),
+    (b'[1, 2]', None),
+    (b'{"data": {"items": [', 'truncated_json'),
+    (b'<html>oops</html>', 'truncated_json'),
+])
+def test_expected_json(body, block):
+    request = Request(URL, meta={'block_expect_json': True})
+    response = TextResponse(URL, body=body, encoding='utf-8', request=request)
+    assert classify_block(response, request) is block
+
+
+def test_compressed_body_is_not_judged():
+    response, request = _response(b'\x1f\x8b\x08\x00', headers={'Content-Encoding': 'gzip'})
+    assert classify_block(response, request) is None
+
+
+def test_without_request_only_status_and_body_count():
+    response, _ = _response(b'<html><body>loading...</body></html>')
+    assert classify_block(response) is None
+    response, _ = _response(status=429)
+    assert classify_block(response) == 'status_429'
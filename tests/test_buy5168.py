@@ -0,0 +1,59 @@
+import json
+import os
+
+import pytest
+from scrapy.http import HtmlResponse, Request
+
+from aidid_house.spiders.buy5168 import Buy5168Spider
+
+# Real BuyCaseDetail responses with the case page of the same listing, see
+# tests/fixtures/README.md.
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'houseprice')
+CASES = sorted(name[:-len('.json')] for name in os.listdir(FIXTURES)
+               if name.endswith('.json') and os.path.exists(os.path.join(FIXTURES, name[:-len('.json')] + '.html')))
+# Item fields both sources carry.
+FIELDS = ('name', 'address', 'district', 'price', 'space', 'floors', 'layout', 'age',
+          'latitude', 'longitude', 'community', 'images', 'features')
+
+captured = pytest.mark.skipif(not CASES, reason="no captured houseprice cases in tests/fixtures/houseprice")
+
+
+def case_url(case_id):
+    return f"https://buy.houseprice.tw/house/{case_id}"
+
+
+def api_item(case_id):
+    with open(os.path.join(FIXTURES, f'{case_id}.json'), encoding='utf-8') as f:
+        return Buy5168Spider.api_item(json.load(f), case_url(case_id), '台北市')
+
+
+def page_item(case_id):
+    with open(os.path.join(FIXTURES, f'{case_id}.html'), 'rb') as f:
+        body = f.read()
+    request = Request(case_url(case_id), meta={'city': '台北市'})
+    return next(Buy5168Spider().parse_case(HtmlResponse(request.url, body=body, encoding='utf-8', request=request)))
+
+
+@captured
+@pytest.mark.parametrize('case_id', CASES)
+def test_api_item_complete(case_id):
+    item = api_item(case_id)
+    assert item is not None, "BuyCaseDetail response lacks name, address or price under the pinned keys"
+    for field in FIELDS:
+        assert item[field] not in (None, '', []), field
+
+
+@captured
+@pytest.mark.parametrize('case_id', CASES)
+def test_api_item_matches_case_page(case_id):
+    from_api, from_page = api_item(case_id), page_item(case_id)
+    for field in FIELDS:
+        assert from_api[field] == from_page[field], field
+
+
+def test_case_pages_by_default():
+    assert not Buy5168Spider().case_api_enabled()
+    spider = Buy5168Spider(case_api_max_misses='20')
+    assert spider.case_api_enabled()
+    spider.case_api_misses = 20
+    assert not spider.case_api_enabled()
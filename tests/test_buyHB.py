@@ -0,0 +1,60 @@
+import json
+import os
+import re
+
+import pytest
+from scrapy.http import Request, TextResponse
+from scrapy.utils.test import get_crawler
+
+from aidid_house.delta import fingerprint
+from aidid_house.items import HouseUpdateItem
+from aidid_house.spiders.buyHB import CARD_KEYS, BuyHBSpider
+
+# Real dataService.aspx search responses, see tests/fixtures/README.md.
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'hbhousing')
+SEARCHES = sorted(name for name in os.listdir(FIXTURES) if name.endswith('.json'))
+SEARCH_URL = 'https://www.hbhousing.com.tw/ajax/dataService.aspx?job=search&path=house&kv=false'
+
+captured = pytest.mark.skipif(not SEARCHES, reason="no captured HB searches in tests/fixtures/hbhousing")
+
+
+def search(body):
+    request = Request(SEARCH_URL, method='POST', meta={'page_number': 1})
+    return TextResponse(SEARCH_URL, body=body, encoding='utf-8', request=request)
+
+
+def spider(existing_cards=None):
+    spider = BuyHBSpider.from_crawler(get_crawler(BuyHBSpider))
+    spider.existing_cards = existing_cards or {}
+    return spider
+
+
+@captured
+@pytest.mark.parametrize('name', SEARCHES)
+def test_card_keys_hold_name_total_price_and_area(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        houses = json.load(f)['data']
+    assert houses
+    for house in houses:
+        card = {field: house.get(key) for field, key in CARD_KEYS.items()}
+        assert isinstance(card['title'], str) and card['title'].strip(), card
+        # Total price in 萬 and area in 坪: plain numbers, not unit prices.
+        assert re.fullmatch(r'\d[\d,]*(\.\d+)?', str(card['price'])), card
+        assert 50 <= float(str(card['price']).replace(',', '')) <= 500000, card
+        assert 1 <= float(card['area']) <= 3000, card
+
+
+def test_known_listing_refetched_only_when_its_card_changed_or_is_unreadable():
+    cards = {sn: {'n': f'房屋 {sn}', 'np': 2880, 'a': 35.2} for sn in ('a1', 'b2', 'c3')}
+    cards['b2']['np'] = 2780
+    cards['c3'] = {'s': 'c3'}
+    s = spider({f'https://www.hbhousing.com.tw/detail/?sn={sn}': fingerprint({'title': f'房屋 {sn}', 'price': 2880,
+                                                                               'area': 35.2})
+                for sn in cards})
+    s.existing_urls = set(s.existing_cards)
+    body = json.dumps({'data': [{'s': sn, **card} for sn, card in cards.items()]}, ensure_ascii=False)
+    output = list(s.parse_page(search(body)))
+    updates = [o for o in output if isinstance(o, HouseUpdateItem)]
+    fetched = [o.meta['case_url'].rsplit('=', 1)[1] for o in output if isinstance(o, Request)]
+    assert len(updates) == 3
+    assert fetched == ['b2', 'c3']
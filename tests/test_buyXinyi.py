@@ -0,0 +1,91 @@
+import json
+import os
+import re
+
+import pytest
+from scrapy.http import HtmlResponse, Request
+
+from aidid_house.spiders.buyXinyi import CASE_CHECKS, CASE_XPATHS, BuyxinyiSpider
+
+# Real detail pages, see tests/fixtures/README.md.
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'sinyi')
+PAGES = sorted(name for name in os.listdir(FIXTURES) if name.endswith('.html'))
+NEXT_DATA = re.compile(rb'<script[^>]*id=["\']?__NEXT_DATA__["\']?[^>]*>.*?</script>', re.S)
+
+captured = pytest.mark.skipif(not PAGES, reason="no captured Sinyi pages in tests/fixtures/sinyi")
+
+
+def page(name, body=None):
+    if body is None:
+        with open(os.path.join(FIXTURES, name), 'rb') as f:
+            body = f.read()
+    url = f"https://www.sinyi.com.tw/buy/house/{name[:-len('.html')]}/"
+    return HtmlResponse(url, body=body, encoding='utf-8', request=Request(url))
+
+
+def case_item(response):
+    return next(BuyxinyiSpider().parse_case_page(response))
+
+
+def state_fields(response):
+    data = json.loads(response.xpath('//script[@id="__NEXT_DATA__"]/text()').get())
+    buy_reducer = data['props']['initialReduxState']['buyReducer']
+    return BuyxinyiSpider.state_fields(buy_reducer.get('contentData', {}), buy_reducer.get('detailData', {}))
+
+
+@captured
+@pytest.mark.parametrize('name', PAGES)
+def test_state_fields_pass_checks(name):
+    fields = state_fields(page(name))
+    assert fields, "no listing fields found in __NEXT_DATA__"
+    for field, value in fields.items():
+        assert CASE_CHECKS[field](value), (field, value)
+
+
+@captured
+@pytest.mark.parametrize('name', PAGES)
+def test_state_fields_match_page(name):
+    # The raw state values, before CASE_CHECKS could send a field to XPath.
+    response = page(name)
+    for field, value in state_fields(response).items():
+        assert value == CASE_XPATHS[field](response), field
+
+
+@captured
+@pytest.mark.parametrize('name', PAGES)
+def test_json_and_xpath_items_match(name):
+    response = page(name)
+    from_json = case_item(response)
+    from_xpath = case_item(page(name, NEXT_DATA.sub(b'', response.body)))
+    for field in (*CASE_XPATHS, 'city', 'district'):
+        assert from_json[field] == from_xpath[field], field
+
+
+@pytest.mark.parametrize('field, value', [
+    ('price', '2880萬'),
+    ('price', '12,800 萬'),
+    ('space', '35.27坪'),
+    ('age', '12.5年'),
+    ('floors', '5/12樓'),
+    ('floors', 'B1/12樓'),
+    ('address', '台北市大安區復興南路一段100號'),
+])
+def test_checks_accept_page_formats(field, value):
+    assert CASE_CHECKS[field](value)
+
+
+@pytest.mark.parametrize('field, value', [
+    ('price', '65.3萬/坪'),       # unit price
+    ('price', '28800000元'),      # total in 元
+    ('price', '2880'),            # no unit
+    ('price', '3萬'),             # not a house price
+    ('price', 2880),
+    ('space', '116.6m²'),
+    ('space', '35.27'),
+    ('space', '8000坪'),
+    ('age', '1988'),
+    ('floors', '5'),
+    ('address', '復興南路一段100號'),
+])
+def test_checks_reject_other_figures(field, value):
+    assert not CASE_CHECKS[field](value)
@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+from parsel import Selector
+from scrapy.utils.test import get_crawler
+
+from aidid_house.delta import card_update, fingerprint, known_cases, list_card
+
+
+def _card(html):
+    return Selector(text=f'<div class="card">{html}</div>').css('div.card')[0]
+
+
+def _spider(existing_urls=(), existing_cards=None):
+    return SimpleNamespace(existing_urls=set(existing_urls), existing_cards=existing_cards or {},
+                           crawler=get_crawler())
+
+
+def test_list_card_reads_title_price_and_area():
+    card = _card('<h3 class="title"> 信義區 三房車位 </h3><span>2,880 萬</span><span>35.2 坪</span>')
+    assert list_card(card) == {'title': '信義區 三房車位', 'price': '2880', 'area': '35.2'}
+
+
+def test_list_card_reads_the_total_price_element():
+    card = _card('<h3>三房</h3><span class="unit-price">81.8萬/坪</span>'
+                 '<div class="price"><del>2,980萬</del> <b>2,880</b>萬</div><span>35.2坪</span>')
+    assert list_card(card)['price'] == '2880'
+
+
+def test_list_card_skips_unit_and_struck_prices_without_price_element():
+    card = _card('<h3>三房</h3><span>81.8 萬/坪</span><s>2,980萬</s><span>2,880萬</span><span>35.2坪</span>')
+    assert list_card(card)['price'] == '2880'
+    card = _card('<h3>三房</h3><span>81.8萬元/坪</span>')
+    assert list_card(card)['price'] is None
+
+
+def test_list_card_with_spider_price_xpath():
+    card = _card('<h3>三房</h3><em>特價</em><span>1,000萬</span><p class="total">2,880萬</p>')
+    assert list_card(card, './/p[@class="total"]//text()')['price'] == '2880'
+
+
+def test_list_card_without_fields():
+    assert list_card(_card('<p>no details</p>')) == {'title': None, 'price': None, 'area': None}
+
+
+def test_fingerprint_is_stable_and_sensitive():
+    card = {'title': 'A', 'price': '2880', 'area': '35.2'}
+    assert fingerprint(card) == fingerprint(dict(reversed(list(card.items()))))
+    assert fingerprint(card) != fingerprint({**card, 'price': '2780'})
+    assert len(fingerprint(card)) == 16
+
+
+def test_fingerprint_of_empty_card_is_none():
+    assert fingerprint({'title': None, 'price': None, 'area': None}) is None
+    assert fingerprint({'title': '', 'price': None, 'area': None}) is None
+
+
+def test_card_update_unchanged_and_first_seen():
+    card = {'title': 'A', 'price': '2880', 'area': '35.2'}
+    url = 'https://buy.yungching.com.tw/house/1'
+    spider = _spider([url], {url: fingerprint(card)})
+    update, changed = card_update(spider, url, card)
+    assert not changed and update['card_fingerprint'] == fingerprint(card)
+    update, changed = card_update(_spider([url]), url, card)
+    assert not changed and update['card_fingerprint'] == fingerprint(card)
+
+
+def test_card_update_changed_keeps_stored_fingerprint():
+    url = 'https://buy.yungching.com.tw/house/1'
+    spider = _spider([url], {url: fingerprint({'title': 'A', 'price': '2880', 'area': '35.2'})})
+    update, changed = card_update(spider, url, {'title': 'A', 'price': '2780', 'area': '35.2'})
+    assert changed and 'card_fingerprint' not in update
+    assert spider.crawler.stats.get_value('delta/card_changed') == 1
+
+
+def test_known_cases_index():
+    spider = _spider(['https://buy.houseprice.tw/house/ab12', 'https://buy.yungching.com.tw/house/9'])
+    assert known_cases(spider, r'buy\.houseprice\.tw/house/(\w+)') == {'ab12': 'https://buy.houseprice.tw/house/ab12'}
+
+
+def test_unreadable_card_is_refetched():
+    url = 'https://buy.yungching.com.tw/house/1'
+    spider = _spider([url], {url: fingerprint({'title': 'A', 'price': '2880', 'area': '35.2'})})
+    update, changed = card_update(spider, url, {'title': None, 'price': None, 'area': None})
+    assert changed and 'card_fingerprint' not in update
+    assert spider.crawler.stats.get_value('delta/card_unreadable') == 1
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+from scrapy.http import HtmlResponse, Request
+
+from aidid_house import embedded
+from aidid_house.embedded import EmbeddedState, embedded_state
+
+NEXT_DATA = {'props': {'pageProps': {'title': '信義區三房', 'price': 2880}}}
+
+
+def _page(*scripts):
+    return ('<html><head>' + ''.join(scripts) + '</head><body><p>x</p></body></html>').encode('utf-8')
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def decoder(request, monkeypatch):
+    # Every test runs with orjson and with the stdlib fallback.
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(embedded, 'orjson', None)
+    return request.param
+
+
+@pytest.mark.parametrize('tag', [
+    '<script id="__NEXT_DATA__" type="application/json">',
+    "<script id='__NEXT_DATA__' type='application/json'>",
+    '<script id=__NEXT_DATA__ type=application/json>',
+    '<script type="application/json"\n  ID = "__NEXT_DATA__" >',
+])
+def test_script_id_quoting(decoder, tag):
+    state = EmbeddedState(_page(tag + json.dumps(NEXT_DATA, ensure_ascii=False) + '</script>'))
+    assert state.script_json('__NEXT_DATA__') == NEXT_DATA
+
+
+def test_window_variables(decoder):
+    state = EmbeddedState(_page(
+        '<script>window.sellSearch = {"total": 3, "items": [1, 2, 3]};\n'
+        'window.tmpDataLayer={"city":"台北市"}; var other = 1;</script>',
+        '<script src="/app.js"></script>',
+    ))
+    assert state.window_var('sellSearch') == {'total': 3, 'items': [1, 2, 3]}
+    assert state.window_var('tmpDataLayer') == {'city': '台北市'}
+    assert state.window_var('missing') is None
+
+
+def test_comparison_is_not_an_assignment(decoder):
+    state = EmbeddedState(_page('<script>if (window.sellSearch == null) {}</script>'))
+    assert state.window_var('sellSearch') is None
+
+
+def test_escaped_script_end_inside_json_strings(decoder):
+    # Serializers escape "</script>" inside strings, so the block ends at the real tag.
+    blob = '{"html": "<b>a<\\/script>b</b>", "note": "\\u003c/script\\u003e"}'
+    state = EmbeddedState(_page(f'<script id="__NEXT_DATA__">{blob}</script>',
+                                '<script>window.itemContact = {"tag": "<\\/script>"};</script>'))
+    assert state.script_json('__NEXT_DATA__') == {'html': '<b>a</script>b</b>', 'note': '</script>'}
+    assert state.window_var('itemContact') == {'tag': '</script>'}
+
+
+def test_raw_script_end_inside_json_cuts_the_block(decoder):
+    # As in a browser, an unescaped "</script>" ends the block: the blob is invalid.
+    state = EmbeddedState(_page('<script id="__NEXT_DATA__">{"html": "</script>"}</script>'))
+    with pytest.raises(ValueError):
+        state.script_json('__NEXT_DATA__')
+
+
+def test_missing_and_unclosed_tags(decoder):
+    assert EmbeddedState(b'<html><body>no scripts</body></html>').script_json('__NEXT_DATA__') is None
+    assert EmbeddedState(b'<html><script id="__NEXT_DATA__">{"a": 1}').script_json('__NEXT_DATA__') is None
+    assert EmbeddedState(b'<html><script id="__NEXT_DATA__"').script_json('__NEXT_DATA__') is None
+    assert EmbeddedState(b'').window_var('sellSearch') is None
+
+
+def test_ld_json_skips_invalid_blocks(decoder):
+    state = EmbeddedState(_page(
+        '<script type="application/ld+json">{"@type": "Product", "name": "A"}</script>',
+        '<script type="application/ld+json">{broken</script>',
+        '<script type="application/ld+json">[{"@type": "Place"}]</script>',
+    ))
+    assert state.ld_json() == [{'@type': 'Product', 'name': 'A'}, [{'@type': 'Place'}]]
+
+
+def test_state_is_cached_per_response():
+    url = 'https://www.sinyi.com.tw/buy/house/1'
+    body = _page('<script id="__NEXT_DATA__">' + json.dumps(NEXT_DATA) + '</script>')
+    response = HtmlResponse(url, body=body, encoding='utf-8', request=Request(url))
+    state = embedded_state(response)
+    assert embedded_state(response) is state
+    assert state.script_json('__NEXT_DATA__') is state.script_json('__NEXT_DATA__')
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+from twisted.internet import defer, threads
+
+from aidid_house.headers import HeaderPool
+from aidid_house.mocksite import MockSite, MockSiteServer
+
+
+def _serve(site):
+    server = MockSiteServer(('127.0.0.1', 0), site)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f'http://{host}:{port}/headers.scrapeops.io/v1/browser-headers'
+
+
+@pytest.fixture
+def mock_endpoint():
+    server, endpoint = _serve(MockSite(latency=0))
+    yield endpoint
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def failing_endpoint():
+    server, endpoint = _serve(MockSite(latency=0, error_rate=1.0))
+    yield endpoint
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sync_threads(monkeypatch):
+    # Run deferToThread inline so refresh_in_background settles without a reactor.
+    monkeypatch.setattr(threads, 'deferToThread', lambda f, *a, **kw: defer.maybeDeferred(f, *a, **kw))
+
+
+def _pool(endpoint, tmp_path, ttl=3600):
+    pool = HeaderPool(endpoint, 'test-key', 5, str(tmp_path / 'headers.json'), ttl, timeout=5)
+    pool.load()
+    return pool
+
+
+def test_starts_from_bundled_list_without_cache(mock_endpoint, tmp_path):
+    pool = _pool(mock_endpoint, tmp_path)
+    assert pool.source == 'fallback'
+    assert pool.headers and pool.is_stale()
+
+
+def test_refresh_replaces_pool_and_writes_cache(mock_endpoint, tmp_path, sync_threads):
+    pool = _pool(mock_endpoint, tmp_path)
+    pool.refresh_in_background()
+    assert pool.source == 'api'
+    assert pool.refreshing is None
+    assert len(pool.headers) == 5
+    assert pool.headers[0]['user-agent'].endswith('MockBrowser/0.0')
+    assert not pool.is_stale()
+
+    # The next process starts from the cache file, not the bundled list.
+    cached = _pool(mock_endpoint, tmp_path)
+    assert cached.source == 'cache'
+    assert cached.headers == pool.headers
+    assert not cached.is_stale()
+
+
+def test_failed_refresh_keeps_fallback(failing_endpoint, tmp_path, sync_threads):
+    pool = _pool(failing_endpoint, tmp_path)
+    bundled = list(pool.headers)
+    pool.refresh_in_background()
+    assert pool.source == 'fallback'
+    assert pool.headers == bundled
+    assert pool.refreshing is None
+    assert not (tmp_path / 'headers.json').exists()
+
+
+def test_failed_refresh_keeps_stale_cache(mock_endpoint, failing_endpoint, tmp_path, sync_threads):
+    _pool(mock_endpoint, tmp_path).refresh_in_background()
+    pool = _pool(failing_endpoint, tmp_path, ttl=0)
+    # The cache was written for another endpoint, so it is not reused.
+    assert pool.source == 'fallback'
+
+    pool = _pool(mock_endpoint, tmp_path, ttl=0)
+    assert pool.source == 'cache' and pool.is_stale()
+    cached = list(pool.headers)
+    pool.endpoint = failing_endpoint
+    pool.refresh_in_background()
+    assert pool.source == 'cache'
+    assert pool.headers == cached
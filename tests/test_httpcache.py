@@ -0,0 +1,66 @@
+import time
+
+import pytest
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.settings import Settings
+
+from aidid_house.httpcache import STORED_AT_HEADER, EndpointTTLPolicy
+
+LIST = 'https://buy.yungching.com.tw/list/台北市-_c/?pg=2'
+POI = 'https://buy.yungching.com.tw/api/v2/information/poi?id=1'
+DETAIL = 'https://buy.yungching.com.tw/house/12345'
+
+
+@pytest.fixture
+def policy():
+    return EndpointTTLPolicy(Settings({'HTTPCACHE_TTL_POLICIES': [
+        (r'buy\.yungching\.com\.tw/api/v2/information/poi', 7 * 24 * 3600),
+        (r'buy\.yungching\.com\.tw/list/', 3600),
+        (r'buy\.yungching\.com\.tw/', 60),
+    ]}))
+
+
+def _cached(url, age, **headers):
+    headers[STORED_AT_HEADER] = str(time.time() - age)
+    return HtmlResponse(url, body=b'<html>listing</html>', headers=headers)
+
+
+def test_first_matching_pattern_wins(policy):
+    assert policy.ttl(Request(POI)) == 7 * 24 * 3600
+    assert policy.ttl(Request(LIST)) == 3600
+    assert policy.ttl(Request(DETAIL)) == 60
+    assert policy.ttl(Request('https://www.sinyi.com.tw/buy/list/')) is None
+
+
+def test_only_listed_endpoints_are_cached(policy):
+    assert policy.should_cache_request(Request(LIST))
+    assert not policy.should_cache_request(Request('https://www.sinyi.com.tw/buy/list/'))
+
+
+def test_block_pages_and_errors_are_not_stored(policy):
+    request = Request(LIST)
+    assert policy.should_cache_response(HtmlResponse(LIST, body=b'<html>listing</html>'), request)
+    assert not policy.should_cache_response(HtmlResponse(LIST, status=403, body=b'denied'), request)
+    assert not policy.should_cache_response(HtmlResponse(LIST, body=b'<html>captcha</html>'), request)
+    assert not policy.should_cache_response(Response(LIST, status=500), request)
+
+
+def test_fresh_entry_is_served(policy):
+    request = Request(LIST)
+    assert policy.is_cached_response_fresh(_cached(LIST, 60), request)
+    assert b'If-None-Match' not in request.headers
+
+
+def test_stale_entry_is_revalidated(policy):
+    request = Request(LIST)
+    cached = _cached(LIST, 7200, ETag='"v1"', **{'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+    assert not policy.is_cached_response_fresh(cached, request)
+    assert request.headers[b'If-None-Match'] == b'"v1"'
+    assert request.headers[b'If-Modified-Since'] == b'Mon, 01 Jan 2024 00:00:00 GMT'
+
+
+def test_only_not_modified_keeps_the_entry(policy):
+    request = Request(LIST)
+    cached = _cached(LIST, 7200)
+    assert policy.is_cached_response_valid(cached, Response(LIST, status=304), request)
+    assert not policy.is_cached_response_valid(cached, Response(LIST, status=200), request)
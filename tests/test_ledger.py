@@ -0,0 +1,33 @@
+from aidid_house.ledger import check, coverage
+
+
+def _run(items_per_sec, new=0, updated=0, unchanged=0, items=0):
+    return {'items_per_sec': items_per_sec, 'items_new': new, 'items_updated': updated,
+            'items_unchanged': unchanged, 'items': items}
+
+
+def test_steady_runs_pass():
+    runs = [_run(9.5, new=10, unchanged=950)] + [_run(10, new=5, unchanged=1000)] * 5
+    assert check(runs, 0.3) == []
+
+
+def test_throughput_drop_is_flagged():
+    runs = [_run(5, unchanged=1000), _run(10, unchanged=1000), _run(12, unchanged=1000), _run(9, unchanged=1000)]
+    assert check(runs, 0.3) == [('items_per_sec', 10, 5, -0.5)]
+
+
+def test_coverage_drop_is_flagged():
+    runs = [_run(10, unchanged=400), _run(10, unchanged=1000), _run(10, new=100, updated=50, unchanged=850)]
+    assert check(runs, 0.3) == [('coverage', 1000, 400, -0.6)]
+
+
+def test_coverage_falls_back_to_items():
+    assert coverage(_run(1, items=70)) == 70
+    assert coverage(_run(1, new=3, updated=2, unchanged=5, items=70)) == 10
+    assert coverage({'items_new': None, 'items_updated': None, 'items_unchanged': None, 'items': None}) == 0
+
+
+def test_missing_values_and_history_are_skipped():
+    assert check([_run(None, unchanged=900), _run(10, unchanged=1000)], 0.3) == []
+    assert check([_run(1, unchanged=10)], 0.3) == []
+    assert check([_run(1, unchanged=10), _run(None, unchanged=0)], 0.3) == []
@@ -0,0 +1,27 @@
+from aidid_house.liveness import delist_domains, in_domains
+
+
+def test_all_shards_saw_listings():
+    reported = {'north': (['www.sinyi.com.tw'], 120), 'south': (['www.sinyi.com.tw'], 80)}
+    assert delist_domains(['north', 'south'], reported) == ['www.sinyi.com.tw']
+
+
+def test_empty_shard_blocks_delisting_on_shared_domain():
+    # south was blocked: its listings must not be delisted because north saw the domain.
+    reported = {'north': (['www.sinyi.com.tw'], 120), 'south': ([], 0)}
+    assert delist_domains(['north', 'south'], reported) == []
+
+
+def test_shard_without_live_count_counts_as_empty():
+    reported = {'north': (['www.sinyi.com.tw'], 120), 'south': (['www.sinyi.com.tw'], None)}
+    assert delist_domains(['north', 'south'], reported) == []
+
+
+def test_per_site_shards_union_domains():
+    reported = {'buyXinyi': (['www.sinyi.com.tw'], 3), 'buyRakuya': (['www.rakuya.com.tw'], 5)}
+    assert delist_domains(['buyRakuya', 'buyXinyi'], reported) == ['www.rakuya.com.tw', 'www.sinyi.com.tw']
+
+
+def test_in_domains_matches_subdomains_only():
+    assert in_domains('https://buy.houseprice.tw/house/1', ['houseprice.tw'])
+    assert not in_domains('https://nothouseprice.tw/house/1', ['houseprice.tw'])
@@ -0,0 +1,79 @@
+import json
+import logging
+from types import SimpleNamespace
+
+from scrapy.settings import Settings
+
+from aidid_house import logs
+from aidid_house.logs import EventLog, JsonFormatter
+
+
+def _events(**settings):
+    return EventLog(Settings({'LOG_RATE_LIMIT': 0, **settings}))
+
+
+def test_default_sampling_shares():
+    events = _events()
+    assert all(not events.allow('buyHB', 'headers', logging.DEBUG) for _ in range(50))
+    assert all(events.allow('buyHB', 'pipeline') for _ in range(50))
+
+
+def test_sampling_rate(monkeypatch):
+    draws = iter([0.05, 0.5, 0.09, 0.95])
+    monkeypatch.setattr(logs.random, 'random', lambda: next(draws))
+    events = _events(LOG_SAMPLING={'page': 0.1})
+    assert [events.allow('buyHB', 'page') for _ in range(4)] == [True, False, True, False]
+    assert events.take_window() == {'page': (4, 2)}
+    assert events.take_window() == {}
+    assert events.totals == {'page': [4, 2]}
+
+
+def test_warnings_and_details_are_always_written():
+    events = _events(LOG_SAMPLING={'listing': 0}, LOG_DETAIL_URLS=['/house/42'], LOG_DETAIL_SPIDERS=['buyXinyi'])
+    assert events.allow('buyHB', 'listing', logging.WARNING)
+    assert events.allow('buyHB', 'listing', url='https://buy.yungching.com.tw/house/42')
+    assert events.allow('buyXinyi', 'listing')
+    assert not events.allow('buyHB', 'listing', url='https://buy.yungching.com.tw/house/43')
+
+
+def test_rate_limit(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(logs.time, 'monotonic', lambda: now[0])
+    events = _events(LOG_RATE_LIMIT=2)
+    assert [events.allow('buyHB', 'pipeline') for _ in range(3)] == [True, True, False]
+    now[0] += 0.5
+    assert events.allow('buyHB', 'pipeline')
+    assert not events.allow('buyHB', 'pipeline')
+
+
+def test_log_formats_fields(caplog):
+    events = _events()
+    logger = logging.getLogger('test_logs')
+    with caplog.at_level(logging.INFO, logger='test_logs'):
+        events.log(logger, 'buyHB', 'pipeline', "Stored", table='master_buyHB', title='三房 車位', note='')
+    record = caplog.records[-1]
+    assert record.getMessage() == 'Stored table=master_buyHB title="三房 車位" note=""'
+    assert record.event == 'pipeline' and record.fields['table'] == 'master_buyHB'
+
+
+def test_json_formatter_merges_event_fields():
+    record = logging.LogRecord('aidid', logging.INFO, __file__, 1, 'Stored', (), None)
+    record.event, record.fields = 'pipeline', {'table': 'master_buyHB', 'message': 'ignored'}
+    record.spider = SimpleNamespace(name='buyHB')
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['event'] == 'pipeline' and entry['table'] == 'master_buyHB'
+    assert entry['message'] == 'Stored' and entry['spider'] == 'buyHB'
+
+
+class FakeCrawler:
+    settings = Settings({'LOG_SAMPLING': {'page': 0.5}})
+
+
+def test_event_log_per_crawler():
+    crawler = FakeCrawler()
+    events = EventLog.of(SimpleNamespace(crawler=crawler))
+    assert EventLog.of(SimpleNamespace(crawler=crawler)) is events
+    assert events.sampling['page'] == 0.5
+    # Without a crawler (benchmarks) every spider shares a default log.
+    assert EventLog.of(SimpleNamespace()) is EventLog.of(SimpleNamespace())
+    assert EventLog.of(SimpleNamespace()) is not events
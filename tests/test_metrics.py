@@ -0,0 +1,63 @@
+from aidid_house.metrics import Registry, timed
+
+
+def test_counter_and_gauge_rendering():
+    registry = Registry()
+    requests = registry.counter('aidid_requests_total', 'Requests sent.', ('spider', 'status'))
+    requests.inc(spider='buyHB', status=200)
+    requests.inc(2, spider='buyHB', status=200)
+    requests.inc(spider='buyHB', status=403)
+    registry.gauge('aidid_queue_depth', 'Scheduler depth.').set(12.5)
+    assert registry.render().splitlines() == [
+        '# HELP aidid_requests_total Requests sent.',
+        '# TYPE aidid_requests_total counter',
+        'aidid_requests_total{spider="buyHB",status="200"} 3',
+        'aidid_requests_total{spider="buyHB",status="403"} 1',
+        '# HELP aidid_queue_depth Scheduler depth.',
+        '# TYPE aidid_queue_depth gauge',
+        'aidid_queue_depth 12.5',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter('aidid_errors_total', 'Errors.', ('message',)).inc(message='a "b"\\c\nd')
+    assert 'aidid_errors_total{message="a \\"b\\"\\\\c\\nd"} 1' in registry.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram('aidid_latency_seconds', 'Latency.', ('spider',), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, spider='buyHB')
+    lines = registry.render().splitlines()[2:]
+    assert lines == [
+        'aidid_latency_seconds_bucket{spider="buyHB",le="0.1"} 2',
+        'aidid_latency_seconds_bucket{spider="buyHB",le="1"} 3',
+        'aidid_latency_seconds_bucket{spider="buyHB",le="+Inf"} 4',
+        'aidid_latency_seconds_sum{spider="buyHB"} 3.65',
+        'aidid_latency_seconds_count{spider="buyHB"} 4',
+    ]
+
+
+def test_empty_metrics_are_skipped_and_collectors_run():
+    registry = Registry()
+    registry.counter('aidid_unused_total', 'Never incremented.')
+    depth = registry.gauge('aidid_depth', 'Depth.')
+    registry.collectors.append(lambda: depth.set(7))
+    text = registry.render()
+    assert 'aidid_unused_total' not in text
+    assert 'aidid_depth 7\n' in text
+
+
+def test_registering_twice_returns_the_same_metric():
+    registry = Registry()
+    assert registry.counter('aidid_x_total', 'X.') is registry.counter('aidid_x_total', 'X.')
+
+
+def test_timed_observes_the_block():
+    registry = Registry()
+    histogram = registry.histogram('aidid_write_seconds', 'Writes.', ('table',))
+    with timed(histogram, table='master_buyHB'):
+        pass
+    assert histogram.values[('master_buyHB',)][0][0] == 1
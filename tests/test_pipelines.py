@@ -0,0 +1,54 @@
+from scrapy.utils.misc import load_object
+from scrapy.utils.test import get_crawler
+
+from aidid_house import pipelines, settings
+from aidid_house.delta import card_update, fingerprint, known_cases
+from aidid_house.spiders.buy5168 import Buy5168Spider
+
+LISTING = 'https://buy.houseprice.tw/house/ab12'
+
+
+class FakeCursor:
+    def __init__(self, tables):
+        self.tables = tables
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        self.rows = []
+        if sql.lstrip().startswith('SELECT'):
+            table = sql.split(' FROM ')[1].split()[0]
+            columns = sql.split('SELECT ')[1].split(' FROM ')[0].split(', ')
+            self.rows = [tuple(row.get(c) for c in columns) for row in self.tables.get(table, [])]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def cursor(self):
+        return FakeCursor(self.tables)
+
+    def commit(self):
+        pass
+
+
+def test_known_listings_survive_every_open_spider(monkeypatch):
+    card = {'title': '三房', 'price': '2880', 'area': '35.2'}
+    tables = {'master_buyxinyi': [{'url': LISTING, 'card_fingerprint': fingerprint(card)}]}
+    monkeypatch.setattr(pipelines, 'acquire', lambda: FakeConnection(tables))
+    spider = Buy5168Spider.from_crawler(get_crawler(Buy5168Spider))
+    for path, _ in sorted(settings.ITEM_PIPELINES.items(), key=lambda kv: kv[1]):
+        pipeline = load_object(path)()
+        if hasattr(pipeline, 'open_spider'):
+            pipeline.open_spider(spider)
+    assert known_cases(spider, r'buy\.houseprice\.tw/house/(\w+)') == {'ab12': LISTING}
+    assert spider.existing_cards == {LISTING: fingerprint(card)}
+    # The refetch of changed cards works off the same index.
+    assert card_update(spider, LISTING, card)[1] is False
+    assert card_update(spider, LISTING, {**card, 'price': '2780'})[1] is True
@@ -0,0 +1,69 @@
+import signal
+
+import pytest
+from scrapy import Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.test import get_crawler
+
+from aidid_house.extensions import SamplingProfiler
+
+
+class FirstSpider(Spider):
+    name = 'first'
+
+
+class SecondSpider(Spider):
+    name = 'second'
+
+
+@pytest.fixture
+def profilers(monkeypatch, tmp_path):
+    monkeypatch.setattr(SamplingProfiler, '_open', [])
+    monkeypatch.setattr(SamplingProfiler, '_handled', set())
+    previous = signal.getsignal(signal.SIGUSR1)
+    settings = {'PROFILER_ENABLED': True, 'PROFILER_MAX_DURATION': 0, 'PROFILER_DIR': str(tmp_path)}
+    opened = []
+    for spidercls in (FirstSpider, SecondSpider):
+        crawler = get_crawler(spidercls, settings)
+        crawler.stats.open_spider(None)
+        profiler = SamplingProfiler.from_crawler(crawler)
+        profiler.spider_opened(spidercls())
+        opened.append((profiler, signal.getsignal(signal.SIGUSR1)))
+    yield opened
+    for profiler, _ in opened:
+        profiler.stop()
+    signal.signal(signal.SIGUSR1, previous)
+
+
+def test_disabled_by_default():
+    with pytest.raises(NotConfigured):
+        SamplingProfiler.from_crawler(get_crawler(FirstSpider))
+
+
+def test_signal_handler_installed_once(profilers):
+    (_, first_handler), (_, second_handler) = profilers
+    assert first_handler is second_handler
+    assert SamplingProfiler._handled == {signal.SIGUSR1}
+
+
+def test_toggle_all_starts_and_stops_every_profiler(profilers, tmp_path):
+    first, second = profilers[0][0], profilers[1][0]
+    assert SamplingProfiler.toggle_all() == ['started', 'started']
+    assert first.running and second.running
+    paths = SamplingProfiler.toggle_all()
+    assert not first.running and not second.running
+    assert [p.rsplit('/', 1)[-1].split('-')[0] for p in paths] == ['first', 'second']
+    assert all(str(tmp_path) in p for p in paths)
+
+
+def test_toggle_all_stops_when_any_is_running(profilers):
+    first, second = profilers[0][0], profilers[1][0]
+    first.start()
+    SamplingProfiler.toggle_all()
+    assert not first.running and not second.running
+
+
+def test_closed_spider_leaves_the_registry(profilers):
+    first, second = profilers[0][0], profilers[1][0]
+    first.spider_closed(first.spider)
+    assert SamplingProfiler._open == [second]
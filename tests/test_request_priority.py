@@ -0,0 +1,36 @@
+from scrapy.http import Request, TextResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from aidid_house.items import RakuyaTradeItem
+from aidid_house.middlewares import RequestPriorityMiddleware
+from aidid_house.settings import REQUEST_TYPE_PRIORITIES
+
+
+def middleware():
+    crawler = get_crawler()
+    return RequestPriorityMiddleware(MemoryStatsCollector(crawler), REQUEST_TYPE_PRIORITIES)
+
+
+def test_requests_get_their_type_priority():
+    mw = middleware()
+    list_page = TextResponse('https://www.rakuya.com.tw/list', body=b'', request=Request('https://www.rakuya.com.tw/list'))
+    out = list(mw.process_spider_output(list_page, [
+        Request('https://www.rakuya.com.tw/a', meta={'request_type': 'detail'}),
+        Request('https://www.rakuya.com.tw/b', meta={'request_type': 'list'}),
+        Request('https://www.rakuya.com.tw/c', meta={'request_type': 'enrichment'}),
+    ], None))
+    assert [r.priority for r in out] == [10, 0, -10]
+    assert 'discovered_at' in out[0].meta
+    assert 'discovered_at' not in out[1].meta
+
+
+def test_trade_items_count_towards_time_to_first_capture():
+    mw = middleware()
+    request = Request('https://www.rakuya.com.tw/realprice/api/info/history?sn=1',
+                      meta={'request_type': 'detail', 'discovered_at': 0.0})
+    history = TextResponse(request.url, body=b'{}', request=request)
+    list(mw.process_spider_output(history, [RakuyaTradeItem(url=request.url)], None))
+    assert mw.ttfc_count == 1
+    mw.spider_closed(None)
+    assert mw.stats.get_value('freshness/ttfc_count') == 1